@@ -1,15 +1,24 @@
 import telebot
 from typing import Dict, List
-from datetime import datetime
+from datetime import datetime, timedelta
 from database import DatabaseManager
-from config import ADMIN_ID, STORE_NAME, CURRENCY
+from config import ADMIN_ID, STORE_NAME, CURRENCY, CLUSTER_WORKERS, WORKER_ID
+from pdf_generator_new import PDFInvoiceGenerator
 from utils import format_currency, sanitize_text, get_current_timestamp
+import keyboards
 
 class AdminPanel:
-    def __init__(self, bot: telebot.TeleBot, db: DatabaseManager):
+    def __init__(self, bot: telebot.TeleBot, db: DatabaseManager, dispatcher=None, states=None, broadcaster=None,
+                 invoices=None):
         self.bot = bot
         self.db = db
+        self.dispatcher = dispatcher
+        self.states = states
+        self.broadcaster = broadcaster
+        self.invoices = invoices
+        self.report_generator = None
         self.admin_id = ADMIN_ID
+        self.products_view = keyboards.CatalogView(db, keyboards.render_products_management)
     
     def is_admin_user(self, user_id: int) -> bool:
         """Check if user is admin"""
@@ -27,31 +36,8 @@ class AdminPanel:
         if not self.is_admin_user(chat_id):
             return
         
-        text = f"""🔧 لوحة تحكم الأدمن - {STORE_NAME}
-
-مرحباً بك في لوحة التحكم
-اختر العملية المطلوبة:"""
-        
-        markup = telebot.types.InlineKeyboardMarkup()
-        markup.row(
-            telebot.types.InlineKeyboardButton("👥 إدارة المستخدمين", callback_data="admin_users"),
-            telebot.types.InlineKeyboardButton("📦 إدارة المنتجات", callback_data="admin_products")
-        )
-        markup.row(
-            telebot.types.InlineKeyboardButton("💰 طلبات الشحن", callback_data="admin_recharge"),
-            telebot.types.InlineKeyboardButton("📊 تقارير المبيعات", callback_data="admin_sales")
-        )
-        markup.row(
-            telebot.types.InlineKeyboardButton("📢 إرسال إذاعة", callback_data="admin_broadcast"),
-            telebot.types.InlineKeyboardButton("⚙️ إعدادات", callback_data="admin_settings")
-        )
-        markup.row(
-            telebot.types.InlineKeyboardButton("⚙️ شحن رصيد", callback_data="admin_balance"),
-            telebot.types.InlineKeyboardButton("🚫 حظر مستخدم", callback_data="admin_ban")
-        )
-        
         try:
-            self.bot.send_message(chat_id, text, reply_markup=markup)
+            self.bot.send_message(chat_id, keyboards.ADMIN_MENU_TEXT, reply_markup=keyboards.ADMIN_MENU)
         except Exception as e:
             print(f"Error showing admin menu: {e}")
     
@@ -72,10 +58,22 @@ class AdminPanel:
                 self.show_recharge_requests(call)
             elif data == "admin_sales":
                 self.show_sales_stats(call)
+            elif data == "admin_report":
+                self.show_report_ranges(call)
+            elif data == "admin_report_custom":
+                self.start_custom_report(call)
+            elif data.startswith("admin_report_"):
+                self.export_report_range(call)
             elif data == "admin_settings":
                 self.show_settings(call)
             elif data == "admin_broadcast":
                 self.show_broadcast_menu(call)
+            elif data == "admin_broadcast_compose":
+                self.start_broadcast_compose(call)
+            elif data == "admin_broadcast_send":
+                self.send_broadcast(call)
+            elif data == "admin_broadcast_stop":
+                self.stop_broadcast(call)
             elif data == "admin_balance":
                 self.show_balance_management(call)
             elif data == "admin_ban":
@@ -108,8 +106,7 @@ class AdminPanel:
         
         if not pending_users:
             text = "✅ لا توجد طلبات موافقة معلقة"
-            markup = telebot.types.InlineKeyboardMarkup()
-            markup.row(telebot.types.InlineKeyboardButton("🔙 العودة", callback_data="admin_menu"))
+            markup = keyboards.ADMIN_BACK
             
             try:
                 self.bot.edit_message_text(text, call.message.chat.id, call.message.message_id, reply_markup=markup)
@@ -181,12 +178,7 @@ class AdminPanel:
             user_name = user.get('name', 'المستخدم')
             
             # Remove user from database
-            users = self.db.get_all_users()
-            if user_id in users:
-                del users[user_id]
-                from utils import save_json
-                from config import USERS_FILE
-                save_json(USERS_FILE, users)
+            self.db.delete_user(user_id)
             
             # Notify admin
             self.bot.answer_callback_query(call.id, f"❌ تم رفض {user_name}")
@@ -207,23 +199,7 @@ class AdminPanel:
     
     def show_products_management(self, call):
         """Show products management"""
-        products = self.db.get_products()
-        
-        text = "📦 إدارة المنتجات\n\n"
-        
-        markup = telebot.types.InlineKeyboardMarkup()
-        
-        for product_id, product in products.items():
-            stock = len(product.get('codes', []))
-            status = "✅" if product.get('active', True) else "❌"
-            
-            text += f"{status} {product['name']}\n💰 {format_currency(product['price'])}\n📦 المخزون: {stock}\n\n"
-            
-            markup.row(
-                telebot.types.InlineKeyboardButton(f"🗑️ حذف {product['name']}", callback_data=f"delete_product_{product_id}")
-            )
-        
-        markup.row(telebot.types.InlineKeyboardButton("🔙 العودة", callback_data="admin_menu"))
+        text, markup = self.products_view.get()
         
         try:
             self.bot.edit_message_text(text, call.message.chat.id, call.message.message_id, reply_markup=markup)
@@ -253,8 +229,7 @@ class AdminPanel:
         
         if not pending_requests:
             text = "✅ لا توجد طلبات شحن معلقة"
-            markup = telebot.types.InlineKeyboardMarkup()
-            markup.row(telebot.types.InlineKeyboardButton("🔙 العودة", callback_data="admin_menu"))
+            markup = keyboards.ADMIN_BACK
             
             try:
                 self.bot.edit_message_text(text, call.message.chat.id, call.message.message_id, reply_markup=markup)
@@ -309,7 +284,7 @@ class AdminPanel:
             # Update request status
             if self.db.update_recharge_request(user_id, request_id, "approved"):
                 # Add balance to user
-                if self.db.update_user_balance(user_id, amount):
+                if self.db.update_user_balance(user_id, amount, "recharge", request_id):
                     user = self.db.get_user(user_id)
                     user_name = user.get('name', 'المستخدم') if user else 'المستخدم'
                     
@@ -371,22 +346,102 @@ class AdminPanel:
     def show_sales_stats(self, call):
         """Show sales statistics"""
         stats = self.db.get_sales_stats()
+        today = stats['days'].get(datetime.now().strftime('%Y-%m-%d'), {"count": 0, "revenue": 0})
         
         text = f"""📊 إحصائيات المبيعات
 
 🛒 إجمالي المبيعات: {stats['total_sales']}
 💰 إجمالي الإيرادات: {format_currency(stats['total_revenue'])}
 👥 العملاء الفريدين: {stats['unique_customers']}
+📆 مبيعات اليوم: {today['count']} ({format_currency(today['revenue'])})
 📅 تاريخ التقرير: {datetime.now().strftime('%Y-%m-%d %H:%M')}"""
         
-        markup = telebot.types.InlineKeyboardMarkup()
-        markup.row(telebot.types.InlineKeyboardButton("🔙 العودة", callback_data="admin_menu"))
+        top_products = sorted(stats['products'].items(), key=lambda item: item[1]['revenue'], reverse=True)[:5]
+        if top_products:
+            text += "\n\n🏆 الأكثر مبيعاً:\n"
+            for name, counter in top_products:
+                text += f"• {name}: {counter['count']} ({format_currency(counter['revenue'])})\n"
+        
+        markup = keyboards.SALES_MENU
         
         try:
             self.bot.edit_message_text(text, call.message.chat.id, call.message.message_id, reply_markup=markup)
         except:
             self.bot.send_message(call.message.chat.id, text, reply_markup=markup)
     
+    def show_report_ranges(self, call):
+        """Ask for the period of the sales report"""
+        text = "📄 تصدير تقرير المبيعات\n\nاختر الفترة:"
+        try:
+            self.bot.edit_message_text(text, call.message.chat.id, call.message.message_id,
+                                       reply_markup=keyboards.REPORT_RANGES)
+        except:
+            self.bot.send_message(call.message.chat.id, text, reply_markup=keyboards.REPORT_RANGES)
+    
+    @staticmethod
+    def report_range(key: str, today: datetime = None):
+        """First day and the day after the last one of a preset period, as ISO dates"""
+        today = (today or datetime.now()).replace(hour=0, minute=0, second=0, microsecond=0)
+        tomorrow = (today + timedelta(days=1)).strftime('%Y-%m-%d')
+        starts = {
+            "today": today,
+            "7d": today - timedelta(days=6),
+            "30d": today - timedelta(days=29),
+            "month": today.replace(day=1),
+            "year": today.replace(month=1, day=1)
+        }
+        if key == "all":
+            return None, None
+        if key not in starts:
+            raise ValueError(f"Unknown report period: {key}")
+        return starts[key].strftime('%Y-%m-%d'), tomorrow
+    
+    def export_report_range(self, call):
+        """Export the sales report of a preset period"""
+        start, end = self.report_range(call.data.replace("admin_report_", "", 1))
+        self.bot.answer_callback_query(call.id, "⏳ جاري إنشاء التقرير")
+        self.export_sales_report(call.message.chat.id, start, end)
+    
+    def start_custom_report(self, call):
+        """Ask the admin for the first and last day of the report"""
+        self.states.set(str(call.from_user.id), {'state': 'waiting_report_range'})
+        self.bot.answer_callback_query(call.id)
+        self.bot.send_message(call.message.chat.id,
+                              "📅 أرسل الفترة بالشكل: YYYY-MM-DD YYYY-MM-DD\nمثال: 2024-01-01 2024-03-31")
+    
+    def export_custom_report(self, message):
+        """Export the sales report for the period the admin typed"""
+        try:
+            first, last = message.text.split()
+            first_day = datetime.strptime(first, '%Y-%m-%d')
+            last_day = datetime.strptime(last, '%Y-%m-%d')
+            if last_day < first_day:
+                raise ValueError("period ends before it starts")
+        except ValueError:
+            self.bot.send_message(message.chat.id, "❌ صيغة غير صحيحة، أرسل: YYYY-MM-DD YYYY-MM-DD")
+            return
+        self.states.delete(str(message.from_user.id))
+        self.export_sales_report(message.chat.id, first, (last_day + timedelta(days=1)).strftime('%Y-%m-%d'))
+    
+    def export_sales_report(self, chat_id: int, start: str = None, end: str = None):
+        """Render and send the sales report for start <= date < end in one pass over the sales"""
+        if start:
+            last_day = (datetime.strptime(end, '%Y-%m-%d') - timedelta(days=1)).strftime('%Y-%m-%d')
+            period = f"{start} - {last_day}"
+            filename = f"sales_report_{start}_{last_day}.pdf"
+        else:
+            period = "All time"
+            filename = f"sales_report_all_{datetime.now().strftime('%Y-%m-%d')}.pdf"
+        try:
+            if self.report_generator is None:
+                self.report_generator = PDFInvoiceGenerator(renderer="story")
+            report = self.report_generator.create_sales_report(self.db.iter_sales(start, end), period)
+            self.bot.send_document(chat_id, report.getvalue(), visible_file_name=filename,
+                                   caption=f"📄 تقرير المبيعات: {period}")
+        except Exception as e:
+            print(f"Error exporting sales report: {e}")
+            self.bot.send_message(chat_id, "❌ حدث خطأ في إنشاء التقرير")
+    
     def show_users_management(self, call):
         """Show users management"""
         users = self.db.get_all_users()
@@ -401,8 +456,7 @@ class AdminPanel:
             balance = user_data.get('balance', 0)
             text += f"👤 {name}\n🆔 {user_id}\n💰 {format_currency(balance)}\n\n"
         
-        markup = telebot.types.InlineKeyboardMarkup()
-        markup.row(telebot.types.InlineKeyboardButton("🔙 العودة", callback_data="admin_menu"))
+        markup = keyboards.ADMIN_BACK
         
         try:
             self.bot.edit_message_text(text, call.message.chat.id, call.message.message_id, reply_markup=markup)
@@ -411,22 +465,56 @@ class AdminPanel:
     
     def show_broadcast_menu(self, call):
         """Show broadcast menu"""
-        text = "📢 إرسال إذاعة\n\nهذه الميزة قيد التطوير"
-        
-        markup = telebot.types.InlineKeyboardMarkup()
-        markup.row(telebot.types.InlineKeyboardButton("🔙 العودة", callback_data="admin_menu"))
+        if self.broadcaster.is_running():
+            text = self.broadcaster.format_progress()
+            markup = keyboards.BROADCAST_RUNNING
+        else:
+            text = "📢 إرسال إذاعة\n\nسيتم إرسال رسالتك إلى جميع المستخدمين المفعلين"
+            if self.broadcaster.status().get("status"):
+                text += "\n\nآخر إذاعة:\n" + self.broadcaster.format_progress()
+            markup = keyboards.BROADCAST_COMPOSE
         
         try:
             self.bot.edit_message_text(text, call.message.chat.id, call.message.message_id, reply_markup=markup)
         except:
             self.bot.send_message(call.message.chat.id, text, reply_markup=markup)
     
+    def start_broadcast_compose(self, call):
+        """Ask the admin for the broadcast text"""
+        self.states.set(str(call.from_user.id), {'state': 'waiting_broadcast_text'})
+        self.bot.answer_callback_query(call.id)
+        self.bot.send_message(call.message.chat.id, "✍️ أرسل الآن نص الإذاعة")
+    
+    def confirm_broadcast(self, message):
+        """Preview the broadcast text and ask for confirmation"""
+        text = message.text.strip()
+        self.states.set(str(message.from_user.id), {'state': 'broadcast_confirm', 'text': text})
+        
+        self.bot.send_message(message.chat.id, f"📢 معاينة الإذاعة:\n\n{text}\n\nهل تريد الإرسال؟",
+                              reply_markup=keyboards.BROADCAST_CONFIRM)
+    
+    def send_broadcast(self, call):
+        """Start the confirmed broadcast"""
+        state = self.states.get(str(call.from_user.id))
+        if not state or state.get('state') != 'broadcast_confirm':
+            self.bot.answer_callback_query(call.id, "❌ انتهت صلاحية الإذاعة، اكتب الرسالة من جديد")
+            return
+        self.states.delete(str(call.from_user.id))
+        if self.broadcaster.start(state['text'], call.message.chat.id):
+            self.bot.answer_callback_query(call.id, "📢 بدأ الإرسال")
+        else:
+            self.bot.answer_callback_query(call.id, "⏳ هناك إذاعة قيد الإرسال")
+    
+    def stop_broadcast(self, call):
+        """Stop the running broadcast"""
+        self.broadcaster.stop()
+        self.bot.answer_callback_query(call.id, "⏹ جاري إيقاف الإذاعة")
+    
     def show_balance_management(self, call):
         """Show balance management"""
         text = "⚙️ شحن رصيد\n\nهذه الميزة قيد التطوير"
         
-        markup = telebot.types.InlineKeyboardMarkup()
-        markup.row(telebot.types.InlineKeyboardButton("🔙 العودة", callback_data="admin_menu"))
+        markup = keyboards.ADMIN_BACK
         
         try:
             self.bot.edit_message_text(text, call.message.chat.id, call.message.message_id, reply_markup=markup)
@@ -437,8 +525,7 @@ class AdminPanel:
         """Show ban management"""
         text = "🚫 حظر مستخدم\n\nهذه الميزة قيد التطوير"
         
-        markup = telebot.types.InlineKeyboardMarkup()
-        markup.row(telebot.types.InlineKeyboardButton("🔙 العودة", callback_data="admin_menu"))
+        markup = keyboards.ADMIN_BACK
         
         try:
             self.bot.edit_message_text(text, call.message.chat.id, call.message.message_id, reply_markup=markup)
@@ -496,11 +583,7 @@ class AdminPanel:
             user_name = user_info.get('name', 'غير معروف') if user_info else 'غير معروف'
             
             # Remove user from database
-            users_data = self.db.get_all_users()
-            if user_id in users_data:
-                del users_data[user_id]
-                from utils import save_json
-                save_json('users.json', users_data)
+            self.db.delete_user(user_id)
             
             # Notify user
             try:
@@ -531,12 +614,42 @@ class AdminPanel:
     
     def show_settings(self, call):
         """Show settings menu"""
-        text = "⚙️ إعدادات البوت\n\nهذه الميزة قيد التطوير"
+        text = "⚙️ إعدادات البوت\n\n" + self.format_system_status()
         
-        markup = telebot.types.InlineKeyboardMarkup()
-        markup.row(telebot.types.InlineKeyboardButton("🔙 العودة", callback_data="admin_menu"))
+        markup = keyboards.ADMIN_BACK
         
         try:
             self.bot.edit_message_text(text, call.message.chat.id, call.message.message_id, reply_markup=markup)
         except:
-            self.bot.send_message(call.message.chat.id, text, reply_markup=markup)
\ No newline at end of file
+            self.bot.send_message(call.message.chat.id, text, reply_markup=markup)
+    
+    def format_system_status(self) -> str:
+        """Format runtime metrics for the settings screen"""
+        storage = self.db.get_storage_metrics()
+        text = f"💾 التخزين: {storage['backend']} ({storage['mode']})\n"
+        if CLUSTER_WORKERS > 1:
+            text += f"🧩 العملية: {WORKER_ID + 1}/{CLUSTER_WORKERS}\n"
+        if "flushes_per_second" in storage:
+            text += f"🔁 عمليات الحفظ/ثانية: {storage['flushes_per_second']:.2f}\n"
+            text += f"📝 ملفات بانتظار الحفظ: {storage['pending_files']}\n"
+        if "wal_bytes" in storage:
+            text += f"📒 سجل الأرصدة: {storage['wal_bytes'] / 1024:.1f} KB (#{storage['wal_seq']})\n"
+        outbound = getattr(self.bot, "outbound", None)
+        if outbound:
+            sending = outbound.stats()
+            text += f"📤 بانتظار الإرسال: {sending['queue_depth']} | زمن التسليم p50/p95: {sending['latency_p50_ms']:.0f}/{sending['latency_p95_ms']:.0f} ms\n"
+            text += f"⏳ انتظار 429: {sending['flood_waits']} | فشل: {sending['failed']}\n"
+        if self.invoices:
+            invoices = self.invoices.stats()
+            text += f"🧾 فواتير قيد الإنشاء: {invoices['backlog']} | زمن الإنشاء p50/p95: {invoices['render_p50_ms']:.0f}/{invoices['render_p95_ms']:.0f} ms\n"
+            if 'archive' in invoices:
+                archive = invoices['archive']
+                text += f"🗄 أرشيف الفواتير: {archive['invoices']} ({archive['bytes'] / 1048576:.1f}/{archive['max_bytes'] / 1048576:.0f} MB)\n"
+        if self.dispatcher:
+            pool = self.dispatcher.stats()
+            text += f"🧵 العمال: {pool['workers']} | بالانتظار: {pool['queue_depth']}"
+            if pool.get("per_worker"):
+                busiest = max(worker["utilization"] for worker in pool["per_worker"])
+                text += f" | أعلى انشغال: {busiest:.0%}"
+            text += "\n"
+        return text
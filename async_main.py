@@ -0,0 +1,363 @@
+"""Asyncio entry point for the bot.
+
+Updates are received by an AsyncTeleBot and handled by coroutines on the
+event loop, one update at a time per user. Replies go through main.py's
+outbound queue and are awaited on the loop, so a conversation waiting on
+Telegram is a suspended coroutine instead of a blocked thread. Storage,
+conversation state and invoice submission block and run on the loop's
+executor; so do the AdminPanel handlers, which serve the one admin. Texts,
+keyboards and data lookups are main.py's.
+
+Usage:
+    python async_main.py
+"""
+import asyncio
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Dict, List
+from telebot.async_telebot import AsyncTeleBot
+from dispatcher import update_user_id
+from outbound import CHAT_METHODS, PRIORITY_HIGH, PRIORITY_NORMAL
+import keyboards
+from config import BOT_TOKEN, ADMIN_ID, STORE_NAME, STARTUP_IMAGE, ASYNC_EXECUTOR_WORKERS
+
+def blocking(fn: Callable, *args, **kwargs) -> Awaitable:
+    """Run blocking storage work on the loop's executor"""
+    return asyncio.to_thread(fn, *args, **kwargs)
+
+def command_of(message) -> str:
+    """The command of a "/command@bot args" message, "" for other messages"""
+    text = message.text or ""
+    if not text.startswith("/"):
+        return ""
+    return text.split()[0][1:].split("@")[0]
+
+class AsyncBot:
+    """Awaitable bot calls for the async handlers.
+
+    Chat sends are queued on an OutboundQueue, keeping its flood limits and
+    priorities, and their results awaited on the loop; other calls go to
+    the AsyncTeleBot.
+    """
+
+    def __init__(self, bot: AsyncTeleBot, outbound):
+        self._bot = bot
+        self.outbound = outbound
+
+    def __getattr__(self, name: str):
+        if name in CHAT_METHODS:
+            async def send(*args, priority: int = PRIORITY_NORMAL, **kwargs):
+                return await asyncio.wrap_future(self.outbound.submit(name, *args, priority=priority, **kwargs))
+            return send
+        return getattr(self._bot, name)
+
+
+class AsyncHandlers:
+    """main.py's update handlers as coroutines over the objects ``app`` (main) set up"""
+
+    def __init__(self, app, bot: AsyncBot):
+        self.app = app
+        self.bot = bot
+
+    async def handle(self, update) -> None:
+        """Handle one update, the async counterpart of process_new_updates"""
+        if update.message is not None:
+            await self.on_message(update.message)
+        elif update.callback_query is not None:
+            await self.callback_query(update.callback_query)
+
+    async def on_message(self, message) -> None:
+        if message.content_type == "photo":
+            await self.handle_photo(message)
+        elif message.content_type == "text":
+            command = command_of(message)
+            if command == "start":
+                await self.send_welcome(message)
+            elif command == "admin":
+                await self.admin_command(message)
+            elif command == "help":
+                await self.bot.send_message(message.chat.id, self.app.HELP_TEXT)
+            else:
+                await self.handle_text_messages(message)
+
+    async def edit_or_send(self, call, text: str, markup) -> None:
+        try:
+            await self.bot.edit_message_text(text, call.message.chat.id, call.message.message_id, reply_markup=markup)
+        except Exception:
+            await self.bot.send_message(call.message.chat.id, text, reply_markup=markup)
+
+    async def send_photo_or_text(self, chat_id: int, url: str, text: str, markup) -> None:
+        if url:
+            try:
+                await self.app.media_cache.send_photo_async(self.bot, chat_id, url, caption=text, reply_markup=markup)
+                return
+            except Exception:
+                pass
+        await self.bot.send_message(chat_id, text, reply_markup=markup)
+
+    async def send_welcome(self, message) -> None:
+        user_id = str(message.from_user.id)
+        name = message.from_user.first_name or "المستخدم"
+        if not await blocking(self.app.check_rate_limit, user_id):
+            await self.bot.reply_to(message, "⏳ يرجى الانتظار قليلاً قبل إرسال طلب آخر")
+            return
+        if not self.app.validate_user_input(name):
+            name = "المستخدم"
+        if await blocking(self.app.db.is_user_banned, user_id):
+            await self.bot.reply_to(message, "❌ تم حظر حسابك من استخدام البوت")
+            return
+        user = await blocking(self.app.ensure_user, user_id, message.from_user)
+        text = self.app.welcome_text(name, user_id, user.get("balance", 0) if user else 0)
+        await self.send_photo_or_text(message.chat.id, STARTUP_IMAGE, text, keyboards.MAIN_MENU)
+
+    async def admin_command(self, message) -> None:
+        if self.app.admin_panel.is_admin_user(message.from_user.id):
+            await blocking(self.app.admin_panel.show_admin_menu, message.chat.id)
+        else:
+            await self.bot.reply_to(message, "⛔ غير مسموح لك بالوصول لهذه الصفحة")
+
+    async def handle_photo(self, message) -> None:
+        user_id = str(message.from_user.id)
+        state_data = await blocking(self.app.user_states.get, user_id)
+        if not state_data or state_data.get('state') != 'waiting_receipt':
+            await self.bot.send_message(message.chat.id, "❓ لم أفهم الغرض من هذه الصورة")
+            return
+        try:
+            photo = message.photo[-1]
+            await self.bot.get_file(photo.file_id)
+            await blocking(self.app.user_states.update, user_id, receipt_photo=photo.file_id, state='waiting_date')
+            await self.bot.send_message(message.chat.id, self.app.RECEIPT_RECEIVED)
+        except Exception as e:
+            await self.bot.send_message(message.chat.id, "❌ حدث خطأ في معالجة الصورة، يرجى المحاولة مرة أخرى")
+            print(f"Photo handling error: {e}")
+
+    async def handle_text_messages(self, message) -> None:
+        user_id = str(message.from_user.id)
+        admin_panel = self.app.admin_panel
+        state_data = await blocking(self.app.user_states.get, user_id)
+        state = state_data.get('state') if state_data else None
+        if state == 'waiting_broadcast_text' and admin_panel.is_admin_user(message.from_user.id):
+            await blocking(admin_panel.confirm_broadcast, message)
+            return
+        if state == 'waiting_report_range' and admin_panel.is_admin_user(message.from_user.id):
+            await blocking(admin_panel.export_custom_report, message)
+            return
+        if state == 'waiting_date':
+            transfer_date = message.text.strip()
+            if len(transfer_date) < 5:
+                await self.bot.send_message(message.chat.id, "❌ يرجى إدخال تاريخ ووقت مفصل للتحويل")
+                return
+            amount = state_data.get('amount')
+            request_id = await blocking(self.app.db.create_recharge_request, user_id=user_id, amount=amount,
+                                        transfer_date=transfer_date, receipt_photo=state_data.get('receipt_photo'))
+            await blocking(self.app.user_states.delete, user_id)
+            await self.bot.send_message(message.chat.id, self.app.recharge_sent_text(request_id, amount))
+            notice = await blocking(self.app.recharge_admin_text, user_id, amount, transfer_date, request_id)
+            try:
+                await self.bot.send_message(admin_panel.admin_id, notice)
+            except Exception as e:
+                print(f"Failed to send admin notification: {e}")
+            return
+        await self.bot.send_message(message.chat.id, "❓ لم أفهم رسالتك، يرجى استخدام الأزرار المتاحة")
+
+    async def callback_query(self, call) -> None:
+        data = call.data
+        try:
+            await self.bot.answer_callback_query(call.id)
+            user_id = str(call.from_user.id)
+            if not await blocking(self.app.check_rate_limit, user_id):
+                return
+            await blocking(self.app.ensure_user, user_id, call.from_user)
+            if not data.startswith("admin_") and await blocking(self.app.db.is_user_banned, user_id):
+                await self.bot.send_message(call.message.chat.id, "❌ تم حظر حسابك")
+                return
+
+            if data == "store":
+                text, markup = await blocking(self.app.store_view.get)
+                await self.edit_or_send(call, text, markup)
+            elif data.startswith("product_"):
+                await self.show_product_details(call)
+            elif data.startswith("buy_"):
+                await self.process_purchase(call)
+            elif data == "recharge":
+                await self.edit_or_send(call, keyboards.RECHARGE_TEXT, keyboards.RECHARGE_MENU)
+            elif data.startswith("recharge_"):
+                await self.process_recharge_request(call)
+            elif data == "history":
+                await self.show_purchase_history(call)
+            elif data.startswith("resend_"):
+                await self.resend_invoice(call)
+            elif data == "check_balance":
+                await self.show_user_balance(call)
+            elif data == "back":
+                await self.back_to_main(call)
+            elif data.startswith(self.app.ADMIN_CALLBACKS):
+                await blocking(self.app.admin_panel.handle_admin_callback, call)
+            elif data == "out_of_stock":
+                await self.bot.send_message(call.message.chat.id, "❌ هذا المنتج غير متوفر حالياً")
+            else:
+                await self.bot.send_message(call.message.chat.id, "❓ أمر غير معروف")
+        except Exception as e:
+            print(f"Error handling callback {data}: {e}")
+            try:
+                await self.bot.send_message(call.message.chat.id, "❌ حدث خطأ، يرجى المحاولة مرة أخرى")
+            except Exception:
+                pass
+
+    async def show_product_details(self, call) -> None:
+        product_id = call.data.replace("product_", "")
+        product = await blocking(self.app.db.get_product, product_id)
+        user = await blocking(self.app.db.get_user, str(call.from_user.id))
+        if not product:
+            await self.bot.answer_callback_query(call.id, "❌ المنتج غير موجود")
+            return
+        if not user:
+            await self.bot.answer_callback_query(call.id, "❌ خطأ في بيانات المستخدم")
+            return
+        text, markup = self.app.product_details(product_id, product, user)
+        await self.send_photo_or_text(call.message.chat.id, product.get('image'), text, markup)
+
+    async def process_purchase(self, call) -> None:
+        product_id = call.data.replace("buy_", "")
+        user_id = str(call.from_user.id)
+        chat_id = call.message.chat.id
+        result = await blocking(self.app.db.process_purchase, user_id, product_id)
+        if not result["success"]:
+            await self.bot.send_message(chat_id, f"❌ فشل الشراء: {result['message']}")
+            return
+        purchase_data = result["data"]
+        sale_data, user_data = await blocking(self.app.invoice_data, user_id, purchase_data)
+        await self.bot.send_message(chat_id, self.app.purchase_text(purchase_data), reply_markup=keyboards.PURCHASE_DONE,
+                                    parse_mode='Markdown', priority=PRIORITY_HIGH)
+        try:
+            queued = await blocking(self.app.invoice_jobs.submit, chat_id, sale_data, user_data)
+        except Exception as e:
+            print(f"PDF generation error: {e}")
+            queued = False
+        if not queued:
+            await self.bot.send_message(chat_id, "❌ حدث خطأ في إنشاء الفاتورة")
+
+    async def process_recharge_request(self, call) -> None:
+        amount = int(call.data.replace("recharge_", ""))
+        await blocking(self.app.user_states.set, str(call.from_user.id), {'state': 'waiting_receipt', 'amount': amount})
+        await self.bot.send_message(call.message.chat.id, self.app.recharge_prompt(amount))
+
+    async def show_purchase_history(self, call) -> None:
+        purchases = await blocking(self.app.db.get_user_purchases, str(call.from_user.id), limit=10)
+        if not purchases:
+            await self.bot.send_message(call.message.chat.id, "📝 لا توجد مشتريات سابقة", reply_markup=keyboards.BACK)
+            return
+        text, markup = self.app.purchase_history(purchases)
+        await self.bot.send_message(call.message.chat.id, text, reply_markup=markup, parse_mode='Markdown')
+
+    async def resend_invoice(self, call) -> None:
+        invoice_id = call.data.replace("resend_", "", 1)
+        user_id = str(call.from_user.id)
+        chat_id = call.message.chat.id
+        entry = await blocking(self.app.invoice_archive.get, invoice_id)
+        if entry is not None and entry['user_id'] == user_id and \
+                await blocking(self.app.invoice_jobs.resend, chat_id, invoice_id):
+            await self.bot.answer_callback_query(call.id, "📄 جاري إرسال الفاتورة")
+            return
+        invoice = await blocking(self.app.past_invoice_data, user_id, invoice_id)
+        if invoice is None:
+            await self.bot.answer_callback_query(call.id, "❌ الفاتورة غير متوفرة")
+        elif await blocking(self.app.invoice_jobs.submit, chat_id, *invoice):
+            await self.bot.answer_callback_query(call.id, "📄 جاري إرسال الفاتورة")
+        else:
+            await self.bot.answer_callback_query(call.id, "❌ حدث خطأ في إنشاء الفاتورة")
+
+    async def show_user_balance(self, call) -> None:
+        user_id = str(call.from_user.id)
+        user = await blocking(self.app.db.get_user, user_id)
+        if not user:
+            await self.bot.answer_callback_query(call.id, "❌ خطأ في بيانات المستخدم")
+            return
+        await self.edit_or_send(call, self.app.balance_text(user_id, user), keyboards.BALANCE_MENU)
+
+    async def back_to_main(self, call) -> None:
+        user_id = str(call.from_user.id)
+        user = await blocking(self.app.db.get_user, user_id)
+        if not user:
+            await self.bot.answer_callback_query(call.id, "❌ خطأ في بيانات المستخدم")
+            return
+        text = self.app.welcome_text(user.get("name", "المستخدم"), user_id, user.get("balance", 0))
+        await self.edit_or_send(call, text, keyboards.MAIN_MENU)
+
+
+class AsyncUpdateDispatcher:
+    """Runs update coroutines on the event loop with per-user ordering.
+
+    Each user with pending updates gets one drain task that awaits their
+    updates' handlers in arrival order; users run concurrently.
+    """
+
+    def __init__(self, handler: Callable[[Any], Awaitable], workers: int):
+        self.handler = handler
+        self.workers = workers  # executor threads for the blocking work, for stats
+        self._pending: Dict[int, deque] = {}
+        self._processed = 0
+        self._errors = 0
+
+    async def dispatch(self, updates: List) -> None:
+        """Queue updates on their users' drain tasks (replaces process_new_updates)"""
+        for update in updates:
+            user_id = update_user_id(update)
+            key = user_id if user_id is not None else -update.update_id
+            pending = self._pending.get(key)
+            if pending is None:
+                pending = self._pending[key] = deque()
+                asyncio.get_running_loop().create_task(self._drain(key, pending))
+            pending.append(update)
+
+    async def _drain(self, key: int, pending: deque) -> None:
+        try:
+            while pending:
+                update = pending[0]
+                try:
+                    await self.handler(update)
+                except Exception as e:
+                    self._errors += 1
+                    print(f"Error processing update {update.update_id}: {e}")
+                self._processed += 1
+                pending.popleft()
+        finally:
+            del self._pending[key]
+
+    def stats(self) -> Dict:
+        """Queue depth and in-flight users"""
+        return {
+            "workers": self.workers,
+            "queue_depth": sum(len(pending) for pending in list(self._pending.values())),
+            "active_users": len(self._pending),
+            "processed": self._processed,
+            "errors": self._errors
+        }
+
+async def run() -> None:
+    # Importing main sets up storage, the outbound queue, invoice jobs and the admin panel
+    import main
+
+    loop = asyncio.get_running_loop()
+    executor = ThreadPoolExecutor(max_workers=ASYNC_EXECUTOR_WORKERS, thread_name_prefix="blocking")
+    loop.set_default_executor(executor)
+
+    intake = AsyncTeleBot(BOT_TOKEN)
+    handlers = AsyncHandlers(main, AsyncBot(intake, main.outbound))
+    dispatcher = AsyncUpdateDispatcher(handlers.handle, ASYNC_EXECUTOR_WORKERS)
+    main.admin_panel.dispatcher = dispatcher
+    main.broadcaster.resume()
+    main.warm_up_media()
+    await blocking(main.register_arabic_font)  # report a missing invoice font now, not at the first Arabic invoice
+
+    intake.process_new_updates = dispatcher.dispatch
+    print(f"🤖 بدء تشغيل {STORE_NAME} (asyncio)")
+    print(f"👤 الأدمن: {ADMIN_ID}")
+    try:
+        await intake.infinity_polling(timeout=20)
+    finally:
+        await intake.close_session()
+        executor.shutdown(wait=True)
+
+if __name__ == "__main__":
+    asyncio.run(run())
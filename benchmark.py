@@ -0,0 +1,142 @@
+"""Benchmarks for the bot's hot paths.
+
+Runs against a throwaway data directory, never the live data files.
+
+Usage:
+    python benchmark.py purchase --backend json --threads 8 --purchases 2000
+    python benchmark.py invoice --count 500
+    python benchmark.py invoice --count 500 --arabic
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+from utils import percentile
+
+def use_temp_data_dir() -> str:
+    """Point config at a fresh data directory before anything imports it"""
+    data_dir = tempfile.mkdtemp(prefix="bench_")
+    os.environ["DATA_DIR"] = data_dir
+    return data_dir
+
+def bench_purchase(backend: str, threads: int, purchases: int, products: int) -> bool:
+    """Concurrent purchases across several products, reports p50/p99 latency"""
+    data_dir = use_temp_data_dir()
+    from config import PURCHASE_P50_TARGET_MS, PURCHASE_P99_TARGET_MS
+    from database import DatabaseManager
+    from storage import create_storage
+
+    db = DatabaseManager(create_storage(backend))
+    product_ids = [f"bench_product_{i}" for i in range(products)]
+    for product_id in product_ids:
+        db.create_product(product_id, {"name": product_id, "price": 100, "codes": [], "active": True})
+        db.add_product_codes(product_id, [f"{product_id}-code-{n}" for n in range(purchases // products + 1)])
+    for t in range(threads):
+        db.create_user(f"bench_user_{t}", "bench")
+        db.update_user_balance(f"bench_user_{t}", 100 * purchases)
+
+    latencies = []
+    failures = []
+    latencies_lock = threading.Lock()
+    per_thread = purchases // threads
+
+    def worker(t: int):
+        user_id = f"bench_user_{t}"
+        for n in range(per_thread):
+            product_id = product_ids[(t + n) % products]
+            started = time.perf_counter()
+            result = db.process_purchase(user_id, product_id)
+            elapsed = (time.perf_counter() - started) * 1000
+            with latencies_lock:
+                latencies.append(elapsed)
+                if not result["success"]:
+                    failures.append(result["message"])
+
+    workers = [threading.Thread(target=worker, args=(t,)) for t in range(threads)]
+    started = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    wall = time.perf_counter() - started
+
+    sales = sum(len(user_sales) for user_sales in db.get_all_sales().values())
+    p50 = percentile(latencies, 50)
+    p99 = percentile(latencies, 99)
+    print(f"backend={backend} threads={threads} products={products} data_dir={data_dir}")
+    print(f"purchases={len(latencies)} failed={len(failures)} recorded_sales={sales} throughput={len(latencies) / wall:.0f}/s")
+    print(f"p50={p50:.2f}ms (target {PURCHASE_P50_TARGET_MS}ms) p99={p99:.2f}ms (target {PURCHASE_P99_TARGET_MS}ms)")
+
+    consistent = sales == len(latencies) - len(failures)
+    if not consistent:
+        print("❌ recorded sales do not match successful purchases")
+    return consistent and p50 <= PURCHASE_P50_TARGET_MS and p99 <= PURCHASE_P99_TARGET_MS
+
+ARABIC_LETTERS = "ابتثجحخدذرزسشصضطظعغفقكلمنهوي"
+
+def arabic_name(index: int) -> str:
+    """A distinct two-word Arabic name for every index"""
+    words = []
+    for _ in range(2):
+        word = ""
+        for _ in range(4):
+            index, letter = divmod(index, len(ARABIC_LETTERS))
+            word += ARABIC_LETTERS[letter]
+        words.append(word)
+    return " ".join(words)
+
+def bench_invoice(count: int, arabic: bool = False) -> bool:
+    """Per-invoice render time of the fast renderer against the platypus story
+
+    With ``arabic`` every invoice has a customer name not seen before, the
+    common case for the store's Arabic-speaking customers.
+    """
+    use_temp_data_dir()
+    from config import INVOICE_SPEEDUP_TARGET
+    from pdf_generator_new import PDFInvoiceGenerator, register_arabic_font
+
+    if arabic and not register_arabic_font():
+        return False
+    sale = {"invoice_id": "INV-BENCH-0001", "product_name": "بطاقة شحن" if arabic else "Bench product",
+            "price": 15000, "code": "BENCH-CODE-0001", "timestamp": "2024-01-01T12:00:00"}
+    user = {"user_id": 123456789, "name": "Bench customer"}
+    per_invoice = {}
+    for renderer in ("story", "fast"):
+        generator = PDFInvoiceGenerator(renderer)
+        generator.create_invoice(sale, user)  # warm up fonts and the template
+        started = time.perf_counter()
+        for i in range(count):
+            name = arabic_name(i + (count if renderer == "fast" else 0)) if arabic else user["name"]
+            pdf = generator.create_invoice(dict(sale, invoice_id=f"INV-BENCH-{i:04d}"), dict(user, name=name))
+        per_invoice[renderer] = (time.perf_counter() - started) / count * 1000
+        print(f"{renderer}: {per_invoice[renderer]:.3f}ms/invoice ({len(pdf.getvalue())} bytes)")
+
+    speedup = per_invoice["story"] / per_invoice["fast"]
+    print(f"speedup={speedup:.1f}x (target {INVOICE_SPEEDUP_TARGET}x)")
+    return speedup >= INVOICE_SPEEDUP_TARGET
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    purchase = subparsers.add_parser("purchase", help="process_purchase latency under concurrency")
+    purchase.add_argument("--backend", choices=["json", "sqlite"], default="json")
+    purchase.add_argument("--threads", type=int, default=8)
+    purchase.add_argument("--purchases", type=int, default=2000)
+    purchase.add_argument("--products", type=int, default=4)
+
+    invoice = subparsers.add_parser("invoice", help="invoice PDF render time, fast renderer against platypus")
+    invoice.add_argument("--count", type=int, default=500)
+    invoice.add_argument("--arabic", action="store_true", help="a new Arabic customer name on every invoice")
+
+    args = parser.parse_args()
+    if args.benchmark == "purchase":
+        ok = bench_purchase(args.backend, args.threads, args.purchases, args.products)
+    elif args.benchmark == "invoice":
+        ok = bench_invoice(args.count, args.arabic)
+    sys.exit(0 if ok else 1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+import os
+import threading
+import time
+from collections import deque
+from typing import Dict
+from utils import load_json, save_json, get_current_timestamp
+from outbound import PRIORITY_LOW
+from config import BROADCAST_CHECKPOINT_FILE, BROADCAST_WINDOW, BROADCAST_PROGRESS_SECONDS
+
+class BroadcastEngine:
+    """Sends one message to every active user through the outbound queue.
+
+    Recipients are streamed from the store in user id order and sent at low
+    priority, so customer replies always go first while the broadcast uses
+    the remaining rate. Up to ``window`` sends are in flight; the checkpoint
+    records the last user whose send (and every send before it) finished,
+    so after a crash the broadcast resumes from there. A few users right
+    after the checkpoint may receive the message twice.
+    """
+
+    def __init__(self, outbound, db, checkpoint_file: str = BROADCAST_CHECKPOINT_FILE,
+                 window: int = BROADCAST_WINDOW, progress_seconds: float = BROADCAST_PROGRESS_SECONDS):
+        self.outbound = outbound
+        self.db = db
+        self.checkpoint_file = checkpoint_file
+        self.window = window
+        self.progress_seconds = progress_seconds
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+        self._reported_text = None
+        self.state = load_json(checkpoint_file) if os.path.exists(checkpoint_file) else {}
+
+    def is_running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def status(self) -> Dict:
+        """Copy of the current (or last) broadcast state"""
+        with self._lock:
+            return dict(self.state, counts=dict(self.state.get("counts", {})))
+
+    def start(self, text: str, admin_chat_id: int) -> bool:
+        """Start a new broadcast, False if one is already running"""
+        if self.is_running():
+            return False
+        with self._lock:
+            self.state = {
+                "text": text,
+                "status": "running",
+                "started_at": get_current_timestamp(),
+                "admin_chat_id": admin_chat_id,
+                "progress_message_id": None,
+                "cursor": None,
+                "counts": {"delivered": 0, "blocked": 0, "failed": 0}
+            }
+        self._launch()
+        return True
+
+    def resume(self) -> bool:
+        """Continue a broadcast interrupted by a restart"""
+        if self.is_running() or self.state.get("status") != "running":
+            return False
+        print(f"Resuming broadcast after user {self.state.get('cursor')}")
+        self._launch()
+        return True
+
+    def stop(self) -> None:
+        """Stop after the sends already in flight"""
+        self._stop.set()
+
+    def _launch(self) -> None:
+        self._stop.clear()
+        self._checkpoint()
+        self._thread = threading.Thread(target=self._run, name="broadcast", daemon=True)
+        self._thread.start()
+
+    def _checkpoint(self) -> None:
+        with self._lock:
+            state = dict(self.state, counts=dict(self.state["counts"]))
+        save_json(self.checkpoint_file, state)
+
+    @staticmethod
+    def _outcome(future) -> str:
+        error = future.exception()
+        if error is None:
+            return "delivered"
+        # 403: the user blocked the bot or deleted the account
+        return "blocked" if getattr(error, "error_code", None) == 403 else "failed"
+
+    def _settle(self, in_flight: deque, block: bool) -> None:
+        """Count finished sends from the front of the window and advance the cursor"""
+        while in_flight and (block or in_flight[0][1].done()):
+            user_id, future = in_flight.popleft()
+            outcome = self._outcome(future)
+            with self._lock:
+                self.state["counts"][outcome] += 1
+                self.state["cursor"] = user_id
+            block = block and len(in_flight) >= self.window
+
+    def _run(self) -> None:
+        text = self.state["text"]
+        in_flight = deque()
+        last_report = 0.0
+        self._report()
+        for user_id in self.db.iter_broadcast_recipients(self.state.get("cursor")):
+            if self._stop.is_set():
+                break
+            in_flight.append((user_id, self.outbound.submit("send_message", int(user_id), text,
+                                                            priority=PRIORITY_LOW)))
+            self._settle(in_flight, block=len(in_flight) >= self.window)
+            if time.monotonic() - last_report >= self.progress_seconds:
+                last_report = time.monotonic()
+                self._checkpoint()
+                self._report()
+
+        while in_flight:
+            self._settle(in_flight, block=True)
+        with self._lock:
+            self.state["status"] = "stopped" if self._stop.is_set() else "done"
+            self.state["finished_at"] = get_current_timestamp()
+        self._checkpoint()
+        self._report()
+
+    def format_progress(self) -> str:
+        """Progress text shown to the admin"""
+        state = self.status()
+        counts = state.get("counts", {})
+        titles = {"running": "⏳ جاري الإرسال...", "done": "✅ اكتملت الإذاعة", "stopped": "⏹ تم إيقاف الإذاعة"}
+        return (f"📢 الإذاعة: {titles.get(state.get('status'), '')}\n\n"
+                f"✅ تم التسليم: {counts.get('delivered', 0):,}\n"
+                f"🚫 محظور: {counts.get('blocked', 0):,}\n"
+                f"❌ فشل: {counts.get('failed', 0):,}\n\n"
+                f"🕒 البداية: {state.get('started_at', '')[:19]}")
+
+    def _report(self) -> None:
+        """Create or edit the live progress message in the admin chat"""
+        state = self.status()
+        text = self.format_progress()
+        message_id = state.get("progress_message_id")
+        if message_id is not None and text == self._reported_text:
+            return  # Telegram rejects edits that change nothing
+        self._reported_text = text
+        try:
+            if message_id is None:
+                message = self.outbound.call("send_message", state["admin_chat_id"], text)
+                with self._lock:
+                    self.state["progress_message_id"] = message.message_id
+            else:
+                self.outbound.call("edit_message_text", text, state["admin_chat_id"], message_id)
+        except Exception as e:
+            print(f"Broadcast progress update failed: {e}")
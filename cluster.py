@@ -0,0 +1,261 @@
+"""Run the bot as several worker processes.
+
+The supervisor receives updates (webhook when WEBHOOK_URL is set, long
+polling otherwise) and routes each one to a worker process by a hash of
+its user id, so every user sticks to one worker and their updates keep
+their order. Workers are separate interpreters running main.py's handlers
+over the shared SQLite store, whose transactions serialize purchases and
+balance changes across processes; conversation states and rate limits
+live in their own SQLite files as well.
+
+Usage:
+    STORAGE_BACKEND=sqlite python cluster.py --workers 4
+"""
+import argparse
+import multiprocessing
+import os
+import queue
+import signal
+import threading
+import time
+import zlib
+from typing import Dict, List, Optional
+from dispatcher import USER_FIELDS
+from config import (BOT_TOKEN, ADMIN_ID, STORE_NAME, STORAGE_BACKEND, CLUSTER_WORKERS, CLUSTER_QUEUE_SIZE,
+                    WEBHOOK_URL, WEBHOOK_SECRET, WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_MAX_PENDING)
+
+def raw_update_user_id(data: Dict) -> Optional[int]:
+    """Get the id of the user a JSON update belongs to"""
+    for field in USER_FIELDS:
+        user = (data.get(field) or {}).get("from")
+        if user is not None:
+            return user["id"]
+    user = (data.get("poll_answer") or {}).get("user")
+    return user["id"] if user is not None else None
+
+def worker_for(user_id: int, workers: int) -> int:
+    """Index of the worker process that owns a user
+
+    crc32 rather than ``hash()``: each worker spreads its users over its
+    thread pool with ``hash(user_id) % WORKER_POOL_SIZE``, and the same
+    modulus at both levels would put all of a worker's users on one thread.
+    """
+    return zlib.crc32(str(user_id).encode()) % workers
+
+def raw_update(data: Dict) -> Dict:
+    """Webhook parser that keeps updates as JSON for the worker queues"""
+    if not isinstance(data, dict) or "update_id" not in data:
+        raise ValueError("not a Telegram update")
+    return data
+
+def run_worker(worker_id: int, workers: int, updates: multiprocessing.Queue, acks) -> None:
+    """Worker process: hand routed updates to this process's bot
+
+    The id of every update whose handler starts is reported on ``acks``;
+    the supervisor redelivers the rest if this process dies.
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # the supervisor stops the workers
+    # WORKER_ID and CLUSTER_WORKERS are already in the environment, so
+    # config (and the outbound rate share) is right when main is imported
+    import main
+    from telebot.types import Update
+
+    main.start_dispatcher()
+    main.dispatcher.on_start = lambda update: acks.put((worker_id, update.update_id))
+    if worker_for(ADMIN_ID, workers) == worker_id:
+        main.broadcaster.resume()  # broadcasts run on the worker that serves the admin
+    if worker_id == 0:
+        main.warm_up_media()
+        main.register_arabic_font()  # report a missing invoice font at startup
+    print(f"🧩 العامل {worker_id + 1}/{workers} يعمل (pid {os.getpid()})")
+
+    while True:
+        # Leave the backlog in the shared queue so the supervisor sees it
+        while main.dispatcher.queue_depth() >= CLUSTER_QUEUE_SIZE:
+            time.sleep(0.05)
+        batch = updates.get()
+        if batch is None:
+            break
+        try:
+            main.telegram.process_new_updates([Update.de_json(data) for data in batch])
+        except Exception as e:
+            print(f"Worker {worker_id}: invalid update batch: {e}")
+    main.dispatcher.stop()
+    main.db.flush()
+
+
+class ClusterSupervisor:
+    """Starts the worker processes, routes updates to them and restarts crashed ones.
+
+    Workers are started with the ``spawn`` method: each is a fresh
+    interpreter that opens its own database connections. Every routed update
+    is kept until its worker reports that its handler started, so each
+    worker's backlog is counted in updates and capped at ``queue_size``; a
+    batch that does not fit raises ``queue.Full`` without queuing anything.
+    A worker that dies is started again on a fresh queue holding the
+    updates it had not started yet.
+    """
+
+    def __init__(self, workers: int = CLUSTER_WORKERS, queue_size: int = CLUSTER_QUEUE_SIZE):
+        if workers < 1:
+            raise ValueError("Cluster needs at least one worker")
+        self.workers = workers
+        self.queue_size = queue_size
+        self._context = multiprocessing.get_context("spawn")
+        self._queues = [self._context.Queue() for _ in range(workers)]
+        self._acks = self._context.SimpleQueue()
+        self._unstarted = [{} for _ in range(workers)]  # update_id -> update, in routing order
+        self._lock = threading.Lock()
+        self._processes = [None] * workers
+        self._routed = [0] * workers
+        self._restarts = 0
+        self._redelivered = 0
+        self._stopping = threading.Event()
+
+    def start(self) -> None:
+        for worker_id in range(self.workers):
+            self._start_worker(worker_id)
+        threading.Thread(target=self._collect_acks, name="cluster-acks", daemon=True).start()
+        threading.Thread(target=self._watch, name="cluster-watch", daemon=True).start()
+
+    def _start_worker(self, worker_id: int) -> None:
+        # spawn copies os.environ into the child when it starts
+        os.environ["WORKER_ID"] = str(worker_id)
+        os.environ["CLUSTER_WORKERS"] = str(self.workers)
+        process = self._context.Process(target=run_worker,
+                                        args=(worker_id, self.workers, self._queues[worker_id], self._acks),
+                                        name=f"bot-worker-{worker_id}")
+        process.start()
+        self._processes[worker_id] = process
+
+    def _watch(self) -> None:
+        while not self._stopping.wait(2):
+            for worker_id, process in enumerate(self._processes):
+                if not process.is_alive() and not self._stopping.is_set():
+                    print(f"Worker {worker_id} exited with code {process.exitcode}, restarting")
+                    self._restarts += 1
+                    self._restart_worker(worker_id)
+
+    def _restart_worker(self, worker_id: int) -> None:
+        """Start a worker again with the updates its predecessor never started"""
+        with self._lock:
+            old = self._queues[worker_id]
+            self._queues[worker_id] = self._context.Queue()
+            pending = list(self._unstarted[worker_id].values())
+            if pending:
+                self._queues[worker_id].put(pending)
+                self._redelivered += len(pending)
+        old.close()
+        self._start_worker(worker_id)
+
+    def _collect_acks(self) -> None:
+        while True:
+            worker_id, update_id = self._acks.get()
+            with self._lock:
+                self._unstarted[worker_id].pop(update_id, None)
+
+    def dispatch(self, updates: List[Dict]) -> None:
+        """Queue JSON updates on their users' workers.
+
+        Raises ``queue.Full`` if any target worker's backlog cannot take its
+        share; nothing is queued then. Never blocks.
+        """
+        batches = {}
+        for data in updates:
+            user_id = raw_update_user_id(data)
+            key = user_id if user_id is not None else data.get("update_id", 0)
+            batches.setdefault(worker_for(key, self.workers), []).append(data)
+        with self._lock:
+            for worker_id, batch in batches.items():
+                if len(self._unstarted[worker_id]) + len(batch) > self.queue_size:
+                    raise queue.Full(f"worker {worker_id} backlog is full")
+            for worker_id, batch in batches.items():
+                for data in batch:
+                    self._unstarted[worker_id][data["update_id"]] = data
+                self._queues[worker_id].put_nowait(batch)
+                self._routed[worker_id] += len(batch)
+
+    def queue_depth(self) -> int:
+        """Updates routed to the workers whose handlers have not started"""
+        with self._lock:
+            return sum(len(unstarted) for unstarted in self._unstarted)
+
+    def stats(self) -> Dict:
+        return {
+            "workers": self.workers,
+            "alive": sum(1 for process in self._processes if process is not None and process.is_alive()),
+            "routed": list(self._routed),
+            "restarts": self._restarts,
+            "redelivered": self._redelivered,
+            "queue_depth": self.queue_depth()
+        }
+
+    def stop(self, timeout: float = 30) -> None:
+        """Let the workers finish their queues and exit"""
+        self._stopping.set()
+        for updates in self._queues:
+            updates.put(None)
+        for process in self._processes:
+            process.join(timeout)
+            if process.is_alive():
+                process.terminate()
+
+
+def poll(supervisor: ClusterSupervisor) -> None:
+    """Long-poll Telegram and route the updates"""
+    from telebot import apihelper
+    offset = None
+    while True:
+        try:
+            updates = apihelper.get_updates(BOT_TOKEN, offset=offset, timeout=20, long_polling_timeout=20)
+        except Exception as e:
+            print(f"خطأ في استقبال التحديثات: {e}")
+            time.sleep(5)
+            continue
+        while updates:
+            try:
+                supervisor.dispatch(updates)
+            except queue.Full:
+                time.sleep(0.5)  # a worker is behind; Telegram keeps the updates meanwhile
+                continue
+            offset = updates[-1]["update_id"] + 1
+            break
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=CLUSTER_WORKERS)
+    args = parser.parse_args()
+    if STORAGE_BACKEND != "sqlite":
+        raise SystemExit("cluster.py needs STORAGE_BACKEND=sqlite: the JSON files belong to a single process")
+
+    import telebot
+    from database import DatabaseManager
+    from webhook import WebhookServer
+
+    # Create, migrate and seed the database once before the workers open it
+    DatabaseManager()
+
+    supervisor = ClusterSupervisor(args.workers)
+    supervisor.start()
+    telegram = telebot.TeleBot(BOT_TOKEN, threaded=False)
+    print(f"🤖 بدء تشغيل {STORE_NAME} ({args.workers} عمليات)")
+    print(f"👤 الأدمن: {ADMIN_ID}")
+    try:
+        telegram.remove_webhook()
+        if WEBHOOK_URL:
+            if not WEBHOOK_SECRET:
+                raise ValueError("WEBHOOK_SECRET is required in webhook mode")
+            server = WebhookServer(supervisor, WEBHOOK_SECRET, WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH,
+                                   WEBHOOK_MAX_PENDING, parse=raw_update)
+            telegram.set_webhook(url=WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH, secret_token=WEBHOOK_SECRET)
+            print(f"🌐 Webhook على المنفذ {server.port}{WEBHOOK_PATH}")
+            server.serve_forever()
+        else:
+            poll(supervisor)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        supervisor.stop()
+
+if __name__ == "__main__":
+    main()
@@ -5,11 +5,82 @@ BOT_TOKEN = os.getenv("BOT_TOKEN", "8150903745:AAFJDCGq7cB2LuBy0uON9iErqnhV_fpuG
 ADMIN_ID = int(os.getenv("ADMIN_ID", "7434574509"))
 
 # File paths
-DATA_DIR = "."
+DATA_DIR = os.getenv("DATA_DIR", ".")
 USERS_FILE = os.path.join(DATA_DIR, "users.json")
 PRODUCTS_FILE = os.path.join(DATA_DIR, "products.json")
 SALES_FILE = os.path.join(DATA_DIR, "sales.json")
 RECHARGE_REQUESTS_FILE = os.path.join(DATA_DIR, "recharge_requests.json")
+DATABASE_FILE = os.path.join(DATA_DIR, "store.db")
+INVENTORY_DIR = os.path.join(DATA_DIR, "inventory")
+SALES_LEDGER_DIR = os.path.join(DATA_DIR, "sales")
+WAL_DIR = os.path.join(DATA_DIR, "wal")
+
+# Storage backend: "json" (data files above) or "sqlite" (DATABASE_FILE)
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "json")
+
+# Durability of JSON file writes: "fsync" (every write), "group" (batch writes
+# within GROUP_COMMIT_WINDOW_MS, fsync once per flush) or "none" (batch, no fsync)
+DURABILITY_MODE = os.getenv("DURABILITY_MODE", "group")
+GROUP_COMMIT_WINDOW_MS = int(os.getenv("GROUP_COMMIT_WINDOW_MS", "50"))
+
+# Balance changes are appended to a write-ahead log in WAL_DIR and folded into
+# users.json by a background compactor every WAL_COMPACT_INTERVAL_SECONDS
+WAL_COMPACT_INTERVAL_SECONDS = int(os.getenv("WAL_COMPACT_INTERVAL_SECONDS", "300"))
+
+# Update processing: worker threads; updates of one user always share a worker
+WORKER_POOL_SIZE = int(os.getenv("WORKER_POOL_SIZE", "8"))
+# async_main.py: threads for blocking storage, state, invoice and admin panel calls
+ASYNC_EXECUTOR_WORKERS = int(os.getenv("ASYNC_EXECUTOR_WORKERS", "8"))
+
+# Webhook mode: set WEBHOOK_URL (public https base URL) to receive updates on a
+# local HTTP server instead of long polling
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8443"))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram")
+WEBHOOK_MAX_PENDING = int(os.getenv("WEBHOOK_MAX_PENDING", "1000"))
+
+# cluster.py: bot worker processes sharing the SQLite store; each worker is
+# started with its own WORKER_ID and gets the updates of a fixed set of users
+CLUSTER_WORKERS = int(os.getenv("CLUSTER_WORKERS", "1"))
+WORKER_ID = int(os.getenv("WORKER_ID", "0"))
+CLUSTER_QUEUE_SIZE = int(os.getenv("CLUSTER_QUEUE_SIZE", "1000"))
+
+# Outbound messages: Telegram allows about 30 messages/s overall (split between
+# cluster workers) and 1/s per chat (short bursts tolerated); 429 responses are
+# retried up to OUTBOUND_MAX_RETRIES
+OUTBOUND_GLOBAL_RATE = 30 / CLUSTER_WORKERS
+OUTBOUND_PER_CHAT_RATE = 1
+OUTBOUND_PER_CHAT_BURST = 3
+OUTBOUND_SENDERS = int(os.getenv("OUTBOUND_SENDERS", "8"))
+OUTBOUND_MAX_RETRIES = 5
+
+# Broadcasts: progress checkpoint, sends in flight and admin progress refresh interval
+BROADCAST_CHECKPOINT_FILE = os.path.join(DATA_DIR, "broadcast.json")
+BROADCAST_WINDOW = 100
+BROADCAST_PROGRESS_SECONDS = 3
+
+# Invoice PDFs are rendered on INVOICE_PROCESSES processes; with
+# INVOICE_MAX_PENDING invoices in progress a purchase waits up to
+# INVOICE_SUBMIT_TIMEOUT seconds before its invoice is given up
+INVOICE_PROCESSES = int(os.getenv("INVOICE_PROCESSES", "2"))
+INVOICE_MAX_PENDING = int(os.getenv("INVOICE_MAX_PENDING", "200"))
+INVOICE_SUBMIT_TIMEOUT = 10
+
+# Sent invoices are kept in INVOICE_ARCHIVE_DIR (PDFs named by their SHA-256,
+# indexed by invoice ID) so customers can get them again from their history;
+# the oldest are dropped once the PDFs take more than INVOICE_ARCHIVE_MAX_MB,
+# checked every INVOICE_ARCHIVE_RETENTION_SECONDS
+INVOICE_ARCHIVE_DIR = os.path.join(DATA_DIR, "invoices")
+INVOICE_ARCHIVE_MAX_MB = int(os.getenv("INVOICE_ARCHIVE_MAX_MB", "500"))
+INVOICE_ARCHIVE_RETENTION_SECONDS = int(os.getenv("INVOICE_ARCHIVE_RETENTION_SECONDS", "300"))
+
+# Images are sent by URL once and by Telegram file_id afterwards (MEDIA_CACHE_FILE);
+# on startup uncached images are uploaded to MEDIA_WARMUP_CHAT_ID and deleted
+MEDIA_CACHE_FILE = os.path.join(DATA_DIR, "media_cache.json")
+MEDIA_WARMUP_CHAT_ID = int(os.getenv("MEDIA_WARMUP_CHAT_ID", str(ADMIN_ID)))
+STARTUP_IMAGE = "https://i.imgur.com/ZLo9XQ1.jpg"
 
 # Bot Settings
 CURRENCY = "IQD"
@@ -86,6 +157,15 @@ RECHARGE_INSTRUCTIONS = """💳 تعليمات إعادة الشحن
 INVOICE_HEADER = "Thank you for purchasing from Yassin Store"
 INVOICE_FOOTER = "By: Yasiin"
 INVOICE_FILENAME = "Yasiin store"
+# "fast" (fields drawn on a canvas over a precompiled static layer) or "story" (platypus layout)
+INVOICE_RENDERER = os.getenv("INVOICE_RENDERER", "fast")
+# TTF font with Arabic and Latin glyphs (e.g. Noto Naskh Arabic or Amiri) for
+# customer and product names in invoices and reports; Arabic text is shaped
+# when arabic-reshaper and python-bidi are installed. Without the file such
+# text falls back to Helvetica. Relative paths are relative to this directory.
+INVOICE_FONT_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                 os.getenv("INVOICE_FONT_FILE", os.path.join("fonts", "NotoNaskhArabic-Regular.ttf")))
+SHAPED_TEXT_CACHE_SIZE = 4096
 INVOICE_CONTACT_INFO = f"""
 Store Information:
 Owner: {OWNER_USERNAME}
@@ -95,9 +175,27 @@ Thank you for your purchase!
 For support, contact us through the above channels.
 """
 
+# Purchase latency targets checked by benchmark.py (milliseconds)
+PURCHASE_P50_TARGET_MS = 10
+PURCHASE_P99_TARGET_MS = 100
+# Minimum speedup of the fast invoice renderer over the platypus one
+INVOICE_SPEEDUP_TARGET = 5
+
+# Conversation states of multi-step flows (recharge): "sqlite" (STATE_DATABASE_FILE,
+# survives restarts, shared by all bot processes) or "memory"
+STATE_BACKEND = os.getenv("STATE_BACKEND", "sqlite")
+STATE_DATABASE_FILE = os.path.join(DATA_DIR, "states.db")
+STATE_TTL_SECONDS = int(os.getenv("STATE_TTL_SECONDS", "3600"))
+STATE_MAX_ENTRIES = 10000
+
 # Rate Limiting Settings
 RATE_LIMIT_SECONDS = 1.5
 MAX_REQUESTS_PER_MINUTE = 15
+# "memory" (per process) or "sqlite" (RATE_LIMIT_DATABASE_FILE, shared by all
+# bot processes on the host)
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory")
+RATE_LIMIT_DATABASE_FILE = os.path.join(DATA_DIR, "ratelimit.db")
+RATE_LIMIT_MAX_ENTRIES = 100000
 
 # Security Settings
 MAX_INPUT_LENGTH = 1000
@@ -1,19 +1,21 @@
-from typing import Dict, List, Optional, Any
-import json
+import threading
+from typing import Callable, Dict, List, Optional, Any
 from datetime import datetime
-from utils import load_json, save_json, backup_json, generate_invoice_id, generate_request_id, get_current_timestamp
-from config import USERS_FILE, PRODUCTS_FILE, SALES_FILE, RECHARGE_REQUESTS_FILE
+from utils import generate_invoice_id, generate_request_id, get_current_timestamp
+from storage import create_storage
 
 class DatabaseManager:
-    def __init__(self):
+    def __init__(self, storage=None):
+        self.storage = storage or create_storage()
+        # Bumped on every product or stock change; cached catalog screens
+        # compare against catalog_version
+        self._catalog_version = 0
+        self._catalog_lock = threading.Lock()
+        self._product_listeners = []
         self.initialize_files()
     
     def initialize_files(self):
-        """Initialize all JSON files with default data"""
-        # Initialize users file
-        if not load_json(USERS_FILE):
-            save_json(USERS_FILE, {})
-        
+        """Seed the store with default data"""
         # Initialize products file with default products
         default_products = {
             "vpn_1month": {
@@ -55,63 +57,44 @@ class DatabaseManager:
             }
         }
         
-        current_products = load_json(PRODUCTS_FILE)
-        if not current_products:
-            save_json(PRODUCTS_FILE, default_products)
-        
-        # Initialize sales file
-        if not load_json(SALES_FILE):
-            save_json(SALES_FILE, {})
-        
-        # Initialize recharge requests file
-        if not load_json(RECHARGE_REQUESTS_FILE):
-            save_json(RECHARGE_REQUESTS_FILE, {})
+        if not self.storage.get_products():
+            for product_id, product_data in default_products.items():
+                self.storage.add_product(product_id, product_data)
     
     # User Management
     def get_user(self, user_id: str) -> Optional[Dict]:
         """Get user data"""
-        users = load_json(USERS_FILE)
-        return users.get(user_id)
+        return self.storage.get_user(user_id)
     
     def create_user(self, user_id: str, name: str) -> bool:
         """Create new user"""
-        users = load_json(USERS_FILE)
-        if user_id not in users:
-            users[user_id] = {
-                "balance": 0,
-                "name": name,
-                "created_at": get_current_timestamp(),
-                "total_spent": 0,
-                "purchase_count": 0,
-                "banned": False,
-                "pending_approval": True
-            }
-            return save_json(USERS_FILE, users)
-        return False
-    
-    def update_user_balance(self, user_id: str, amount: int) -> bool:
-        """Update user balance"""
-        users = load_json(USERS_FILE)
-        if user_id in users:
-            users[user_id]["balance"] += amount
-            return save_json(USERS_FILE, users)
-        return False
-    
-    def set_user_balance(self, user_id: str, balance: int) -> bool:
+        return self.storage.add_user(user_id, {
+            "balance": 0,
+            "name": name,
+            "created_at": get_current_timestamp(),
+            "total_spent": 0,
+            "purchase_count": 0,
+            "banned": False,
+            "pending_approval": True
+        })
+    
+    def update_user_balance(self, user_id: str, amount: int, reason: str = "admin", ref: Optional[str] = None) -> bool:
+        """Update user balance, ``reason``/``ref`` go to the balance log"""
+        return self.storage.adjust_user_balance(user_id, amount, reason, ref)
+    
+    def set_user_balance(self, user_id: str, balance: int, reason: str = "admin", ref: Optional[str] = None) -> bool:
         """Set user balance to specific amount"""
-        users = load_json(USERS_FILE)
-        if user_id in users:
-            users[user_id]["balance"] = balance
-            return save_json(USERS_FILE, users)
-        return False
+        return self.storage.set_user_balance(user_id, balance, reason, ref)
+    
+    def iter_broadcast_recipients(self, after: Optional[str] = None):
+        """Stream ids of approved, non-banned users in id order, starting after ``after``"""
+        for user_id, user in self.storage.iter_users(after):
+            if not user.get("banned", False) and not user.get("pending_approval", False):
+                yield user_id
     
     def ban_user(self, user_id: str, banned: bool = True) -> bool:
         """Ban or unban user"""
-        users = load_json(USERS_FILE)
-        if user_id in users:
-            users[user_id]["banned"] = banned
-            return save_json(USERS_FILE, users)
-        return False
+        return self.storage.update_user(user_id, {"banned": banned})
     
     def is_user_banned(self, user_id: str) -> bool:
         """Check if user is banned"""
@@ -120,44 +103,36 @@ class DatabaseManager:
     
     def approve_user(self, user_id: str) -> bool:
         """Approve pending user"""
-        users = load_json(USERS_FILE)
-        if user_id in users:
-            users[user_id]["pending_approval"] = False
-            users[user_id]["approved_at"] = get_current_timestamp()
-            return save_json(USERS_FILE, users)
-        return False
+        return self.storage.update_user(user_id, {
+            "pending_approval": False,
+            "approved_at": get_current_timestamp()
+        })
     
     def is_user_pending(self, user_id: str) -> bool:
         """Check if user is pending approval"""
         user = self.get_user(user_id)
         return user.get("pending_approval", False) if user else False
     
+    def delete_user(self, user_id: str) -> bool:
+        """Delete user"""
+        return self.storage.delete_user(user_id)
+    
     def get_all_users(self) -> Dict:
         """Get all users"""
-        return load_json(USERS_FILE)
+        return self.storage.get_all_users()
     
     def get_pending_users(self) -> List[Dict]:
         """Get users pending approval"""
-        users = load_json(USERS_FILE)
-        pending_users = []
-        
-        for user_id, user_data in users.items():
-            if user_data.get("pending_approval", False):
-                user_info = user_data.copy()
-                user_info["user_id"] = user_id
-                pending_users.append(user_info)
-        
-        return pending_users
+        return self.storage.get_pending_users()
     
     # Product Management
     def get_products(self) -> Dict:
         """Get all products"""
-        return load_json(PRODUCTS_FILE)
+        return self.storage.get_products()
     
     def get_product(self, product_id: str) -> Optional[Dict]:
         """Get specific product"""
-        products = self.get_products()
-        return products.get(product_id)
+        return self.storage.get_product(product_id)
     
     def get_available_products(self) -> Dict:
         """Get products that are active and have stock"""
@@ -167,7 +142,7 @@ class DatabaseManager:
             # Check if product is active (default to True for backward compatibility)
             is_active = product.get("active", True)
             # Check if product has codes available
-            has_stock = len(product.get("codes", [])) > 0
+            has_stock = product.get("stock", 0) > 0
             
             if is_active and has_stock:
                 available[product_id] = product
@@ -175,109 +150,90 @@ class DatabaseManager:
     
     def add_product_code(self, product_id: str, code: str) -> bool:
         """Add code to product"""
-        products = load_json(PRODUCTS_FILE)
-        if product_id in products:
-            if "codes" not in products[product_id]:
-                products[product_id]["codes"] = []
-            products[product_id]["codes"].append(code)
-            return save_json(PRODUCTS_FILE, products)
-        return False
+        return self._catalog_changed(self.storage.add_product_code(product_id, code))
+    
+    def add_product_codes(self, product_id: str, codes: List[str]) -> bool:
+        """Add several codes to product"""
+        return self._catalog_changed(self.storage.add_product_codes(product_id, codes))
     
     def remove_product_code(self, product_id: str) -> Optional[str]:
         """Remove and return first available code"""
-        products = load_json(PRODUCTS_FILE)
-        if product_id in products and products[product_id].get("codes"):
-            code = products[product_id]["codes"].pop(0)
-            save_json(PRODUCTS_FILE, products)
-            return code
-        return None
+        return self._catalog_changed(self.storage.pop_product_code(product_id))
     
     def update_product(self, product_id: str, updates: Dict) -> bool:
         """Update product information"""
-        products = load_json(PRODUCTS_FILE)
-        if product_id in products:
-            products[product_id].update(updates)
-            return save_json(PRODUCTS_FILE, products)
-        return False
+        before = self.get_product(product_id) if self._product_listeners else None
+        if not self._catalog_changed(self.storage.update_product(product_id, updates)):
+            return False
+        self._notify_product_change(product_id, before)
+        return True
     
     def create_product(self, product_id: str, product_data: Dict) -> bool:
         """Create new product"""
-        products = load_json(PRODUCTS_FILE)
-        if product_id not in products:
-            products[product_id] = product_data
-            return save_json(PRODUCTS_FILE, products)
-        return False
+        if not self._catalog_changed(self.storage.add_product(product_id, product_data)):
+            return False
+        self._notify_product_change(product_id, None)
+        return True
     
     def delete_product(self, product_id: str) -> bool:
         """Delete product"""
-        products = load_json(PRODUCTS_FILE)
-        if product_id in products:
-            del products[product_id]
-            return save_json(PRODUCTS_FILE, products)
-        return False
+        before = self.get_product(product_id) if self._product_listeners else None
+        if not self._catalog_changed(self.storage.delete_product(product_id)):
+            return False
+        self._notify_product_change(product_id, before)
+        return True
+    
+    def add_product_listener(self, listener: Callable[[str, Optional[Dict], Optional[Dict]], None]) -> None:
+        """Call ``listener(product_id, before, after)`` after a product is created, updated or deleted"""
+        self._product_listeners.append(listener)
+    
+    def _notify_product_change(self, product_id: str, before: Optional[Dict]) -> None:
+        if not self._product_listeners:
+            return
+        after = self.get_product(product_id)
+        for listener in self._product_listeners:
+            try:
+                listener(product_id, before, after)
+            except Exception as e:
+                print(f"Product listener failed for {product_id}: {e}")
+    
+    @property
+    def catalog_version(self) -> int:
+        """Product change counter, shared by all processes on the SQLite backend"""
+        shared = self.storage.catalog_version()
+        return self._catalog_version if shared is None else shared
+    
+    def _catalog_changed(self, result):
+        """Invalidate cached catalog screens if the change went through"""
+        if result:
+            with self._catalog_lock:
+                self._catalog_version += 1
+        return result
     
     # Sales Management
-    def record_sale(self, user_id: str, product_name: str, code: str, price: int) -> str:
-        """Record a sale and return invoice ID"""
-        sales = load_json(SALES_FILE)
-        users = load_json(USERS_FILE)
-        
-        if user_id not in sales:
-            sales[user_id] = []
-        
-        invoice_id = generate_invoice_id()
-        sale_record = {
-            "product": product_name,
-            "code": code,
-            "price": price,
-            "date": get_current_timestamp(),
-            "invoice_id": invoice_id
-        }
-        
-        sales[user_id].append(sale_record)
-        save_json(SALES_FILE, sales)
-        
-        # Update user statistics
-        if user_id in users:
-            users[user_id]["total_spent"] = users[user_id].get("total_spent", 0) + price
-            users[user_id]["purchase_count"] = users[user_id].get("purchase_count", 0) + 1
-            save_json(USERS_FILE, users)
-        
-        return invoice_id
+    def get_user_purchases(self, user_id: str, limit: Optional[int] = None) -> List[Dict]:
+        """Get user purchase history, optionally only the last ``limit`` purchases"""
+        return self.storage.get_user_sales(user_id, limit)
     
-    def get_user_purchases(self, user_id: str) -> List[Dict]:
-        """Get user purchase history"""
-        sales = load_json(SALES_FILE)
-        return sales.get(user_id, [])
+    def iter_sales(self, start: Optional[str] = None, end: Optional[str] = None):
+        """Stream (user_id, sale) pairs with start <= date < end"""
+        return self.storage.iter_sales(start, end)
     
     def get_all_sales(self) -> Dict:
         """Get all sales data"""
-        return load_json(SALES_FILE)
+        return self.storage.get_all_sales()
     
     def get_sales_stats(self) -> Dict:
-        """Get sales statistics"""
-        sales = load_json(SALES_FILE)
-        total_sales = 0
-        total_revenue = 0
-        
-        for user_sales in sales.values():
-            total_sales += len(user_sales)
-            total_revenue += sum(sale["price"] for sale in user_sales)
-        
-        return {
-            "total_sales": total_sales,
-            "total_revenue": total_revenue,
-            "unique_customers": len(sales)
-        }
+        """Get sales statistics: totals plus per-product and per-day counters"""
+        return self.storage.get_sales_stats()
+    
+    def rebuild_sales_stats(self) -> Dict:
+        """Recompute sales statistics from the stored sales"""
+        return self.storage.rebuild_sales_stats()
     
     # Recharge Request Management
     def create_recharge_request(self, user_id: str, amount: int, transfer_date: str = None, receipt_photo: str = None) -> str:
         """Create recharge request with transfer details"""
-        requests = load_json(RECHARGE_REQUESTS_FILE)
-        
-        if user_id not in requests:
-            requests[user_id] = []
-        
         request_id = generate_request_id()
         request_data = {
             "amount": amount,
@@ -288,120 +244,93 @@ class DatabaseManager:
             "receipt_photo": receipt_photo
         }
         
-        requests[user_id].append(request_data)
-        save_json(RECHARGE_REQUESTS_FILE, requests)
+        self.storage.add_recharge_request(user_id, request_data)
         return request_id
     
     def get_recharge_requests(self, status: str = None) -> Dict:
         """Get recharge requests, optionally filtered by status"""
-        requests = load_json(RECHARGE_REQUESTS_FILE)
-        if status:
-            filtered_requests = {}
-            for user_id, user_requests in requests.items():
-                filtered_user_requests = [req for req in user_requests if req.get("status") == status]
-                if filtered_user_requests:
-                    filtered_requests[user_id] = filtered_user_requests
-            return filtered_requests
-        return requests
+        return self.storage.get_recharge_requests(status)
     
     def update_recharge_request(self, user_id: str, request_id: str, status: str) -> bool:
         """Update recharge request status"""
-        requests = load_json(RECHARGE_REQUESTS_FILE)
-        
-        if user_id in requests:
-            for request in requests[user_id]:
-                if request.get("request_id") == request_id:
-                    request["status"] = status
-                    request["processed_at"] = get_current_timestamp()
-                    return save_json(RECHARGE_REQUESTS_FILE, requests)
-        return False
+        return self.storage.update_recharge_request(user_id, request_id, {
+            "status": status,
+            "processed_at": get_current_timestamp()
+        })
     
     def get_pending_recharge_requests(self) -> List[Dict]:
         """Get all pending recharge requests with user info"""
-        requests = load_json(RECHARGE_REQUESTS_FILE)
-        users = load_json(USERS_FILE)
+        requests = self.get_recharge_requests("pending")
         pending_requests = []
         
         for user_id, user_requests in requests.items():
-            user_info = users.get(user_id, {})
+            user_info = self.get_user(user_id) or {}
             for request in user_requests:
-                if request.get("status") == "pending":
-                    request_info = request.copy()
-                    request_info["user_id"] = user_id
-                    request_info["user_name"] = user_info.get("name", "مستخدم غير معروف")
-                    pending_requests.append(request_info)
+                request_info = request.copy()
+                request_info["user_id"] = user_id
+                request_info["user_name"] = user_info.get("name", "مستخدم غير معروف")
+                pending_requests.append(request_info)
         
         return pending_requests
     
     # Process purchase transaction
     def process_purchase(self, user_id: str, product_id: str) -> Dict:
-        """Process complete purchase transaction"""
+        """Process complete purchase transaction
+        
+        The balance/stock check, code removal, balance deduction and sale
+        record are committed by the storage backend as one unit: a single
+        transaction in SQLite, a single journaled WAL entry in JSON storage.
+        Buyers of the same product are serialized; different products are
+        bought in parallel.
+        """
         result = {"success": False, "message": "", "data": {}}
         
         try:
-            # Get user and product data
-            user = self.get_user(user_id)
-            product = self.get_product(product_id)
+            outcome = self.storage.purchase(
+                user_id, product_id, generate_invoice_id(), get_current_timestamp()
+            )
             
-            if not user:
+            status = outcome["status"]
+            if status == "no_user":
                 result["message"] = "المستخدم غير موجود"
-                return result
-            
-            if not product:
+            elif status == "no_product":
                 result["message"] = "المنتج غير موجود"
-                return result
-            
-            # Check if user has sufficient balance
-            user_balance = user.get("balance", 0)
-            product_price = product.get("price", 0)
-            
-            if user_balance < product_price:
-                result["message"] = f"رصيدك غير كافي. تحتاج إلى {product_price - user_balance:,} {self.get_currency()} إضافية"
-                return result
-            
-            # Check if product has available codes
-            available_codes = product.get("codes", [])
-            if not available_codes:
+            elif status == "insufficient_balance":
+                result["message"] = f"رصيدك غير كافي. تحتاج إلى {outcome['price'] - outcome['balance']:,} {self.get_currency()} إضافية"
+            elif status == "out_of_stock":
                 result["message"] = "المنتج غير متوفر حالياً"
-                return result
-            
-            # Process the purchase
-            product_code = self.remove_product_code(product_id)
-            if not product_code:
-                result["message"] = "فشل في الحصول على كود المنتج"
-                return result
-            
-            # Deduct balance
-            new_balance = user_balance - product_price
-            if not self.set_user_balance(user_id, new_balance):
-                # Restore the code if balance update fails
-                self.add_product_code(product_id, product_code)
+            elif status == "write_failed":
                 result["message"] = "فشل في تحديث الرصيد"
-                return result
-            
-            # Record the sale
-            invoice_id = self.record_sale(
-                user_id=user_id,
-                product_name=product.get("name", "منتج غير معروف"),
-                code=product_code,
-                price=product_price
-            )
-            
-            result["success"] = True
-            result["message"] = "تم الشراء بنجاح"
-            result["data"] = {
-                "product_name": product.get("name"),
-                "code": product_code,
-                "price": product_price,
-                "invoice_id": invoice_id,
-                "new_balance": new_balance
-            }
+            else:
+                self._catalog_changed(True)
+                result["success"] = True
+                result["message"] = "تم الشراء بنجاح"
+                result["data"] = {
+                    "product_name": outcome["product_name"],
+                    "code": outcome["code"],
+                    "price": outcome["price"],
+                    "invoice_id": outcome["invoice_id"],
+                    "new_balance": outcome["balance"]
+                }
             
         except Exception as e:
             result["message"] = f"حدث خطأ أثناء معالجة الطلب: {str(e)}"
             
         return result
     
+    # Storage maintenance
+    def flush(self) -> bool:
+        """Write pending changes to disk"""
+        return self.storage.flush()
+    
+    def get_storage_metrics(self) -> Dict:
+        """Get storage write metrics"""
+        return self.storage.get_metrics()
+    
+    def compact_balance_log(self) -> int:
+        """Fold the balance write-ahead log into the users snapshot"""
+        return self.storage.compact_wal()
+    
     def get_currency(self) -> str:
         """Get currency symbol"""
         from config import CURRENCY
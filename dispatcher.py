@@ -0,0 +1,116 @@
+import queue
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+# Update fields that carry the user who triggered the update
+USER_FIELDS = ("message", "edited_message", "callback_query", "inline_query", "chosen_inline_result",
+               "shipping_query", "pre_checkout_query", "my_chat_member", "chat_member", "chat_join_request")
+
+def update_user_id(update) -> Optional[int]:
+    """Get the id of the user an update belongs to"""
+    for field in USER_FIELDS:
+        event = getattr(update, field, None)
+        user = getattr(event, "from_user", None)
+        if user is not None:
+            return user.id
+    poll_answer = getattr(update, "poll_answer", None)
+    if poll_answer is not None and getattr(poll_answer, "user", None) is not None:
+        return poll_answer.user.id
+    return None
+
+class UpdateDispatcher:
+    """Worker pool that processes updates in parallel with per-user ordering.
+
+    Each worker owns a FIFO queue and updates are routed by user id, so all
+    updates of one user run on the same worker in arrival order while other
+    users are served by the remaining workers. Updates without a user are
+    spread by update id. ``on_start``, if set, is called with each update
+    right before its handler runs.
+    """
+
+    def __init__(self, handler: Callable[[List], None], workers: int = 8):
+        if workers < 1:
+            raise ValueError("Worker pool needs at least one worker")
+        self.handler = handler
+        self.on_start = None
+        self.started_at = time.monotonic()
+        self._queues = [queue.Queue() for _ in range(workers)]
+        self._stats = [{"processed": 0, "errors": 0, "busy_seconds": 0.0, "busy_since": None} for _ in range(workers)]
+        self._threads = []
+        for index in range(workers):
+            thread = threading.Thread(target=self._run, args=(index,), name=f"update-worker-{index}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _worker_for(self, update) -> int:
+        user_id = update_user_id(update)
+        key = user_id if user_id is not None else getattr(update, "update_id", 0)
+        return hash(key) % len(self._queues)
+
+    def dispatch(self, updates: List) -> None:
+        """Queue updates on their users' workers (drop-in for process_new_updates)"""
+        for update in updates:
+            self._queues[self._worker_for(update)].put(update)
+
+    def _run(self, index: int) -> None:
+        updates = self._queues[index]
+        stats = self._stats[index]
+        while True:
+            update = updates.get()
+            if update is None:
+                updates.task_done()
+                return
+            started = time.monotonic()
+            stats["busy_since"] = started
+            try:
+                if self.on_start is not None:
+                    self.on_start(update)
+                self.handler([update])
+            except Exception as e:
+                stats["errors"] += 1
+                print(f"Error processing update {getattr(update, 'update_id', '?')}: {e}")
+            finally:
+                stats["busy_since"] = None
+                stats["busy_seconds"] += time.monotonic() - started
+                stats["processed"] += 1
+                updates.task_done()
+
+    def queue_depth(self) -> int:
+        """Updates waiting across all workers"""
+        return sum(updates.qsize() for updates in self._queues)
+
+    def stats(self) -> Dict:
+        """Queue depth and per-worker utilization since start"""
+        now = time.monotonic()
+        uptime = max(now - self.started_at, 1e-9)
+        workers = []
+        for updates, stats in zip(self._queues, self._stats):
+            busy = stats["busy_seconds"]
+            if stats["busy_since"] is not None:
+                busy += now - stats["busy_since"]
+            workers.append({
+                "queue_depth": updates.qsize(),
+                "processed": stats["processed"],
+                "errors": stats["errors"],
+                "busy": stats["busy_since"] is not None,
+                "utilization": min(busy / uptime, 1.0)
+            })
+        return {
+            "workers": len(workers),
+            "queue_depth": sum(worker["queue_depth"] for worker in workers),
+            "processed": sum(worker["processed"] for worker in workers),
+            "per_worker": workers
+        }
+
+    def join(self) -> None:
+        """Wait until every queued update is processed"""
+        for updates in self._queues:
+            updates.join()
+
+    def stop(self) -> None:
+        """Finish queued updates and stop the workers"""
+        for updates in self._queues:
+            updates.put(None)
+        for thread in self._threads:
+            thread.join()
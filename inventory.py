@@ -0,0 +1,165 @@
+import json
+import os
+import threading
+from typing import Dict, Iterator, List, Optional, Tuple
+from urllib.parse import quote
+from config import INVENTORY_DIR
+
+class CodeInventory:
+    """Per-product queues of unsold product codes.
+
+    Codes of a product live in an append-only ``<product>.codes`` file, one
+    JSON string per line. Handing out a code reads the line at the current
+    read offset and appends the new offset to ``<product>.taken``, so a sale
+    never rewrites the remaining stock. Stock counts are kept as counters.
+    """
+
+    def __init__(self, directory: str = INVENTORY_DIR):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.RLock()
+        self._queues = {}
+
+    def _paths(self, product_id: str) -> tuple:
+        base = os.path.join(self.directory, quote(product_id, safe=""))
+        return base + ".codes", base + ".taken"
+
+    def _read_offset(self, taken_path: str) -> int:
+        """Read the last complete offset from the taken log.
+
+        A partial line left by a crash is cut off, otherwise the next offset
+        would be appended to it and read back as one bogus number.
+        """
+        if not os.path.exists(taken_path):
+            return 0
+        with open(taken_path, "r+b") as f:
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+            f.seek(max(0, size - 64))
+            tail = f.read()
+            lines = tail.split(b"\n")
+            if lines[-1]:
+                f.truncate(size - len(lines[-1]))
+        lines = lines[:-1]  # drop the partial line after the last newline
+        return int(lines[-1]) if lines and lines[-1] else 0
+
+    def _queue(self, product_id: str) -> Dict:
+        """Get queue state, loading it from disk on first use"""
+        queue = self._queues.get(product_id)
+        if queue is not None:
+            return queue
+
+        codes_path, taken_path = self._paths(product_id)
+        offset = self._read_offset(taken_path)
+        count = 0
+        size = os.path.getsize(codes_path) if os.path.exists(codes_path) else 0
+        offset = min(offset, size)
+        if offset < size:
+            with open(codes_path, "rb") as f:
+                f.seek(offset)
+                for chunk in iter(lambda: f.read(1 << 20), b""):
+                    count += chunk.count(b"\n")
+        queue = {"offset": offset, "count": count}
+        self._queues[product_id] = queue
+        return queue
+
+    def exists(self, product_id: str) -> bool:
+        """Check if the product has an inventory on disk"""
+        return os.path.exists(self._paths(product_id)[0])
+
+    def count(self, product_id: str) -> int:
+        """Number of unsold codes"""
+        with self._lock:
+            return self._queue(product_id)["count"]
+
+    def add(self, product_id: str, codes: List[str]) -> int:
+        """Append codes to the end of the queue, returns the new stock count"""
+        with self._lock:
+            queue = self._queue(product_id)
+            if queue["count"] == 0 and queue["offset"] > 0:
+                self.clear(product_id)
+                queue = self._queue(product_id)
+
+            data = "".join(json.dumps(code, ensure_ascii=False) + "\n" for code in codes).encode("utf-8")
+            codes_path, _ = self._paths(product_id)
+            with open(codes_path, "ab") as f:
+                f.write(data)
+            queue["count"] += len(codes)
+            return queue["count"]
+
+    def peek(self, product_id: str) -> Tuple[Optional[str], int]:
+        """First unsold code and the read offset after it, (None, offset) when empty"""
+        with self._lock:
+            queue = self._queue(product_id)
+            if queue["count"] == 0:
+                return None, queue["offset"]
+            codes_path, _ = self._paths(product_id)
+            with open(codes_path, "rb") as f:
+                f.seek(queue["offset"])
+                line = f.readline()
+            return json.loads(line.decode("utf-8")), queue["offset"] + len(line)
+
+    def take(self, product_id: str, code: str, offset: int) -> bool:
+        """Mark ``code`` ending at ``offset`` as sold.
+
+        Idempotent, so journaled purchases can be replayed: an offset the
+        queue already moved past is ignored, the current offset is written to
+        the taken log again, and the next code is only taken if it is
+        ``code``. Returns False if the code is not (or no longer) the head of
+        the queue.
+        """
+        with self._lock:
+            queue = self._queue(product_id)
+            if offset > queue["offset"]:
+                if self.peek(product_id) != (code, offset):
+                    return False
+                queue["offset"] = offset
+                queue["count"] -= 1
+            elif offset < queue["offset"]:
+                return False
+            _, taken_path = self._paths(product_id)
+            with open(taken_path, "a") as f:
+                f.write(f"{offset}\n")
+            return True
+
+    def pop(self, product_id: str) -> Optional[str]:
+        """Remove and return the first unsold code"""
+        with self._lock:
+            code, offset = self.peek(product_id)
+            if code is not None:
+                self.take(product_id, code, offset)
+            return code
+
+    def remaining(self, product_id: str) -> Iterator[str]:
+        """Stream the unsold codes of a product without removing them"""
+        with self._lock:
+            offset = self._queue(product_id)["offset"]
+        codes_path, _ = self._paths(product_id)
+        if not os.path.exists(codes_path):
+            return
+        with open(codes_path, "rb") as f:
+            f.seek(offset)
+            for line in f:
+                yield json.loads(line.decode("utf-8"))
+
+    def clear(self, product_id: str) -> None:
+        """Drop all codes of a product.
+
+        The codes file is truncated before the taken log, so a crash in
+        between leaves an offset past the end of an empty file, which loads
+        as an empty queue.
+        """
+        with self._lock:
+            codes_path, taken_path = self._paths(product_id)
+            for path in (codes_path, taken_path):
+                if os.path.exists(path):
+                    open(path, "wb").close()
+            self._queues[product_id] = {"offset": 0, "count": 0}
+
+    def delete(self, product_id: str) -> None:
+        """Remove the inventory files of a product"""
+        with self._lock:
+            for path in self._paths(product_id):
+                if os.path.exists(path):
+                    os.remove(path)
+            self._queues.pop(product_id, None)
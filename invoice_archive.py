@@ -0,0 +1,147 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Optional
+from utils import ensure_directory
+from config import INVOICE_ARCHIVE_DIR, INVOICE_ARCHIVE_MAX_MB, INVOICE_ARCHIVE_RETENTION_SECONDS
+
+class InvoiceArchive:
+    """Rendered invoice PDFs on disk, content addressed.
+
+    Each PDF is stored once as ``<dir>/<sha[:2]>/<sha>.pdf``; a SQLite index
+    in the same directory maps invoice IDs to their owner, hash and size,
+    plus the Telegram ``file_id`` of the sent document once known. Every
+    invoice PDF embeds its own invoice ID, so in practice no two invoices
+    share a blob; the hash names the file and lets ``read`` detect damage.
+
+    Every ``retention_interval`` seconds a background thread drops the
+    oldest invoices from the index, and deletes their files, while the
+    stored PDFs exceed ``max_bytes``; ``store`` itself never scans the
+    archive. The index is shared by every bot process on the host.
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS invoices (
+        invoice_id TEXT PRIMARY KEY,
+        user_id TEXT NOT NULL,
+        sha256 TEXT NOT NULL,
+        size INTEGER NOT NULL,
+        created REAL NOT NULL,
+        file_id TEXT
+    );
+    CREATE INDEX IF NOT EXISTS idx_invoices_sha256 ON invoices (sha256);
+    CREATE INDEX IF NOT EXISTS idx_invoices_created ON invoices (created);
+    """
+
+    def __init__(self, directory: str = INVOICE_ARCHIVE_DIR, max_bytes: int = INVOICE_ARCHIVE_MAX_MB * 1024 * 1024,
+                 retention_interval: int = INVOICE_ARCHIVE_RETENTION_SECONDS):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.path = os.path.join(directory, "index.db")
+        self._local = threading.local()
+        ensure_directory(self.path)
+        conn = self._conn()
+        conn.executescript(self.SCHEMA)
+        conn.commit()
+        if retention_interval > 0:
+            threading.Thread(target=self._retention_loop, args=(retention_interval,),
+                             name="invoice-retention", daemon=True).start()
+
+    def _conn(self) -> sqlite3.Connection:
+        """Get the connection of the current thread"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _blob_path(self, sha256: str) -> str:
+        return os.path.join(self.directory, sha256[:2], f"{sha256}.pdf")
+
+    def store(self, invoice_id: str, user_id: str, pdf: bytes) -> str:
+        """Archive an invoice's PDF and return its hash"""
+        sha256 = hashlib.sha256(pdf).hexdigest()
+        path = self._blob_path(sha256)
+        if not os.path.exists(path):
+            ensure_directory(path)
+            temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(temp_path, "wb") as f:
+                f.write(pdf)
+            os.replace(temp_path, path)
+        conn = self._conn()
+        with conn:
+            conn.execute("INSERT OR REPLACE INTO invoices (invoice_id, user_id, sha256, size, created, file_id) "
+                         "VALUES (?, ?, ?, ?, ?, NULL)", (invoice_id, str(user_id), sha256, len(pdf), time.time()))
+        return sha256
+
+    def _retention_loop(self, interval: int) -> None:
+        while True:
+            time.sleep(interval)
+            try:
+                self.enforce_retention()
+            except Exception as e:
+                print(f"Error enforcing invoice archive retention: {e}")
+
+    def enforce_retention(self) -> None:
+        """Drop the oldest invoices until the stored PDFs fit in max_bytes"""
+        conn = self._conn()
+        with conn:
+            total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM "
+                                 "(SELECT sha256, MAX(size) AS size FROM invoices GROUP BY sha256)").fetchone()[0]
+            if total <= self.max_bytes:
+                return
+            dropped = []
+            for invoice_id, sha256, size in conn.execute(
+                    "SELECT invoice_id, sha256, size FROM invoices ORDER BY created").fetchall():
+                if total <= self.max_bytes:
+                    break
+                conn.execute("DELETE FROM invoices WHERE invoice_id = ?", (invoice_id,))
+                if conn.execute("SELECT 1 FROM invoices WHERE sha256 = ? LIMIT 1", (sha256,)).fetchone() is None:
+                    total -= size
+                    dropped.append(sha256)
+        for sha256 in dropped:
+            try:
+                os.remove(self._blob_path(sha256))
+            except FileNotFoundError:
+                pass
+
+    def get(self, invoice_id: str) -> Optional[Dict]:
+        """Index entry of an archived invoice, None if it is not archived"""
+        row = self._conn().execute("SELECT user_id, sha256, size, created, file_id FROM invoices "
+                                   "WHERE invoice_id = ?", (invoice_id,)).fetchone()
+        if row is None:
+            return None
+        return {"invoice_id": invoice_id, "user_id": row[0], "sha256": row[1], "size": row[2],
+                "created": row[3], "file_id": row[4]}
+
+    def read(self, invoice_id: str) -> Optional[bytes]:
+        """The archived PDF, None if it is missing or does not match its hash"""
+        entry = self.get(invoice_id)
+        if entry is None:
+            return None
+        try:
+            with open(self._blob_path(entry["sha256"]), "rb") as f:
+                pdf = f.read()
+        except OSError:
+            return None
+        if hashlib.sha256(pdf).hexdigest() != entry["sha256"]:
+            print(f"Archived invoice {invoice_id} is corrupt")
+            return None
+        return pdf
+
+    def set_file_id(self, invoice_id: str, file_id: Optional[str]) -> None:
+        """Remember (or with None, forget) the Telegram file_id of a sent invoice"""
+        conn = self._conn()
+        with conn:
+            conn.execute("UPDATE invoices SET file_id = ? WHERE invoice_id = ?", (file_id, invoice_id))
+
+    def stats(self) -> Dict:
+        """Archived invoices and the bytes of their stored PDFs, each shared PDF counted once"""
+        row = self._conn().execute(
+            "SELECT (SELECT COUNT(*) FROM invoices), "
+            "(SELECT COALESCE(SUM(size), 0) FROM (SELECT DISTINCT sha256, size FROM invoices))").fetchone()
+        return {"invoices": row[0], "bytes": row[1], "max_bytes": self.max_bytes}
@@ -0,0 +1,234 @@
+import multiprocessing
+import queue
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Dict
+import invoice_worker
+from outbound import PRIORITY_HIGH
+from utils import percentile
+from config import INVOICE_PROCESSES, INVOICE_MAX_PENDING, INVOICE_SUBMIT_TIMEOUT, INVOICE_FILENAME
+
+def start_render_pool(processes: int = INVOICE_PROCESSES) -> ProcessPoolExecutor:
+    """Start the invoice render processes
+
+    The processes fork from a forkserver that has imported only
+    invoice_worker, never from the bot, so they inherit none of its threads
+    or locks and the pool can be started, or replaced, from any thread.
+    Like spawn, the forkserver runs the entry script again in every process
+    as ``__mp_main__``; main.py skips its setup there. Processes start as
+    jobs arrive; the first one is started here so a broken PDF setup shows
+    at startup.
+    """
+    context = multiprocessing.get_context("forkserver")
+    context.set_forkserver_preload(["invoice_worker"])
+    pool = ProcessPoolExecutor(max_workers=processes, mp_context=context,
+                               initializer=invoice_worker.init_renderer)
+    pool.submit(invoice_worker.ready).result()
+    return pool
+
+
+class InvoiceJobs:
+    """Renders invoice PDFs on a process pool and sends them when ready.
+
+    PDF layout is CPU bound; in a pool process it no longer holds the GIL
+    of the process serving updates. At most ``max_pending`` invoices are
+    queued or rendering; ``submit`` waits up to ``submit_timeout`` seconds
+    for a free slot and gives up after that. With an ``archive``, rendered
+    PDFs and the file_ids they were sent as are kept for ``resend``; archive
+    writes run in order on their own thread, off the pool's management
+    thread and the outbound senders. When a
+    render process dies the pool is broken for good; it is replaced with
+    one from ``pool_factory``, on a thread of its own rather than the
+    broken pool's management thread, and the invoices it lost are rendered
+    again once.
+    """
+
+    def __init__(self, outbound, executor: ProcessPoolExecutor, max_pending: int = INVOICE_MAX_PENDING,
+                 submit_timeout: float = INVOICE_SUBMIT_TIMEOUT, archive=None,
+                 pool_factory: Callable[[], ProcessPoolExecutor] = start_render_pool):
+        self.outbound = outbound
+        self.executor = executor
+        self.pool_factory = pool_factory
+        self._pool_lock = threading.Lock()
+        self.archive = archive
+        self.max_pending = max_pending
+        self.submit_timeout = submit_timeout
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._counters = {"submitted": 0, "rendered": 0, "failed": 0, "rejected": 0, "resent": 0, "pool_restarts": 0}
+        self._render_times = deque(maxlen=1000)
+        self._archive_writes = queue.Queue()
+        self._archiver = None
+        if archive is not None:
+            self._archiver = threading.Thread(target=self._archive_loop, name="invoice-archive", daemon=True)
+            self._archiver.start()
+
+    def _archive_loop(self) -> None:
+        while True:
+            write = self._archive_writes.get()
+            if write is None:
+                return
+            method, invoice_id, args = write
+            try:
+                getattr(self.archive, method)(invoice_id, *args)
+            except Exception as e:
+                print(f"Archive {method} of invoice {invoice_id} failed: {e}")
+
+    def _archive_write(self, method: str, invoice_id: str, *args) -> None:
+        if self.archive is not None:
+            self._archive_writes.put((method, invoice_id, args))
+
+    def submit(self, chat_id: int, sale_data: Dict[str, Any], user_data: Dict[str, Any]) -> bool:
+        """Queue an invoice for ``chat_id``, False if the backlog stayed full"""
+        if not self._slots.acquire(timeout=self.submit_timeout):
+            with self._lock:
+                self._counters["rejected"] += 1
+            return False
+        with self._lock:
+            self._pending += 1
+            self._counters["submitted"] += 1
+        try:
+            self._render(chat_id, sale_data, user_data, retry=True)
+        except Exception:
+            self._release()
+            raise
+        return True
+
+    def _render(self, chat_id: int, sale_data: Dict[str, Any], user_data: Dict[str, Any], retry: bool) -> None:
+        executor = self.executor
+        try:
+            future = executor.submit(invoice_worker.render_invoice, sale_data, user_data)
+        except BrokenProcessPool:
+            self._replace_pool(executor)
+            future = self.executor.submit(invoice_worker.render_invoice, sale_data, user_data)
+        future.add_done_callback(lambda done: self._rendered(chat_id, sale_data, user_data, done, executor, retry))
+
+    def _replace_pool(self, broken: ProcessPoolExecutor) -> None:
+        """Start a new render pool unless another thread already replaced ``broken``"""
+        with self._pool_lock:
+            if self.executor is not broken:
+                return
+            print("Invoice render pool broke, starting a new one")
+            self.executor = self.pool_factory()
+            with self._lock:
+                self._counters["pool_restarts"] += 1
+        broken.shutdown(wait=False)
+
+    def _release(self) -> None:
+        with self._lock:
+            self._pending -= 1
+        self._slots.release()
+
+    def _rendered(self, chat_id: int, sale_data: Dict[str, Any], user_data: Dict[str, Any], future,
+                  executor: ProcessPoolExecutor, retry: bool) -> None:
+        # Runs on the pool's management thread: only queue the sends here
+        if retry and isinstance(future.exception(), BrokenProcessPool):
+            threading.Thread(target=self._render_again, args=(chat_id, sale_data, user_data, executor),
+                             name="invoice-pool-restart", daemon=True).start()
+            return
+        self._release()
+        try:
+            pdf, seconds = future.result()
+        except Exception as e:
+            self._failed(chat_id, sale_data, e)
+            return
+        with self._lock:
+            self._counters["rendered"] += 1
+            self._render_times.append(seconds)
+        invoice_id = sale_data.get('invoice_id')
+        self._archive_write("store", invoice_id, user_data.get('user_id'), pdf)
+        self._send_pdf(chat_id, invoice_id, pdf, PRIORITY_HIGH)
+
+    def _render_again(self, chat_id: int, sale_data: Dict[str, Any], user_data: Dict[str, Any],
+                      broken: ProcessPoolExecutor) -> None:
+        """Render an invoice lost with ``broken`` on a new pool"""
+        try:
+            self._replace_pool(broken)
+            self._render(chat_id, sale_data, user_data, retry=False)
+        except Exception as e:
+            print(f"Restarting invoice render pool failed: {e}")
+            self._release()
+            self._failed(chat_id, sale_data, e)
+
+    def _failed(self, chat_id: int, sale_data: Dict[str, Any], error: Exception) -> None:
+        with self._lock:
+            self._counters["failed"] += 1
+        print(f"PDF generation error for {sale_data.get('invoice_id')}: {error}")
+        self.outbound.submit("send_message", chat_id, "❌ حدث خطأ في إنشاء الفاتورة")
+
+    def _send_pdf(self, chat_id: int, invoice_id: str, pdf: bytes, priority: int):
+        # Raw bytes rather than a file object, so a retried send uploads it again
+        sent = self.outbound.submit("send_document", chat_id, pdf,
+                                    visible_file_name=f"{INVOICE_FILENAME}.pdf", priority=priority)
+        sent.add_done_callback(lambda done: self._delivered(invoice_id, done))
+        return sent
+
+    def _delivered(self, invoice_id: str, future) -> None:
+        if future.exception() is not None:
+            print(f"Sending invoice {invoice_id} failed: {future.exception()}")
+            return
+        document = getattr(future.result(), "document", None)
+        if document is not None:
+            self._archive_write("set_file_id", invoice_id, document.file_id)
+
+    def resend(self, chat_id: int, invoice_id: str) -> bool:
+        """Send an archived invoice again without rendering it, False if it is not archived
+
+        The caller checks that the invoice belongs to the user. The cached
+        file_id is tried first; if Telegram rejects it the archived PDF is
+        uploaded instead.
+        """
+        entry = self.archive.get(invoice_id) if self.archive is not None else None
+        if entry is None:
+            return False
+        with self._lock:
+            self._counters["resent"] += 1
+        if entry["file_id"]:
+            sent = self.outbound.submit("send_document", chat_id, entry["file_id"], priority=PRIORITY_HIGH)
+            sent.add_done_callback(lambda done: self._resent(chat_id, invoice_id, done))
+            return True
+        pdf = self.archive.read(invoice_id)
+        if pdf is None:
+            return False
+        self._send_pdf(chat_id, invoice_id, pdf, PRIORITY_HIGH)
+        return True
+
+    def _resent(self, chat_id: int, invoice_id: str, future) -> None:
+        error = future.exception()
+        if error is None:
+            return
+        if getattr(error, "error_code", None) != 400:
+            print(f"Resending invoice {invoice_id} failed: {error}")
+            return
+        print(f"Cached file_id of invoice {invoice_id} rejected, uploading the PDF: {error}")
+        self._archive_write("set_file_id", invoice_id, None)
+        pdf = self.archive.read(invoice_id)
+        if pdf is None:
+            self.outbound.submit("send_message", chat_id, "❌ الفاتورة غير متوفرة")
+            return
+        self._send_pdf(chat_id, invoice_id, pdf, PRIORITY_HIGH)
+
+    def backlog(self) -> int:
+        """Invoices queued or rendering"""
+        return self._pending
+
+    def stats(self) -> Dict:
+        """Counters, backlog and render time percentiles in ms"""
+        with self._lock:
+            samples = list(self._render_times)
+            stats = dict(self._counters, backlog=self._pending)
+        for pct in (50, 95, 99):
+            stats[f"render_p{pct}_ms"] = percentile(samples, pct) * 1000
+        if self.archive is not None:
+            stats["archive"] = self.archive.stats()
+        return stats
+
+    def shutdown(self) -> None:
+        """Finish queued invoices and stop the pool"""
+        self.executor.shutdown(wait=True)
+        if self._archiver is not None:
+            self._archive_writes.put(None)
+            self._archiver.join()
@@ -0,0 +1,25 @@
+"""Entry module of the invoice render processes.
+
+The render pool's forkserver imports this module, and with it reportlab
+and the invoice layout, before it forks any render process. The processes
+run nothing but the functions below.
+"""
+import time
+from typing import Any, Dict, Tuple
+from pdf_generator_new import PDFInvoiceGenerator
+
+_generator = None
+
+def init_renderer() -> None:
+    """Pool initializer: one generator per render process"""
+    global _generator
+    _generator = PDFInvoiceGenerator()
+
+def ready() -> bool:
+    return True
+
+def render_invoice(sale_data: Dict[str, Any], user_data: Dict[str, Any]) -> Tuple[bytes, float]:
+    """Render one invoice in a pool process, returns the PDF and the render time"""
+    started = time.perf_counter()
+    pdf = _generator.create_invoice(sale_data, user_data).getvalue()
+    return pdf, time.perf_counter() - started
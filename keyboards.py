@@ -0,0 +1,124 @@
+"""Prebuilt reply markups and cached screens.
+
+Keyboards that never change are built and serialized to JSON once at
+import. TeleBot sends a string ``reply_markup`` as is, so handlers pass
+these constants instead of building markup objects on every tap.
+"""
+import threading
+from typing import Tuple
+import telebot
+from config import (OWNER_USERNAME, RECHARGE_AMOUNTS, RECHARGE_INSTRUCTIONS, BANK_INFO, STORE_NAME,
+                    STORE_MESSAGE)
+from utils import format_currency
+
+def button(text: str, data: str = None, url: str = None) -> telebot.types.InlineKeyboardButton:
+    return telebot.types.InlineKeyboardButton(text, callback_data=data, url=url)
+
+def serialize(*rows) -> str:
+    """Serialize rows of buttons into an inline keyboard"""
+    markup = telebot.types.InlineKeyboardMarkup()
+    for row in rows:
+        markup.row(*row)
+    return markup.to_json()
+
+# Customer screens
+MAIN_MENU = serialize(
+    [button("🛍️ عرض المنتجات", "store")],
+    [button("💳 إعادة الشحن", "recharge"), button("📝 تاريخ المشتريات", "history")],
+    [button("📞 التواصل", url=f"https://t.me/{OWNER_USERNAME.replace('@', '')}")]
+)
+BACK = serialize([button("🔙 العودة", "back")])
+BALANCE_MENU = serialize([button("💳 إعادة شحن", "recharge")], [button("🔙 العودة", "back")])
+PURCHASE_DONE = serialize(
+    [button("🛍️ شراء منتج آخر", "store")],
+    [button("📝 تاريخ المشتريات", "history")],
+    [button("🔙 العودة للقائمة الرئيسية", "back")]
+)
+RECHARGE_MENU = serialize(
+    *[[button(f"💳 {format_currency(amount)}", f"recharge_{amount}")] for amount in RECHARGE_AMOUNTS],
+    [button("🔙 العودة", "back")]
+)
+RECHARGE_TEXT = RECHARGE_INSTRUCTIONS.format(
+    bank_name=BANK_INFO['bank_name'],
+    account_number=BANK_INFO['account_number'],
+    account_holder=BANK_INFO['account_holder'],
+    iban=BANK_INFO['iban'],
+    swift_code=BANK_INFO['swift_code'],
+    owner_username=OWNER_USERNAME
+)
+
+# Admin screens
+ADMIN_MENU = serialize(
+    [button("👥 إدارة المستخدمين", "admin_users"), button("📦 إدارة المنتجات", "admin_products")],
+    [button("💰 طلبات الشحن", "admin_recharge"), button("📊 تقارير المبيعات", "admin_sales")],
+    [button("📢 إرسال إذاعة", "admin_broadcast"), button("⚙️ إعدادات", "admin_settings")],
+    [button("⚙️ شحن رصيد", "admin_balance"), button("🚫 حظر مستخدم", "admin_ban")]
+)
+ADMIN_MENU_TEXT = f"""🔧 لوحة تحكم الأدمن - {STORE_NAME}
+
+مرحباً بك في لوحة التحكم
+اختر العملية المطلوبة:"""
+ADMIN_BACK = serialize([button("🔙 العودة", "admin_menu")])
+BROADCAST_COMPOSE = serialize([button("✍️ كتابة رسالة", "admin_broadcast_compose")],
+                              [button("🔙 العودة", "admin_menu")])
+BROADCAST_RUNNING = serialize([button("⏹ إيقاف الإذاعة", "admin_broadcast_stop")],
+                              [button("🔙 العودة", "admin_menu")])
+SALES_MENU = serialize([button("📄 تصدير تقرير PDF", "admin_report")], [button("🔙 العودة", "admin_menu")])
+REPORT_RANGES = serialize(
+    [button("اليوم", "admin_report_today"), button("آخر 7 أيام", "admin_report_7d")],
+    [button("آخر 30 يوماً", "admin_report_30d"), button("هذا الشهر", "admin_report_month")],
+    [button("هذه السنة", "admin_report_year"), button("كل المبيعات", "admin_report_all")],
+    [button("📅 فترة مخصصة", "admin_report_custom")],
+    [button("🔙 العودة", "admin_sales")]
+)
+BROADCAST_CONFIRM = serialize([button("✅ إرسال", "admin_broadcast_send"), button("❌ إلغاء", "admin_broadcast")])
+
+
+class CatalogView:
+    """A screen rendered from the product catalog, cached per catalog version.
+
+    ``render(products)`` builds the ``(text, reply_markup)`` pair from
+    ``db.get_products()``; it only runs again after the database bumps
+    ``catalog_version`` (a product was created, updated or deleted, or its
+    stock changed), so the screen otherwise costs one comparison (plus a
+    one-row version read on the SQLite backend, where other processes may
+    change the catalog).
+    """
+
+    def __init__(self, db, render):
+        self.db = db
+        self.render = render
+        self._cached = (None, None)
+        self._lock = threading.Lock()
+
+    def get(self) -> Tuple[str, str]:
+        version, screen = self._cached
+        if version == self.db.catalog_version:
+            return screen
+        with self._lock:
+            # Read the version first: a change while rendering leaves the
+            # entry stale-versioned and the next call renders again
+            version = self.db.catalog_version
+            if self._cached[0] != version:
+                self._cached = (version, self.render(self.db.get_products()))
+            return self._cached[1]
+
+
+def render_store(products) -> Tuple[str, str]:
+    """The customer product list (active products with stock)"""
+    rows = [[button(f"{product['name']} - {format_currency(product['price'])}", f"product_{product_id}")]
+            for product_id, product in products.items()
+            if product.get("active", True) and product.get("stock", 0) > 0]
+    if not rows:
+        return "❌ لا توجد منتجات متاحة حالياً\nيرجى المحاولة لاحقاً", BACK
+    return STORE_MESSAGE, serialize(*rows, [button("🔙 العودة", "back")])
+
+def render_products_management(products) -> Tuple[str, str]:
+    """The admin product list with stock counts and delete buttons"""
+    text = "📦 إدارة المنتجات\n\n"
+    rows = []
+    for product_id, product in products.items():
+        status = "✅" if product.get('active', True) else "❌"
+        text += f"{status} {product['name']}\n💰 {format_currency(product['price'])}\n📦 المخزون: {product.get('stock', 0)}\n\n"
+        rows.append([button(f"🗑️ حذف {product['name']}", f"delete_product_{product_id}")])
+    return text, serialize(*rows, [button("🔙 العودة", "admin_menu")])
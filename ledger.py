@@ -0,0 +1,247 @@
+import bisect
+import json
+import os
+import threading
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+from utils import load_json, save_json, GroupCommitWriter
+from config import SALES_LEDGER_DIR
+
+class SalesLedger:
+    """Append-only sales ledger partitioned by month.
+
+    Each sale is one JSON line in ``<YYYY-MM>.jsonl``. An append-only
+    ``index.log`` maps every sale to ``(user, partition, offset)`` so a
+    user's history is read by seeking straight to their records instead of
+    scanning everybody's sales.
+    """
+
+    INDEX_FILE = "index.log"
+
+    def __init__(self, directory: str = SALES_LEDGER_DIR):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.RLock()
+        self._index = {}
+        self._indexed_size = {}
+        self._sale_count = 0
+        self._load_index()
+        self._recover_tail()
+
+    def _partition_path(self, partition: str) -> str:
+        return os.path.join(self.directory, f"{partition}.jsonl")
+
+    def _index_path(self) -> str:
+        return os.path.join(self.directory, self.INDEX_FILE)
+
+    def partitions(self) -> List[str]:
+        """Sorted list of month partitions"""
+        return sorted(name[:-len(".jsonl")] for name in os.listdir(self.directory) if name.endswith(".jsonl"))
+
+    def is_empty(self) -> bool:
+        return not self._index
+
+    def _remember(self, user_id: str, partition: str, offset: int, length: int) -> None:
+        locations = self._index.setdefault(user_id, [])
+        if locations and locations[-1] > (partition, offset):
+            bisect.insort(locations, (partition, offset))  # recovered record of an older partition
+        else:
+            locations.append((partition, offset))
+        self._sale_count += 1
+        self._indexed_size[partition] = max(self._indexed_size.get(partition, 0), offset + length)
+
+    def _load_index(self) -> None:
+        """Load the per-user offset index, truncating a torn last line"""
+        path = self._index_path()
+        if not os.path.exists(path):
+            return
+        complete = 0
+        with open(path, "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break  # interrupted append
+                parts = line.decode("utf-8").rstrip("\n").split("\t")
+                if len(parts) != 4:
+                    break
+                user_id, partition, offset, length = parts
+                self._remember(user_id, partition, int(offset), int(length))
+                complete += len(line)
+        if os.path.getsize(path) > complete:
+            # Later appends must start on a clean line
+            with open(path, "r+b") as f:
+                f.truncate(complete)
+
+    def _recover_tail(self) -> None:
+        """Index records appended to any partition after its last index write"""
+        for partition in self.partitions():
+            offset = self._indexed_size.get(partition, 0)
+            path = self._partition_path(partition)
+            if os.path.getsize(path) <= offset:
+                continue
+            with open(path, "rb") as f:
+                f.seek(offset)
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        break
+                    record = json.loads(line.decode("utf-8"))
+                    self._append_index(record["user_id"], partition, offset, len(line))
+                    offset += len(line)
+            if os.path.getsize(path) > offset:
+                # Drop a half-written record so the next append starts on a clean line
+                with open(path, "r+b") as f:
+                    f.truncate(offset)
+
+    def _append_index(self, user_id: str, partition: str, offset: int, length: int) -> None:
+        with open(self._index_path(), "a", encoding="utf-8") as f:
+            f.write(f"{user_id}\t{partition}\t{offset}\t{length}\n")
+        self._remember(user_id, partition, offset, length)
+
+    def append(self, user_id: str, record: Dict) -> bool:
+        """Append a sale record"""
+        line = json.dumps(dict(record, user_id=user_id), ensure_ascii=False).encode("utf-8") + b"\n"
+        partition = record.get("date", "")[:7] or "unknown"
+        with self._lock:
+            try:
+                with open(self._partition_path(partition), "ab") as f:
+                    offset = f.tell()
+                    f.write(line)
+                self._append_index(user_id, partition, offset, len(line))
+                return True
+            except OSError as e:
+                print(f"Error appending sale to ledger: {e}")
+                return False
+
+    def _read(self, partition: str, offset: int) -> Dict:
+        with open(self._partition_path(partition), "rb") as f:
+            f.seek(offset)
+            record = json.loads(f.readline().decode("utf-8"))
+        record.pop("user_id", None)
+        return record
+
+    def get_user_sales(self, user_id: str, limit: Optional[int] = None) -> List[Dict]:
+        """Get a user's sales, oldest first; ``limit`` keeps only the last N"""
+        with self._lock:
+            locations = list(self._index.get(user_id, []))
+        if limit is not None:
+            locations = locations[-limit:] if limit > 0 else []
+        return [self._read(partition, offset) for partition, offset in locations]
+
+    def customer_count(self) -> int:
+        """Number of users with at least one sale"""
+        return len(self._index)
+
+    def sale_count(self) -> int:
+        """Number of recorded sales"""
+        return self._sale_count
+
+    def has_sales(self, user_id: str) -> bool:
+        """Check if user bought anything before"""
+        return user_id in self._index
+
+    def invoice_ids_since(self, user_id: str, since: str) -> set:
+        """Invoice IDs of a user's sales dated ``since`` or later, read newest first"""
+        with self._lock:
+            locations = list(self._index.get(user_id, []))
+        invoice_ids = set()
+        for partition, offset in reversed(locations):
+            record = self._read(partition, offset)
+            if record.get("date", "") < since:
+                break
+            invoice_ids.add(record.get("invoice_id"))
+        return invoice_ids
+
+    def iter_sales(self, start: Optional[str] = None, end: Optional[str] = None) -> Iterator[Tuple[str, Dict]]:
+        """Stream ``(user_id, record)`` for sales with start <= date < end.
+
+        Dates are ISO strings; only partitions overlapping the range are read.
+        """
+        for partition in self.partitions():
+            if start and partition < start[:7]:
+                continue
+            if end and partition > end[:7]:
+                break
+            with open(self._partition_path(partition), "rb") as f:
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        break
+                    record = json.loads(line.decode("utf-8"))
+                    date = record.get("date", "")
+                    if (start and date < start) or (end and date >= end):
+                        continue
+                    yield record.pop("user_id"), record
+
+    def import_sales(self, sales: Dict[str, List[Dict]]) -> None:
+        """Append a legacy ``{user_id: [sale, ...]}`` dict in date order"""
+        records = [(sale.get("date", ""), user_id, sale) for user_id, user_sales in sales.items() for sale in user_sales]
+        records.sort(key=lambda item: item[0])
+        for _, user_id, sale in records:
+            self.append(user_id, sale)
+
+
+class SalesStats:
+    """Running sales totals kept next to the ledger.
+
+    Updated with every recorded sale so the admin dashboard never scans the
+    history; ``rebuild`` recomputes everything from the ledger for repairs.
+    """
+
+    def __init__(self, path: str = None, writer: GroupCommitWriter = None):
+        self.path = path or os.path.join(SALES_LEDGER_DIR, "stats.json")
+        self.writer = writer
+        self._lock = threading.Lock()
+        self.data = self._normalize(load_json(self.path))
+
+    def _serialize(self) -> str:
+        with self._lock:
+            return json.dumps(self.data, ensure_ascii=False, indent=2)
+
+    def _save(self) -> bool:
+        if self.writer is None:
+            return save_json(self.path, self.snapshot())
+        # Not waited for: totals that lag the ledger are rebuilt on startup
+        self.writer.write(self.path, self._serialize)
+        return True
+
+    @staticmethod
+    def _normalize(data: Dict) -> Dict:
+        return {
+            "total_sales": data.get("total_sales", 0),
+            "total_revenue": data.get("total_revenue", 0),
+            "unique_customers": data.get("unique_customers", 0),
+            "products": data.get("products", {}),
+            "days": data.get("days", {})
+        }
+
+    @staticmethod
+    def _apply(data: Dict, record: Dict, new_customer: bool) -> None:
+        price = record.get("price", 0)
+        data["total_sales"] += 1
+        data["total_revenue"] += price
+        if new_customer:
+            data["unique_customers"] += 1
+        for bucket, key in (("products", record.get("product", "")), ("days", record.get("date", "")[:10])):
+            counter = data[bucket].setdefault(key, {"count": 0, "revenue": 0})
+            counter["count"] += 1
+            counter["revenue"] += price
+
+    def add(self, record: Dict, new_customer: bool) -> bool:
+        """Count one sale and persist the totals"""
+        with self._lock:
+            self._apply(self.data, record, new_customer)
+        return self._save()
+
+    def snapshot(self) -> Dict:
+        """Copy of the current totals"""
+        with self._lock:
+            return json.loads(json.dumps(self.data))
+
+    def rebuild(self, sales: Iterable[Tuple[str, Dict]]) -> Dict:
+        """Recompute totals from a stream of (user_id, sale) pairs"""
+        data = self._normalize({})
+        customers = set()
+        for user_id, record in sales:
+            self._apply(data, record, user_id not in customers)
+            customers.add(user_id)
+        with self._lock:
+            self.data = data
+        self._save()
+        return self.snapshot()
@@ -1,55 +1,61 @@
 import telebot
 import os
+import threading
 import time
 from datetime import datetime, timedelta
 from database import DatabaseManager
-from pdf_generator_new import PDFInvoiceGenerator
+from invoice_jobs import InvoiceJobs, start_render_pool
+from invoice_archive import InvoiceArchive
+from pdf_generator_new import register_arabic_font
 from admin_panel import AdminPanel
+from dispatcher import UpdateDispatcher
+from webhook import WebhookServer
+from rate_limiter import create_rate_limiter
+from state_store import create_state_store
+from outbound import OutboundQueue, QueuedBot, PRIORITY_HIGH
+from broadcast import BroadcastEngine
+import keyboards
+from media_cache import MediaCache
 from config import *
 from utils import *
 
-# Security and rate limiting
-user_last_action = {}
-RATE_LIMIT_SECONDS = 2
-MAX_REQUESTS_PER_MINUTE = 20
-user_request_count = {}
+# Initialize bot; handlers run synchronously in whichever thread calls
+# handle_updates (dispatcher workers); async_main.py has coroutine versions.
+# Handlers talk to ``bot``, which sends through the flood-limited outbound queue.
+telegram = telebot.TeleBot(BOT_TOKEN, threaded=False)
+handle_updates = telegram.process_new_updates
+dispatcher = None
 
-# Initialize bot
-bot = telebot.TeleBot(BOT_TOKEN)
+# The invoice render processes run this script again as __mp_main__ (see
+# start_render_pool); they only render PDFs, so the bot is not set up there
+if __name__ != "__mp_main__":
+    render_pool = start_render_pool()
+    outbound = OutboundQueue(telegram)
+    bot = QueuedBot(telegram, outbound)
 
-# Initialize components
-db = DatabaseManager()
-pdf_generator = PDFInvoiceGenerator()
-admin_panel = AdminPanel(bot, db)
+    # User states for multi-step operations (expire after STATE_TTL_SECONDS)
+    user_states = create_state_store()
 
-# User states for multi-step operations
-user_states = {}
+    # Initialize components
+    db = DatabaseManager()
+    broadcaster = BroadcastEngine(outbound, db)
+    invoice_archive = InvoiceArchive()
+    invoice_jobs = InvoiceJobs(outbound, render_pool, archive=invoice_archive)
+    admin_panel = AdminPanel(bot, db, states=user_states, broadcaster=broadcaster, invoices=invoice_jobs)
+
+    # The store menu, re-rendered only when the catalog changes
+    store_view = keyboards.CatalogView(db, keyboards.render_store)
+
+    # Telegram file_ids of the welcome and product images
+    media_cache = MediaCache(bot)
+    db.add_product_listener(media_cache.on_product_change)
+
+    # Security and rate limiting (RATE_LIMIT_SECONDS / MAX_REQUESTS_PER_MINUTE)
+    rate_limiter = create_rate_limiter()
 
 def check_rate_limit(user_id: str) -> bool:
     """Check if user is rate limited"""
-    current_time = time.time()
-    
-    # Check last action time
-    if user_id in user_last_action:
-        if current_time - user_last_action[user_id] < RATE_LIMIT_SECONDS:
-            return False
-    
-    # Check requests per minute
-    minute_ago = current_time - 60
-    if user_id not in user_request_count:
-        user_request_count[user_id] = []
-    
-    # Remove old requests
-    user_request_count[user_id] = [req_time for req_time in user_request_count[user_id] if req_time > minute_ago]
-    
-    # Check if exceeded limit
-    if len(user_request_count[user_id]) >= MAX_REQUESTS_PER_MINUTE:
-        return False
-    
-    # Update tracking
-    user_last_action[user_id] = current_time
-    user_request_count[user_id].append(current_time)
-    return True
+    return rate_limiter.allow(user_id)
 
 def validate_user_input(text: str) -> bool:
     """Validate user input for security"""
@@ -66,7 +72,47 @@ def validate_user_input(text: str) -> bool:
     
     return True
 
-@bot.message_handler(commands=['start'])
+# Views shared with the handlers in async_main.py
+
+def ensure_user(user_id: str, from_user):
+    """Get a user, creating and approving them on their first contact"""
+    user = db.get_user(user_id)
+    if not user:
+        full_name = f"{from_user.first_name or ''} {from_user.last_name or ''}".strip()
+        if db.create_user(user_id, full_name):
+            # Approve all users immediately
+            db.approve_user(user_id)
+        user = db.get_user(user_id)
+    return user
+
+def welcome_text(name: str, user_id: str, balance: int) -> str:
+    return WELCOME_MESSAGE.format(
+        name=sanitize_text(name),
+        user_id=user_id,
+        balance=balance,
+        currency=CURRENCY,
+        store_name=STORE_NAME
+    )
+
+HELP_TEXT = f"""📋 مساعدة {STORE_NAME}
+
+🔸 الأوامر المتاحة:
+/start - بدء التفاعل مع البوت
+/help - عرض هذه المساعدة
+
+🔸 كيفية الاستخدام:
+1️⃣ اضغط على "عرض المنتجات" لرؤية الخدمات المتاحة
+2️⃣ اختر المنتج المطلوب وتأكد من رصيدك
+3️⃣ اضغط على "تأكيد الشراء" للحصول على الكود
+4️⃣ ستحصل على فاتورة PDF مع تفاصيل الشراء
+
+🔸 إعادة الشحن:
+اضغط على "إعادة الشحن" واتبع التعليمات
+
+🔸 للدعم:
+{OWNER_USERNAME}"""
+
+@telegram.message_handler(commands=['start'])
 def send_welcome(message):
     """Handle /start command"""
     user_id = str(message.from_user.id)
@@ -87,40 +133,16 @@ def send_welcome(message):
         return
     
     # Create user if doesn't exist and approve immediately
-    user = db.get_user(user_id)
-    if not user:
-        full_name = f"{message.from_user.first_name or ''} {message.from_user.last_name or ''}".strip()
-        if db.create_user(user_id, full_name):
-            # Approve all users immediately
-            db.approve_user(user_id)
-            user = db.get_user(user_id)
-    
-    balance = user.get("balance", 0) if user else 0
-    
-    welcome_text = WELCOME_MESSAGE.format(
-        name=sanitize_text(name),
-        user_id=user_id,
-        balance=balance,
-        currency=CURRENCY,
-        store_name=STORE_NAME
-    )
-    
-    markup = telebot.types.InlineKeyboardMarkup()
-    markup.row(telebot.types.InlineKeyboardButton("🛍️ عرض المنتجات", callback_data="store"))
-    markup.row(
-        telebot.types.InlineKeyboardButton("💳 إعادة الشحن", callback_data="recharge"),
-        telebot.types.InlineKeyboardButton("📝 تاريخ المشتريات", callback_data="history")
-    )
-    markup.row(telebot.types.InlineKeyboardButton("📞 التواصل", url=f"https://t.me/{OWNER_USERNAME.replace('@', '')}"))
+    user = ensure_user(user_id, message.from_user)
+    text = welcome_text(name, user_id, user.get("balance", 0) if user else 0)
     
     # Send welcome message with startup image
-    startup_image = "https://i.imgur.com/ZLo9XQ1.jpg"
     try:
-        bot.send_photo(message.chat.id, startup_image, caption=welcome_text, reply_markup=markup)
+        media_cache.send_photo(message.chat.id, STARTUP_IMAGE, caption=text, reply_markup=keyboards.MAIN_MENU)
     except:
-        bot.send_message(message.chat.id, welcome_text, reply_markup=markup)
+        bot.send_message(message.chat.id, text, reply_markup=keyboards.MAIN_MENU)
 
-@bot.message_handler(commands=['admin'])
+@telegram.message_handler(commands=['admin'])
 def admin_command(message):
     """Handle /admin command"""
     if admin_panel.is_admin_user(message.from_user.id):
@@ -128,50 +150,31 @@ def admin_command(message):
     else:
         bot.reply_to(message, "⛔ غير مسموح لك بالوصول لهذه الصفحة")
 
-@bot.message_handler(commands=['help'])
+@telegram.message_handler(commands=['help'])
 def help_command(message):
     """Handle /help command"""
-    help_text = f"""📋 مساعدة {STORE_NAME}
-
-🔸 الأوامر المتاحة:
-/start - بدء التفاعل مع البوت
-/help - عرض هذه المساعدة
-
-🔸 كيفية الاستخدام:
-1️⃣ اضغط على "عرض المنتجات" لرؤية الخدمات المتاحة
-2️⃣ اختر المنتج المطلوب وتأكد من رصيدك
-3️⃣ اضغط على "تأكيد الشراء" للحصول على الكود
-4️⃣ ستحصل على فاتورة PDF مع تفاصيل الشراء
-
-🔸 إعادة الشحن:
-اضغط على "إعادة الشحن" واتبع التعليمات
+    bot.send_message(message.chat.id, HELP_TEXT)
 
-🔸 للدعم:
-{OWNER_USERNAME}"""
-    
-    bot.send_message(message.chat.id, help_text)
+RECEIPT_RECEIVED = "✅ تم استلام صورة الإيصال\n\n📅 الآن أرسل تاريخ ووقت التحويل بالتفصيل\n\nمثال: 2025-07-01 الساعة 14:30"
 
-@bot.message_handler(content_types=['photo'])
+@telegram.message_handler(content_types=['photo'])
 def handle_photo(message):
     """Handle photo uploads for recharge requests"""
     user_id = str(message.from_user.id)
     
     # Check if user is in recharge state
-    if user_id in user_states and user_states[user_id].get('state') == 'waiting_receipt':
+    state_data = user_states.get(user_id)
+    if state_data and state_data.get('state') == 'waiting_receipt':
         try:
             # Get the photo
             photo = message.photo[-1]  # Get the highest resolution photo
             file_info = bot.get_file(photo.file_id)
             
             # Store the receipt photo file_id
-            user_states[user_id]['receipt_photo'] = photo.file_id
+            user_states.update(user_id, receipt_photo=photo.file_id, state='waiting_date')
             
             # Ask for transfer date
-            bot.send_message(
-                message.chat.id,
-                "✅ تم استلام صورة الإيصال\n\n📅 الآن أرسل تاريخ ووقت التحويل بالتفصيل\n\nمثال: 2025-07-01 الساعة 14:30"
-            )
-            user_states[user_id]['state'] = 'waiting_date'
+            bot.send_message(message.chat.id, RECEIPT_RECEIVED)
             
         except Exception as e:
             bot.send_message(message.chat.id, "❌ حدث خطأ في معالجة الصورة، يرجى المحاولة مرة أخرى")
@@ -179,16 +182,24 @@ def handle_photo(message):
     else:
         bot.send_message(message.chat.id, "❓ لم أفهم الغرض من هذه الصورة")
 
-@bot.message_handler(func=lambda message: True)
+@telegram.message_handler(func=lambda message: True)
 def handle_text_messages(message):
     """Handle text messages"""
     user_id = str(message.from_user.id)
     
     # Handle recharge flow
-    if user_id in user_states:
-        state_data = user_states.get(user_id, {})
+    state_data = user_states.get(user_id)
+    if state_data:
         state = state_data.get('state')
         
+        if state == 'waiting_broadcast_text' and admin_panel.is_admin_user(message.from_user.id):
+            admin_panel.confirm_broadcast(message)
+            return
+        
+        if state == 'waiting_report_range' and admin_panel.is_admin_user(message.from_user.id):
+            admin_panel.export_custom_report(message)
+            return
+        
         if state == 'waiting_date':
             # Process transfer date
             transfer_date = message.text.strip()
@@ -209,26 +220,31 @@ def handle_text_messages(message):
             )
             
             # Clear user state
-            del user_states[user_id]
+            user_states.delete(user_id)
             
             # Notify user
-            bot.send_message(
-                message.chat.id,
-                f"✅ تم إرسال طلب إعادة الشحن بنجاح!\n\n📄 رقم الطلب: {request_id}\n💰 المبلغ: {format_currency(amount)}\n\n⏳ سيتم مراجعة طلبك وإشعارك بالنتيجة قريباً"
-            )
+            bot.send_message(message.chat.id, recharge_sent_text(request_id, amount))
             
             # Notify admin
-            user_info = db.get_user(user_id)
-            admin_panel.send_admin_notification(
-                f"🔔 طلب إعادة شحن جديد\n\n👤 المستخدم: {user_info.get('name', 'غير معروف')}\n🆔 ID: {user_id}\n💰 المبلغ: {format_currency(amount)}\n📅 تاريخ التحويل: {transfer_date}\n📄 رقم الطلب: {request_id}"
-            )
+            admin_panel.send_admin_notification(recharge_admin_text(user_id, amount, transfer_date, request_id))
             
             return
     
     # Default response for unrecognized text
     bot.send_message(message.chat.id, "❓ لم أفهم رسالتك، يرجى استخدام الأزرار المتاحة")
 
-@bot.callback_query_handler(func=lambda call: True)
+def recharge_sent_text(request_id: str, amount: int) -> str:
+    return f"✅ تم إرسال طلب إعادة الشحن بنجاح!\n\n📄 رقم الطلب: {request_id}\n💰 المبلغ: {format_currency(amount)}\n\n⏳ سيتم مراجعة طلبك وإشعارك بالنتيجة قريباً"
+
+def recharge_admin_text(user_id: str, amount: int, transfer_date: str, request_id: str) -> str:
+    """The admin's notice of a new recharge request (reads the user)"""
+    user_info = db.get_user(user_id) or {}
+    return f"🔔 طلب إعادة شحن جديد\n\n👤 المستخدم: {user_info.get('name', 'غير معروف')}\n🆔 ID: {user_id}\n💰 المبلغ: {format_currency(amount)}\n📅 تاريخ التحويل: {transfer_date}\n📄 رقم الطلب: {request_id}"
+
+# Callback data prefixes handled by the admin panel
+ADMIN_CALLBACKS = ("admin_", "approve_", "reject_", "delete_product_")
+
+@telegram.callback_query_handler(func=lambda call: True)
 def callback_query(call):
     """Handle all callback queries"""
     try:
@@ -243,12 +259,7 @@ def callback_query(call):
             return
         
         # Create user if doesn't exist and approve immediately
-        user = db.get_user(user_id)
-        if not user:
-            full_name = f"{call.from_user.first_name or ''} {call.from_user.last_name or ''}".strip()
-            db.create_user(user_id, full_name)
-            db.approve_user(user_id)
-            user = db.get_user(user_id)
+        ensure_user(user_id, call.from_user)
         
         # Check if user is banned
         if not data.startswith("admin_") and db.is_user_banned(user_id):
@@ -267,11 +278,13 @@ def callback_query(call):
             process_recharge_request(call)
         elif data == "history":
             show_purchase_history(call)
+        elif data.startswith("resend_"):
+            resend_invoice(call)
         elif data == "check_balance":
             show_user_balance(call)
         elif data == "back":
             back_to_main(call)
-        elif data.startswith("admin_") or data.startswith("approve_") or data.startswith("reject_") or data.startswith("delete_product_") or data.startswith("approve_recharge_") or data.startswith("reject_recharge_") or data.startswith("approve_user_") or data.startswith("reject_user_"):
+        elif data.startswith(ADMIN_CALLBACKS):
             admin_panel.handle_admin_callback(call)
         elif data == "out_of_stock":
             bot.send_message(call.message.chat.id, "❌ هذا المنتج غير متوفر حالياً")
@@ -287,28 +300,7 @@ def callback_query(call):
 
 def show_products(call):
     """Show available products"""
-    products = db.get_available_products()
-    
-    if not products:
-        text = "❌ لا توجد منتجات متاحة حالياً\nيرجى المحاولة لاحقاً"
-        markup = telebot.types.InlineKeyboardMarkup()
-        markup.row(telebot.types.InlineKeyboardButton("🔙 العودة", callback_data="back"))
-        bot.edit_message_text(text, call.message.chat.id, call.message.message_id, reply_markup=markup)
-        return
-    
-    text = STORE_MESSAGE
-    
-    markup = telebot.types.InlineKeyboardMarkup()
-    for product_id, product in products.items():
-        stock = len(product.get('codes', []))
-        if stock > 0:
-            button_text = f"{product['name']} - {format_currency(product['price'])}"
-            markup.row(telebot.types.InlineKeyboardButton(button_text, callback_data=f"product_{product_id}"))
-        else:
-            button_text = f"❌ {product['name']} - نفذ المخزون"
-            markup.row(telebot.types.InlineKeyboardButton(button_text, callback_data="out_of_stock"))
-    
-    markup.row(telebot.types.InlineKeyboardButton("🔙 العودة", callback_data="back"))
+    text, markup = store_view.get()
     
     try:
         bot.edit_message_text(text, call.message.chat.id, call.message.message_id, reply_markup=markup)
@@ -329,8 +321,22 @@ def show_product_details(call):
         bot.answer_callback_query(call.id, "❌ خطأ في بيانات المستخدم")
         return
     
+    text, markup = product_details(product_id, product, user)
+    
+    # Send with product image if available
+    product_image = product.get('image')
+    if product_image:
+        try:
+            media_cache.send_photo(call.message.chat.id, product_image, caption=text, reply_markup=markup)
+        except:
+            bot.send_message(call.message.chat.id, text, reply_markup=markup)
+    else:
+        bot.send_message(call.message.chat.id, text, reply_markup=markup)
+
+def product_details(product_id: str, product: dict, user: dict):
+    """The product page: text and buttons for this user's balance"""
     user_balance = user.get("balance", 0)
-    stock = len(product.get('codes', []))
+    stock = product.get('stock', 0)
     
     text = f"""📦 تفاصيل المنتج
 
@@ -354,16 +360,7 @@ def show_product_details(call):
         text += "\n❌ نفذ المخزون"
     
     markup.row(telebot.types.InlineKeyboardButton("🔙 العودة للمتجر", callback_data="store"))
-    
-    # Send with product image if available
-    product_image = product.get('image')
-    if product_image:
-        try:
-            bot.send_photo(call.message.chat.id, product_image, caption=text, reply_markup=markup)
-        except:
-            bot.send_message(call.message.chat.id, text, reply_markup=markup)
-    else:
-        bot.send_message(call.message.chat.id, text, reply_markup=markup)
+    return text, markup
 
 def process_purchase(call):
     """Process product purchase"""
@@ -376,14 +373,26 @@ def process_purchase(call):
     if result["success"]:
         # Purchase successful
         purchase_data = result["data"]
-        user_data = db.get_user(user_id)
-        if user_data:
-            user_data["user_id"] = user_id  # Add user_id for PDF
-        else:
-            user_data = {"user_id": user_id, "name": "مستخدم"}
+        sale_data, user_data = invoice_data(user_id, purchase_data)
+        
+        bot.send_message(call.message.chat.id, purchase_text(purchase_data), reply_markup=keyboards.PURCHASE_DONE,
+                         parse_mode='Markdown', priority=PRIORITY_HIGH)
         
-        # Format code with monospace for easy copying - Fixed version
-        success_text = f"""🎉 تهانينا! تم الشراء بنجاح! 🎉
+        # The PDF invoice is rendered in the background and follows the code
+        try:
+            queued = invoice_jobs.submit(call.message.chat.id, sale_data, user_data)
+        except Exception as e:
+            print(f"PDF generation error: {e}")
+            queued = False
+        if not queued:
+            bot.send_message(call.message.chat.id, "❌ حدث خطأ في إنشاء الفاتورة")
+    else:
+        # Purchase failed
+        bot.send_message(call.message.chat.id, f"❌ فشل الشراء: {result['message']}")
+
+def purchase_text(purchase_data: dict) -> str:
+    # Format code with monospace for easy copying - Fixed version
+    return f"""🎉 تهانينا! تم الشراء بنجاح! 🎉
 
 ━━━━━━━━━━━━━━━━━━━━━━━
 📦 المنتج: {purchase_data['product_name']}
@@ -399,63 +408,30 @@ def process_purchase(call):
 💡 اضغط على الكود أعلاه مرة واحدة لنسخه تلقائياً
 
 📧 ستصلك فاتورة PDF تحتوي على جميع التفاصيل"""
-        
-        markup = telebot.types.InlineKeyboardMarkup()
-        markup.row(telebot.types.InlineKeyboardButton("🛍️ شراء منتج آخر", callback_data="store"))
-        markup.row(telebot.types.InlineKeyboardButton("📝 تاريخ المشتريات", callback_data="history"))
-        markup.row(telebot.types.InlineKeyboardButton("🔙 العودة للقائمة الرئيسية", callback_data="back"))
-        
-        bot.send_message(call.message.chat.id, success_text, reply_markup=markup, parse_mode='Markdown')
-        
-        # Generate and send PDF invoice
-        try:
-            sale_data = {
-                'invoice_id': purchase_data['invoice_id'],
-                'product_name': purchase_data['product_name'],
-                'price': purchase_data['price'],
-                'code': purchase_data['code'],
-                'timestamp': get_current_timestamp()
-            }
-            
-            pdf_buffer = pdf_generator.create_invoice(sale_data, user_data)
-            bot.send_document(
-                call.message.chat.id,
-                pdf_buffer,
-                visible_file_name="Yasiin store.pdf"
-            )
-        except Exception as e:
-            print(f"PDF generation error: {e}")
-            bot.send_message(call.message.chat.id, "❌ حدث خطأ في إنشاء الفاتورة")
+
+def invoice_data(user_id: str, purchase_data: dict):
+    """Sale and user data for the invoice of a purchase (reads the user)"""
+    user_data = db.get_user(user_id)
+    if user_data:
+        user_data["user_id"] = user_id  # Add user_id for PDF
     else:
-        # Purchase failed
-        bot.send_message(call.message.chat.id, f"❌ فشل الشراء: {result['message']}")
+        user_data = {"user_id": user_id, "name": "مستخدم"}
+    sale_data = {
+        'invoice_id': purchase_data['invoice_id'],
+        'product_name': purchase_data['product_name'],
+        'price': purchase_data['price'],
+        'code': purchase_data['code'],
+        'timestamp': get_current_timestamp()
+    }
+    return sale_data, user_data
 
 def show_recharge_options(call):
     """Show recharge options with bank information"""
-    text = RECHARGE_INSTRUCTIONS.format(
-        bank_name=BANK_INFO['bank_name'],
-        account_number=BANK_INFO['account_number'],
-        account_holder=BANK_INFO['account_holder'],
-        iban=BANK_INFO['iban'],
-        swift_code=BANK_INFO['swift_code'],
-        owner_username=OWNER_USERNAME
-    )
-    
-    markup = telebot.types.InlineKeyboardMarkup()
-    
-    # Add recharge amount buttons
-    for amount in RECHARGE_AMOUNTS:
-        markup.row(telebot.types.InlineKeyboardButton(
-            f"💳 {format_currency(amount)}", 
-            callback_data=f"recharge_{amount}"
-        ))
-    
-    markup.row(telebot.types.InlineKeyboardButton("🔙 العودة", callback_data="back"))
-    
     try:
-        bot.edit_message_text(text, call.message.chat.id, call.message.message_id, reply_markup=markup)
+        bot.edit_message_text(keyboards.RECHARGE_TEXT, call.message.chat.id, call.message.message_id,
+                              reply_markup=keyboards.RECHARGE_MENU)
     except:
-        bot.send_message(call.message.chat.id, text, reply_markup=markup)
+        bot.send_message(call.message.chat.id, keyboards.RECHARGE_TEXT, reply_markup=keyboards.RECHARGE_MENU)
 
 def process_recharge_request(call):
     """Process recharge request"""
@@ -463,12 +439,15 @@ def process_recharge_request(call):
     user_id = str(call.from_user.id)
     
     # Set user state for recharge flow
-    user_states[user_id] = {
+    user_states.set(user_id, {
         'state': 'waiting_receipt',
         'amount': amount
-    }
+    })
     
-    text = f"""💳 طلب إعادة شحن بمبلغ {format_currency(amount)}
+    bot.send_message(call.message.chat.id, recharge_prompt(amount))
+
+def recharge_prompt(amount: int) -> str:
+    return f"""💳 طلب إعادة شحن بمبلغ {format_currency(amount)}
 
 📸 الآن أرسل صورة واضحة من إيصال التحويل البنكي
 
@@ -479,24 +458,25 @@ def process_recharge_request(call):
 • رقم الحساب المرسل إليه
 
 📤 أرسل الصورة الآن..."""
-    
-    bot.send_message(call.message.chat.id, text)
 
 def show_purchase_history(call):
     """Show user purchase history"""
     user_id = str(call.from_user.id)
-    purchases = db.get_user_purchases(user_id)
+    purchases = db.get_user_purchases(user_id, limit=10)
     
     if not purchases:
         text = "📝 لا توجد مشتريات سابقة"
-        markup = telebot.types.InlineKeyboardMarkup()
-        markup.row(telebot.types.InlineKeyboardButton("🔙 العودة", callback_data="back"))
-        bot.send_message(call.message.chat.id, text, reply_markup=markup)
+        bot.send_message(call.message.chat.id, text, reply_markup=keyboards.BACK)
         return
     
+    text, markup = purchase_history(purchases)
+    bot.send_message(call.message.chat.id, text, reply_markup=markup, parse_mode='Markdown')
+
+def purchase_history(purchases: list):
+    """History text and resend buttons of the user's last purchases"""
     text = "📝 تاريخ المشتريات:\n\n"
     
-    for i, purchase in enumerate(purchases[-10:], 1):  # Show last 10 purchases
+    for i, purchase in enumerate(purchases, 1):  # Show last 10 purchases
         date = purchase.get('date', 'غير محدد')
         try:
             # Format date
@@ -511,10 +491,49 @@ def show_purchase_history(call):
         text += f"📅 {formatted_date}\n"
         text += f"🔐 `{purchase.get('code', 'غير محدد')}`\n\n"
     
-    markup = telebot.types.InlineKeyboardMarkup()
-    markup.row(telebot.types.InlineKeyboardButton("🔙 العودة", callback_data="back"))
+    markup = keyboards.serialize(
+        *[[keyboards.button(f"📄 إعادة إرسال فاتورة {i}", f"resend_{purchase['invoice_id']}")]
+          for i, purchase in enumerate(purchases, 1) if purchase.get('invoice_id')],
+        [keyboards.button("🔙 العودة", "back")]
+    )
+    return text, markup
+
+def resend_invoice(call):
+    """Send the invoice of one of the user's purchases again"""
+    invoice_id = call.data.replace("resend_", "", 1)
+    user_id = str(call.from_user.id)
     
-    bot.send_message(call.message.chat.id, text, reply_markup=markup, parse_mode='Markdown')
+    # Archived invoices go out as stored, without rendering
+    entry = invoice_archive.get(invoice_id)
+    if entry is not None and entry['user_id'] == user_id and invoice_jobs.resend(call.message.chat.id, invoice_id):
+        bot.answer_callback_query(call.id, "📄 جاري إرسال الفاتورة")
+        return
+    
+    # Older than the archive or dropped by retention: render it again from the sale
+    invoice = past_invoice_data(user_id, invoice_id)
+    if invoice is None:
+        bot.answer_callback_query(call.id, "❌ الفاتورة غير متوفرة")
+        return
+    if invoice_jobs.submit(call.message.chat.id, *invoice):
+        bot.answer_callback_query(call.id, "📄 جاري إرسال الفاتورة")
+    else:
+        bot.answer_callback_query(call.id, "❌ حدث خطأ في إنشاء الفاتورة")
+
+def past_invoice_data(user_id: str, invoice_id: str):
+    """Sale and user data to render one of the user's past invoices, None if it is not theirs"""
+    purchase = next((p for p in db.get_user_purchases(user_id) if p.get('invoice_id') == invoice_id), None)
+    if purchase is None:
+        return None
+    user_data = db.get_user(user_id) or {"name": "مستخدم"}
+    user_data["user_id"] = user_id
+    sale_data = {
+        'invoice_id': invoice_id,
+        'product_name': purchase.get('product', 'N/A'),
+        'price': purchase.get('price', 0),
+        'code': purchase.get('code'),
+        'timestamp': purchase.get('date')
+    }
+    return sale_data, user_data
 
 def show_user_balance(call):
     """Show user balance"""
@@ -525,26 +544,25 @@ def show_user_balance(call):
         bot.answer_callback_query(call.id, "❌ خطأ في بيانات المستخدم")
         return
     
+    text = balance_text(user_id, user)
+    
+    try:
+        bot.edit_message_text(text, call.message.chat.id, call.message.message_id, reply_markup=keyboards.BALANCE_MENU)
+    except:
+        bot.send_message(call.message.chat.id, text, reply_markup=keyboards.BALANCE_MENU)
+
+def balance_text(user_id: str, user: dict) -> str:
     balance = user.get("balance", 0)
     total_spent = user.get("total_spent", 0)
     purchase_count = user.get("purchase_count", 0)
     
-    text = f"""💎 معلومات الرصيد
+    return f"""💎 معلومات الرصيد
 
 👤 الاسم: {user.get('name', 'غير محدد')}
 🆔 معرف المستخدم: {user_id}
 💰 الرصيد الحالي: {format_currency(balance)}
 💸 إجمالي المصروف: {format_currency(total_spent)}
 🛒 عدد المشتريات: {purchase_count}"""
-    
-    markup = telebot.types.InlineKeyboardMarkup()
-    markup.row(telebot.types.InlineKeyboardButton("💳 إعادة شحن", callback_data="recharge"))
-    markup.row(telebot.types.InlineKeyboardButton("🔙 العودة", callback_data="back"))
-    
-    try:
-        bot.edit_message_text(text, call.message.chat.id, call.message.message_id, reply_markup=markup)
-    except:
-        bot.send_message(call.message.chat.id, text, reply_markup=markup)
 
 def back_to_main(call):
     """Return to main menu"""
@@ -555,38 +573,55 @@ def back_to_main(call):
         bot.answer_callback_query(call.id, "❌ خطأ في بيانات المستخدم")
         return
     
-    balance = user.get("balance", 0)
-    name = user.get("name", "المستخدم")
-    
-    welcome_text = WELCOME_MESSAGE.format(
-        name=sanitize_text(name),
-        user_id=user_id,
-        balance=balance,
-        currency=CURRENCY,
-        store_name=STORE_NAME
-    )
-    
-    markup = telebot.types.InlineKeyboardMarkup()
-    markup.row(telebot.types.InlineKeyboardButton("🛍️ عرض المنتجات", callback_data="store"))
-    markup.row(
-        telebot.types.InlineKeyboardButton("💳 إعادة الشحن", callback_data="recharge"),
-        telebot.types.InlineKeyboardButton("📝 تاريخ المشتريات", callback_data="history")
-    )
-    markup.row(telebot.types.InlineKeyboardButton("📞 التواصل", url=f"https://t.me/{OWNER_USERNAME.replace('@', '')}"))
+    text = welcome_text(user.get("name", "المستخدم"), user_id, user.get("balance", 0))
     
     try:
-        bot.edit_message_text(welcome_text, call.message.chat.id, call.message.message_id, reply_markup=markup)
+        bot.edit_message_text(text, call.message.chat.id, call.message.message_id,
+                              reply_markup=keyboards.MAIN_MENU)
     except:
-        bot.send_message(call.message.chat.id, welcome_text, reply_markup=markup)
+        bot.send_message(call.message.chat.id, text, reply_markup=keyboards.MAIN_MENU)
+
+def start_dispatcher():
+    """Route polled updates to the per-user ordered worker pool"""
+    global dispatcher
+    if dispatcher is None:
+        dispatcher = UpdateDispatcher(handle_updates, WORKER_POOL_SIZE)
+        admin_panel.dispatcher = dispatcher
+        telegram.process_new_updates = dispatcher.dispatch
+
+def warm_up_media():
+    """Upload uncached welcome and product images in the background"""
+    urls = [STARTUP_IMAGE] + [product.get("image") for product in db.get_products().values()]
+    threading.Thread(target=media_cache.warm_up, args=(urls, MEDIA_WARMUP_CHAT_ID),
+                     name="media-warmup", daemon=True).start()
+
+def run_webhook():
+    """Receive updates through the local webhook server"""
+    if not WEBHOOK_SECRET:
+        raise ValueError("WEBHOOK_SECRET is required in webhook mode")
+    server = WebhookServer(dispatcher, WEBHOOK_SECRET, WEBHOOK_HOST, WEBHOOK_PORT,
+                           WEBHOOK_PATH, WEBHOOK_MAX_PENDING)
+    bot.remove_webhook()
+    bot.set_webhook(url=WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH, secret_token=WEBHOOK_SECRET)
+    print(f"🌐 Webhook على المنفذ {server.port}{WEBHOOK_PATH}")
+    server.serve_forever()
 
 def main():
     """Main function to run the bot"""
+    start_dispatcher()
+    broadcaster.resume()
+    warm_up_media()
+    register_arabic_font()  # report a missing invoice font now, not at the first Arabic invoice
     print(f"🤖 بدء تشغيل {STORE_NAME}")
     print(f"👤 الأدمن: {ADMIN_ID}")
     print("🔄 البوت يعمل الآن...")
     
+    if WEBHOOK_URL:
+        run_webhook()
+        return
+    
     try:
-        bot.infinity_polling(timeout=20, long_polling_timeout=20)
+        telegram.infinity_polling(timeout=20, long_polling_timeout=20)
     except Exception as e:
         print(f"خطأ في تشغيل البوت: {e}")
         time.sleep(5)
@@ -0,0 +1,36 @@
+"""Maintenance commands for the store data.
+
+Usage:
+    python manage.py rebuild-stats
+    python manage.py compact-wal
+"""
+import argparse
+from database import DatabaseManager
+from utils import format_currency
+
+def rebuild_stats(db: DatabaseManager) -> None:
+    """Recompute sales aggregates from the stored sales"""
+    stats = db.rebuild_sales_stats()
+    print("✅ تم إعادة بناء إحصائيات المبيعات")
+    print(f"🛒 إجمالي المبيعات: {stats['total_sales']}")
+    print(f"💰 إجمالي الإيرادات: {format_currency(stats['total_revenue'])}")
+    print(f"👥 العملاء الفريدين: {stats['unique_customers']}")
+
+def compact_wal(db: DatabaseManager) -> None:
+    """Fold the balance write-ahead log into users.json"""
+    archived = db.compact_balance_log()
+    print(f"✅ تم دمج سجل الأرصدة ({archived} عملية مؤرشفة)")
+
+COMMANDS = {
+    "rebuild-stats": rebuild_stats,
+    "compact-wal": compact_wal,
+}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=sorted(COMMANDS))
+    args = parser.parse_args()
+    COMMANDS[args.command](DatabaseManager())
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+import asyncio
+import threading
+from typing import Dict, Iterable, Optional
+from utils import load_json, save_json
+from outbound import PRIORITY_LOW
+from config import MEDIA_CACHE_FILE
+
+class MediaCache:
+    """Telegram file_ids of images the bot sends by URL.
+
+    The first successful send of a URL makes Telegram download it; the
+    ``file_id`` of the largest size it returns is remembered in
+    ``MEDIA_CACHE_FILE`` and every later send reuses it. A file_id Telegram
+    no longer accepts is dropped and the URL is sent again.
+    """
+
+    def __init__(self, bot, path: str = MEDIA_CACHE_FILE):
+        self.bot = bot
+        self.path = path
+        self._lock = threading.Lock()
+        self._file_ids: Dict[str, str] = load_json(path)
+        self._hits = 0
+        self._misses = 0
+
+    def send_photo(self, chat_id: int, url: str, **kwargs):
+        """Send an image by cached file_id, falling back to its URL"""
+        file_id = self._file_ids.get(url)
+        if file_id is not None:
+            try:
+                message = self.bot.send_photo(chat_id, file_id, **kwargs)
+                self._hits += 1
+                return message
+            except Exception as e:
+                if getattr(e, "error_code", None) != 400:
+                    raise
+                print(f"Cached file_id for {url} rejected, sending by URL: {e}")
+                self.forget(url)
+        self._misses += 1
+        message = self.bot.send_photo(chat_id, url, **kwargs)
+        self._remember(url, message)
+        return message
+
+    async def send_photo_async(self, bot, chat_id: int, url: str, **kwargs):
+        """send_photo for async_main.py, whose ``bot`` calls are awaited"""
+        file_id = self._file_ids.get(url)
+        if file_id is not None:
+            try:
+                message = await bot.send_photo(chat_id, file_id, **kwargs)
+                self._hits += 1
+                return message
+            except Exception as e:
+                if getattr(e, "error_code", None) != 400:
+                    raise
+                print(f"Cached file_id for {url} rejected, sending by URL: {e}")
+                await asyncio.to_thread(self.forget, url)
+        self._misses += 1
+        message = await bot.send_photo(chat_id, url, **kwargs)
+        await asyncio.to_thread(self._remember, url, message)
+        return message
+
+    def _remember(self, url: str, message) -> None:
+        photos = getattr(message, "photo", None)
+        if not photos:
+            return
+        with self._lock:
+            # Merge with the file so other bot processes' entries are kept
+            file_ids = load_json(self.path)
+            file_ids.update(self._file_ids)
+            file_ids[url] = photos[-1].file_id
+            self._file_ids = file_ids
+            save_json(self.path, file_ids)
+
+    def forget(self, url: Optional[str]) -> None:
+        """Drop the file_id of a URL whose image changed"""
+        with self._lock:
+            if self._file_ids.pop(url, None) is not None:
+                file_ids = load_json(self.path)
+                file_ids.pop(url, None)
+                save_json(self.path, file_ids)
+
+    def on_product_change(self, product_id: str, before: Optional[Dict], after: Optional[Dict]) -> None:
+        """Catalog listener: forget a product's old image when it is replaced or removed"""
+        old_image = (before or {}).get("image")
+        if old_image and old_image != (after or {}).get("image"):
+            self.forget(old_image)
+
+    def warm_up(self, urls: Iterable[str], chat_id: int) -> int:
+        """Upload uncached images to ``chat_id`` (deleting the messages) and return how many were cached"""
+        cached = 0
+        for url in dict.fromkeys(urls):
+            if not url or url in self._file_ids:
+                continue
+            try:
+                message = self.bot.send_photo(chat_id, url, disable_notification=True, priority=PRIORITY_LOW)
+                self._remember(url, message)
+                cached += 1
+                self.bot.delete_message(chat_id, message.message_id, priority=PRIORITY_LOW)
+            except Exception as e:
+                print(f"Media warm-up failed for {url}: {e}")
+        return cached
+
+    def stats(self) -> Dict:
+        return {"entries": len(self._file_ids), "hits": self._hits, "misses": self._misses}
@@ -0,0 +1,272 @@
+import heapq
+import itertools
+import random
+import socket
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from typing import Any, Dict, Optional
+from utils import percentile
+from config import (OUTBOUND_GLOBAL_RATE, OUTBOUND_PER_CHAT_RATE, OUTBOUND_PER_CHAT_BURST,
+                    OUTBOUND_SENDERS, OUTBOUND_MAX_RETRIES)
+
+PRIORITY_HIGH = 0    # purchased codes and invoices
+PRIORITY_NORMAL = 1  # replies to user actions
+PRIORITY_LOW = 2     # broadcasts
+
+# Bot methods that send to a chat and where their chat id is passed
+# (positional index; reply_to takes the message being answered)
+CHAT_METHODS = {
+    "send_message": 0,
+    "send_photo": 0,
+    "send_document": 0,
+    "send_media_group": 0,
+    "copy_message": 0,
+    "forward_message": 0,
+    "delete_message": 0,
+    "edit_message_text": 1,
+    "edit_message_caption": 1,
+    "edit_message_reply_markup": 0,
+    "reply_to": None,
+}
+
+def chat_id_of(method: str, args: tuple, kwargs: Dict) -> Any:
+    """Find the chat a bot call is addressed to"""
+    if method == "reply_to":
+        message = args[0] if args else kwargs["message"]
+        return message.chat.id
+    if "chat_id" in kwargs:
+        return kwargs["chat_id"]
+    position = CHAT_METHODS[method]
+    return args[position] if len(args) > position else None
+
+def retry_after_of(error: Exception) -> Optional[float]:
+    """retry_after of a Telegram 429 error, None for other errors"""
+    if getattr(error, "error_code", None) != 429:
+        return None
+    result = getattr(error, "result_json", None) or {}
+    return float(result.get("parameters", {}).get("retry_after", 1))
+
+# Calls that change nothing when repeated. Sends are not among them: a
+# timeout or server error after Telegram accepted a message would deliver
+# it twice if retried
+IDEMPOTENT_METHODS = {"delete_message", "edit_message_text", "edit_message_caption", "edit_message_reply_markup"}
+
+def is_connect_error(error: Exception) -> bool:
+    """The request never reached Telegram: DNS failure, refused or timed out connect"""
+    if isinstance(error, (ConnectionRefusedError, socket.gaierror)):
+        return True
+    if type(error).__name__ == "ConnectTimeout":
+        return True
+    # requests wraps urllib3's connect failures in a ConnectionError
+    cause = error.args[0] if error.args else None
+    reason = getattr(cause, "reason", cause)
+    return type(reason).__name__ in ("NewConnectionError", "NameResolutionError", "ConnectTimeoutError")
+
+def is_retryable(method: str, error: Exception) -> bool:
+    """Flood waits and failed connects are always safe to retry; server
+    errors and other network failures only for idempotent calls"""
+    code = getattr(error, "error_code", None)
+    if code == 429 or is_connect_error(error):
+        return True
+    if method not in IDEMPOTENT_METHODS:
+        return False
+    if code is not None:
+        return code >= 500
+    return isinstance(error, OSError)  # requests' read timeouts and dropped connections
+
+
+class OutboundQueue:
+    """Central scheduler for every message the bot sends.
+
+    Calls are queued per chat and handed to sender threads in priority
+    order while staying under the global and per-chat Telegram limits.
+    Messages to one chat keep their order. A 429 pauses the chat for the
+    returned ``retry_after`` plus jitter and the call is retried. Failed
+    connects, and server and network errors of idempotent calls, are
+    retried with jittered exponential backoff; a send that may have reached
+    Telegram is never repeated.
+    """
+
+    SWEEP_EVERY = 1000
+
+    def __init__(self, bot, global_rate: float = OUTBOUND_GLOBAL_RATE, per_chat_rate: float = OUTBOUND_PER_CHAT_RATE,
+                 per_chat_burst: int = OUTBOUND_PER_CHAT_BURST, senders: int = OUTBOUND_SENDERS,
+                 max_retries: int = OUTBOUND_MAX_RETRIES):
+        self.bot = bot
+        self.global_rate = global_rate
+        self.per_chat_rate = per_chat_rate
+        self.per_chat_burst = per_chat_burst
+        self.max_retries = max_retries
+        self._cond = threading.Condition()
+        self._seq = itertools.count()
+        self._chats = {}       # chat_id -> {"jobs": deque, "tokens", "updated", "ready_at", "busy"}
+        self._ready = []       # heap of (priority, seq, chat_id) for chats that may send now
+        self._waiting = []     # heap of (ready_at, priority, seq, chat_id) for paused chats
+        self._global_tokens = float(global_rate)
+        self._global_updated = time.monotonic()
+        self._latencies = deque(maxlen=1000)
+        self._counters = {"sent": 0, "failed": 0, "retried": 0, "flood_waits": 0}
+        self._submitted = 0
+        for index in range(senders):
+            threading.Thread(target=self._run, name=f"outbound-{index}", daemon=True).start()
+
+    def submit(self, method: str, *args, priority: int = PRIORITY_NORMAL, **kwargs) -> Future:
+        """Queue a bot call, the future resolves to its result"""
+        chat_id = chat_id_of(method, args, kwargs)
+        job = {"method": method, "args": args, "kwargs": kwargs, "priority": priority,
+               "future": Future(), "queued_at": time.monotonic(), "attempts": 0}
+        with self._cond:
+            self._submitted += 1
+            if self._submitted % self.SWEEP_EVERY == 0:
+                self._sweep(job["queued_at"])
+            chat = self._chats.get(chat_id)
+            if chat is None:
+                chat = self._chats[chat_id] = {"jobs": deque(), "tokens": float(self.per_chat_burst),
+                                               "updated": time.monotonic(), "ready_at": 0.0, "busy": False}
+            chat["jobs"].append(job)
+            if len(chat["jobs"]) == 1 and not chat["busy"]:
+                self._schedule(chat_id, chat)
+            self._cond.notify()
+        return job["future"]
+
+    def call(self, method: str, *args, priority: int = PRIORITY_NORMAL, **kwargs) -> Any:
+        """Queue a bot call and wait for its result (or exception)"""
+        return self.submit(method, *args, priority=priority, **kwargs).result()
+
+    # Scheduling, all under self._cond
+    def _sweep(self, now: float) -> None:
+        """Forget idle chats whose limits have fully recovered"""
+        for chat_id, chat in list(self._chats.items()):
+            if chat["jobs"] or chat["busy"] or chat["ready_at"] > now:
+                continue
+            self._refill_chat(chat, now)
+            if chat["tokens"] >= self.per_chat_burst:
+                del self._chats[chat_id]
+
+    def _refill_chat(self, chat: Dict, now: float) -> None:
+        chat["tokens"] = min(float(self.per_chat_burst), chat["tokens"] + (now - chat["updated"]) * self.per_chat_rate)
+        chat["updated"] = now
+
+    def _schedule(self, chat_id: Any, chat: Dict) -> None:
+        """Queue a chat with pending jobs for its next send"""
+        now = time.monotonic()
+        self._refill_chat(chat, now)
+        ready_at = max(chat["ready_at"], now + max(0.0, 1 - chat["tokens"]) / self.per_chat_rate)
+        priority = chat["jobs"][0]["priority"]
+        if ready_at <= now:
+            heapq.heappush(self._ready, (priority, next(self._seq), chat_id))
+        else:
+            heapq.heappush(self._waiting, (ready_at, priority, next(self._seq), chat_id))
+
+    def _next_job(self) -> Optional[tuple]:
+        """Pick the next sendable job or return how long to wait"""
+        now = time.monotonic()
+        while self._waiting and self._waiting[0][0] <= now:
+            _, priority, seq, chat_id = heapq.heappop(self._waiting)
+            heapq.heappush(self._ready, (priority, seq, chat_id))
+        if not self._ready:
+            return None, (self._waiting[0][0] - now) if self._waiting else None
+
+        self._global_tokens = min(float(self.global_rate),
+                                  self._global_tokens + (now - self._global_updated) * self.global_rate)
+        self._global_updated = now
+        if self._global_tokens < 1:
+            return None, (1 - self._global_tokens) / self.global_rate
+
+        _, _, chat_id = heapq.heappop(self._ready)
+        chat = self._chats[chat_id]
+        self._refill_chat(chat, now)
+        self._global_tokens -= 1
+        chat["tokens"] -= 1
+        chat["busy"] = True
+        return (chat_id, chat, chat["jobs"][0]), None
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while True:
+                    picked, wait = self._next_job()
+                    if picked is not None:
+                        break
+                    self._cond.wait(wait)
+            self._send(*picked)
+
+    def _send(self, chat_id: Any, chat: Dict, job: Dict) -> None:
+        job["attempts"] += 1
+        started = time.monotonic()
+        try:
+            result = getattr(self.bot, job["method"])(*job["args"], **job["kwargs"])
+        except Exception as e:
+            self._failed(chat_id, chat, job, e)
+            return
+        now = time.monotonic()
+        with self._cond:
+            self._counters["sent"] += 1
+            self._latencies.append((now - job["queued_at"], now - started))
+            self._finish(chat_id, chat)
+        job["future"].set_result(result)
+
+    def _failed(self, chat_id: Any, chat: Dict, job: Dict, error: Exception) -> None:
+        retry_after = retry_after_of(error)
+        retry = job["attempts"] <= self.max_retries and is_retryable(job["method"], error)
+        with self._cond:
+            if retry:
+                if retry_after is not None:
+                    self._counters["flood_waits"] += 1
+                    delay = retry_after + random.uniform(0, 1)
+                else:
+                    delay = min(30.0, 0.5 * 2 ** (job["attempts"] - 1)) * random.uniform(0.5, 1.5)
+                self._counters["retried"] += 1
+                chat["ready_at"] = time.monotonic() + delay
+                chat["busy"] = False
+                self._schedule(chat_id, chat)  # the job stays at the head of the chat queue
+                self._cond.notify()
+                return
+            self._counters["failed"] += 1
+            self._finish(chat_id, chat)
+        job["future"].set_exception(error)
+
+    def _finish(self, chat_id: Any, chat: Dict) -> None:
+        chat["jobs"].popleft()
+        chat["busy"] = False
+        if chat["jobs"]:
+            self._schedule(chat_id, chat)
+            self._cond.notify()
+
+    def queue_depth(self) -> int:
+        """Calls waiting to be sent"""
+        with self._cond:
+            return sum(len(chat["jobs"]) for chat in self._chats.values())
+
+    def stats(self) -> Dict:
+        """Send counters and latency percentiles (queue wait + send) in ms"""
+        with self._cond:
+            samples = list(self._latencies)
+            stats = dict(self._counters, queue_depth=sum(len(chat["jobs"]) for chat in self._chats.values()))
+        for name, index in (("latency", 0), ("send", 1)):
+            values = [sample[index] for sample in samples]
+            for pct in (50, 95, 99):
+                stats[f"{name}_p{pct}_ms"] = percentile(values, pct) * 1000
+        return stats
+
+
+class QueuedBot:
+    """TeleBot stand-in that routes chat sends through an OutboundQueue.
+
+    Send methods block until delivered and return or raise like the real
+    call, so existing ``try/except`` fallbacks keep working; they accept an
+    extra ``priority`` keyword. Everything else goes to the wrapped bot.
+    """
+
+    def __init__(self, bot, outbound: OutboundQueue):
+        self._bot = bot
+        self.outbound = outbound
+
+    def __getattr__(self, name: str):
+        if name in CHAT_METHODS:
+            def send(*args, priority: int = PRIORITY_NORMAL, **kwargs):
+                return self.outbound.call(name, *args, priority=priority, **kwargs)
+            return send
+        return getattr(self._bot, name)
@@ -8,15 +8,373 @@ from reportlab.pdfgen import canvas
 from reportlab.lib.colors import HexColor
 from io import BytesIO
 from datetime import datetime
-from typing import Dict, Any
-from config import STORE_NAME, OWNER_USERNAME, CHANNEL_LINK, CURRENCY
+from functools import lru_cache
+import threading
+from typing import Dict, Any, Iterable, Tuple
+from config import (STORE_NAME, OWNER_USERNAME, CHANNEL_LINK, CURRENCY, INVOICE_RENDERER, INVOICE_FILENAME,
+                    INVOICE_HEADER, INVOICE_FOOTER, INVOICE_CONTACT_INFO, INVOICE_FONT_FILE, SHAPED_TEXT_CACHE_SIZE)
 from reportlab.pdfbase import pdfmetrics
 from reportlab.pdfbase.ttfonts import TTFont
 
-class PDFInvoiceGenerator:
+try:
+    import arabic_reshaper
+    from bidi.algorithm import get_display
+except ImportError:  # optional: Arabic is then drawn unjoined and in logical order
+    arabic_reshaper = None
+
+ARABIC_FONT = 'InvoiceArabic'
+_font_lock = threading.Lock()
+_arabic_font_ready = None
+
+def register_arabic_font() -> bool:
+    """Register INVOICE_FONT_FILE once per process, False if it can't be loaded
+
+    reportlab embeds only the glyphs a document uses (a font subset), so the
+    full TTF never ends up in the PDFs.
+    """
+    global _arabic_font_ready
+    if _arabic_font_ready is None:
+        with _font_lock:
+            if _arabic_font_ready is None:
+                try:
+                    pdfmetrics.registerFont(TTFont(ARABIC_FONT, INVOICE_FONT_FILE))
+                    _arabic_font_ready = True
+                except Exception as e:
+                    print(f"❌ Arabic PDF font {INVOICE_FONT_FILE} could not be loaded ({e}); Arabic names in "
+                          f"invoices and reports will not display. Install the TTF there or set INVOICE_FONT_FILE.")
+                    _arabic_font_ready = False
+    return _arabic_font_ready
+
+@lru_cache(maxsize=SHAPED_TEXT_CACHE_SIZE)
+def shape_text(text: str) -> str:
+    """Join Arabic letters into their contextual forms and reorder the line for display"""
+    if arabic_reshaper is None:
+        return text
+    return get_display(arabic_reshaper.reshape(text))
+
+def pdf_text(value: Any, font: str) -> Tuple[str, str]:
+    """Text and font to draw a value with: Latin-1 text keeps ``font``, other text is shaped for the Arabic font"""
+    text = str(value)
+    try:
+        text.encode('latin-1')
+        return text, font
+    except UnicodeEncodeError:
+        pass
+    if not register_arabic_font():
+        return text, font
+    return shape_text(text), ARABIC_FONT
+
+def truncate(text: str, font: str, size: float, max_width: float) -> str:
+    """Cut text to max_width with an ellipsis; shaped Arabic is in display order, so it loses its left end"""
+    rtl = font == ARABIC_FONT
+    while len(text) > 1 and pdfmetrics.stringWidth(text, font, size) > max_width:
+        text = '…' + text[2:] if rtl else text[:-2] + '…'
+    return text
+
+class FastInvoiceRenderer:
+    """Draws invoices on a bare canvas over a precompiled static layer.
+
+    The parts of the invoice that never change and use the standard fonts
+    (headings, labels, table fills and grid, the instruction line) are drawn
+    once on a scratch canvas and kept as page content. Each invoice places
+    that content as a form XObject (``beginForm``/``doForm``) and draws only
+    the text that needs the Arabic font and the sale's own values on top.
+    No platypus layout runs per invoice. Headings, contact block and footer
+    come from INVOICE_HEADER, INVOICE_CONTACT_INFO and INVOICE_FOOTER.
+
+    Arabic text goes through the canvas like any other, so reportlab embeds
+    only the glyphs an invoice uses and a customer name seen for the first
+    time costs the same as one seen before.
+    """
+
+    WIDTH, HEIGHT = A4
+    LABEL_WIDTH = 2 * inch
+    VALUE_WIDTH = 3 * inch
+    ROW_HEIGHT = 22
+    FONT = 'Helvetica'
+    BOLD = 'Helvetica-Bold'
+    FONT_SIZE = 11
+    MIN_FONT_SIZE = 6
+    PADDING = 6
+    STATIC_FORM = 'InvoiceStatic'
+
+    INVOICE_ROWS = ('Invoice ID:', 'Customer ID:', 'Customer Name:', 'Purchase Date:', 'Product:', 'Price:')
+    INVOICE_TOP = 680
+    CODE_TOP = 488
+
+    def __init__(self):
+        self.left = (self.WIDTH - self.LABEL_WIDTH - self.VALUE_WIDTH) / 2
+        self.value_x = self.left + self.LABEL_WIDTH + self.PADDING
+        lines = self._static_lines()
+        self._arabic_lines = [line for line in lines if line[1] == ARABIC_FONT]
+        self._layer = self._compile_layer([line for line in lines if line[1] != ARABIC_FONT])
+
+    def _fit(self, text: str, font: str, max_width: float) -> tuple:
+        """Largest font size (down to MIN_FONT_SIZE) at which text fits, cutting it if needed"""
+        size = self.FONT_SIZE
+        while size > self.MIN_FONT_SIZE and pdfmetrics.stringWidth(text, font, size) > max_width:
+            size -= 0.5
+        return truncate(text, font, size, max_width), size
+
+    def _table(self, c: canvas.Canvas, top: float, labels: tuple, label_fill, row_fills: tuple) -> None:
+        """Draw the label column, row fills and grid of a two-column table"""
+        for index, label in enumerate(labels):
+            bottom = top - (index + 1) * self.ROW_HEIGHT
+            c.setFillColor(row_fills[index % len(row_fills)])
+            c.rect(self.left + self.LABEL_WIDTH, bottom, self.VALUE_WIDTH, self.ROW_HEIGHT, stroke=0, fill=1)
+            c.setFillColor(label_fill)
+            c.rect(self.left, bottom, self.LABEL_WIDTH, self.ROW_HEIGHT, stroke=0, fill=1)
+            c.setFillColor(colors.black)
+            c.setFont(self.BOLD, self.FONT_SIZE)
+            c.drawString(self.left + self.PADDING, bottom + 7, label)
+        c.setStrokeColor(colors.black)
+        c.setLineWidth(1)
+        c.grid([self.left, self.left + self.LABEL_WIDTH, self.left + self.LABEL_WIDTH + self.VALUE_WIDTH],
+               [top - index * self.ROW_HEIGHT for index in range(len(labels) + 1)])
+
+    def _use_fonts(self, c: canvas.Canvas) -> None:
+        """Name the standard fonts in a fixed order, so the layer's font names hold on every canvas"""
+        for font in (self.FONT, self.BOLD):
+            c.setFont(font, self.FONT_SIZE)
+
+    def _static_lines(self) -> list:
+        """``(text, font, size, color, x, y, centred)`` of the configured text lines"""
+        centre = self.WIDTH / 2
+        lines = [pdf_text(INVOICE_HEADER, self.BOLD) + (18, colors.darkblue, centre, 752, True)]
+        y = 400
+        for line in INVOICE_CONTACT_INFO.strip().split('\n'):
+            lines.append(pdf_text(line.strip(), self.FONT) + (12, colors.black, inch, y, False))
+            y -= 16
+        lines.append(pdf_text(INVOICE_FOOTER, self.BOLD) + (10, colors.grey, centre, 270, True))
+        return lines
+
+    @staticmethod
+    def _draw_lines(c: canvas.Canvas, lines: list) -> None:
+        for text, font, size, color, x, y, centred in lines:
+            c.setFillColor(color)
+            c.setFont(font, size)
+            if centred:
+                c.drawCentredString(x, y, text)
+            else:
+                c.drawString(x, y, text)
+
+    def _draw_static(self, c: canvas.Canvas, lines: list) -> None:
+        centre = self.WIDTH / 2
+        self._draw_lines(c, lines)
+        c.setFillColor(colors.black)
+        c.setFont(self.BOLD, 16)
+        c.drawCentredString(centre, 705, "PURCHASE INVOICE")
+        self._table(c, self.INVOICE_TOP, self.INVOICE_ROWS, colors.lightgrey, (colors.white, colors.lightgrey))
+
+        c.setFillColor(colors.black)
+        c.setFont(self.BOLD, 16)
+        c.drawCentredString(centre, self.CODE_TOP + 15, "PRODUCT DETAILS:")
+        self._table(c, self.CODE_TOP, ('Product Code:', 'Instructions:'), colors.lightblue, (colors.white,))
+        instructions, size = self._fit('Please keep this code safe and follow product instructions',
+                                       self.FONT, self.VALUE_WIDTH - 2 * self.PADDING)
+        c.setFont(self.FONT, size)
+        c.drawString(self.value_x, self.CODE_TOP - 2 * self.ROW_HEIGHT + 7, instructions)
+
+    def _compile_layer(self, lines: list) -> str:
+        """Draw the standard-font part of the invoice once and keep its page content"""
+        c = canvas.Canvas(BytesIO(), pagesize=A4)
+        self._use_fonts(c)
+        c.saveState()
+        self._draw_static(c, lines)
+        c.restoreState()
+        return c.getCurrentPageContent()
+
+    def _fields_text(self, c: canvas.Canvas, fields: list):
+        """Text object drawing ``(text, font, y)`` fields in the value column"""
+        text = c.beginText()
+        text.setFillColor(colors.black)
+        max_width = self.VALUE_WIDTH - 2 * self.PADDING
+        for value, font, y in fields:
+            value, size = self._fit(value, font, max_width)
+            text.setFont(font, size)
+            text.setTextOrigin(self.value_x, y)
+            text.textOut(value)
+        return text
+
+    def render(self, sale_data: Dict[str, Any], user_data: Dict[str, Any]) -> BytesIO:
+        """Draw one sale over the static layer"""
+        values = (
+            sale_data.get('invoice_id', 'N/A'),
+            user_data.get('user_id', 'N/A'),
+            user_data.get('name', 'Customer'),
+            sale_data.get('timestamp', datetime.now().strftime('%Y-%m-%d %H:%M:%S')),
+            sale_data.get('product_name', 'N/A'),
+            f"{sale_data.get('price', 0):,} {CURRENCY}",
+        )
+        rows = [(value, self.INVOICE_TOP - (index + 1) * self.ROW_HEIGHT + 7) for index, value in enumerate(values)]
+        rows.append((sale_data.get('code') or 'N/A', self.CODE_TOP - self.ROW_HEIGHT + 7))
+        fields = [pdf_text(value, self.FONT) + (y,) for value, y in rows]
+
+        buffer = BytesIO()
+        # Uncompressed: deflating the page and the font subset costs more
+        # than the few kilobytes it saves on a one-page invoice
+        c = canvas.Canvas(buffer, pagesize=A4, pageCompression=0)
+        c.setTitle(INVOICE_FILENAME)
+        self._use_fonts(c)
+        c.beginForm(self.STATIC_FORM)
+        c.addLiteral(self._layer)
+        c.endForm()
+        c.doForm(self.STATIC_FORM)
+        c.saveState()
+        self._draw_lines(c, self._arabic_lines)
+        c.restoreState()
+        c.drawText(self._fields_text(c, fields))
+        c.showPage()
+        c.save()
+        buffer.seek(0)
+        return buffer
+
+
+class SalesReport:
+    """Sales totals per day and per product, built one sale at a time.
+
+    Memory grows with the number of days, products and customers in the
+    range, not with the number of sales.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.revenue = 0
+        self.customers = set()
+        self.days: Dict[str, Dict[str, int]] = {}
+        self.products: Dict[str, Dict[str, int]] = {}
+
+    def add(self, user_id: str, sale: Dict[str, Any]) -> None:
+        price = sale.get('price', 0)
+        self.count += 1
+        self.revenue += price
+        self.customers.add(user_id)
+        for bucket, key in ((self.days, sale.get('date', '')[:10]), (self.products, sale.get('product', ''))):
+            counter = bucket.get(key)
+            if counter is None:
+                counter = bucket[key] = {'count': 0, 'revenue': 0}
+            counter['count'] += 1
+            counter['revenue'] += price
+
+
+class SalesReportRenderer:
+    """Draws a SalesReport on as many A4 pages as its tables need"""
+
+    WIDTH, HEIGHT = A4
+    MARGIN = inch
+    ROW_HEIGHT = 18
+    FONT = 'Helvetica'
+    BOLD = 'Helvetica-Bold'
+
     def __init__(self):
+        self.c = None
+        self.y = 0
+        self.page = 0
+
+    def _new_page(self) -> None:
+        if self.page:
+            self._page_footer()
+            self.c.showPage()
+        self.page += 1
+        self.y = self.HEIGHT - self.MARGIN
+
+    def _page_footer(self) -> None:
+        self.c.setFillColor(colors.grey)
+        self.c.setFont(self.BOLD, 9)
+        self.c.drawCentredString(self.WIDTH / 2, self.MARGIN / 2, f"{INVOICE_FOOTER} - Page {self.page}")
+        self.c.setFillColor(colors.black)
+
+    def _line(self, text: str, font: str, size: int, spacing: float) -> None:
+        if self.y - spacing < self.MARGIN:
+            self._new_page()
+        self.y -= spacing
+        self.c.setFont(font, size)
+        self.c.drawString(self.MARGIN, self.y, text)
+
+    def _table(self, title: str, columns: Tuple[Tuple[str, float], ...], rows: Iterable[Tuple]) -> None:
+        """Draw a table, repeating its column headings on every page it spans"""
+        right = self.WIDTH - self.MARGIN
+
+        def heading():
+            self.y -= self.ROW_HEIGHT
+            self.c.setFillColor(colors.lightgrey)
+            self.c.rect(self.MARGIN, self.y - 5, right - self.MARGIN, self.ROW_HEIGHT, stroke=0, fill=1)
+            self.c.setFillColor(colors.black)
+            self.c.setFont(self.BOLD, 10)
+            for label, x in columns:
+                self.c.drawString(self.MARGIN + x, self.y, label)
+
+        edges = [x for _, x in columns[1:]] + [right - self.MARGIN]
+        limits = [edge - x - 6 for (_, x), edge in zip(columns, edges)]
+
+        # Keep the title with the headings and a first row
+        if self.y - 30 - 3 * self.ROW_HEIGHT < self.MARGIN:
+            self._new_page()
+        self._line(title, self.BOLD, 13, 30)
+        heading()
+        for row in rows:
+            if self.y - self.ROW_HEIGHT < self.MARGIN:
+                self._new_page()
+                heading()
+            self.y -= self.ROW_HEIGHT
+            for value, (_, x), limit in zip(row, columns, limits):
+                text, font = pdf_text(value, self.FONT)
+                self.c.setFont(font, 10)
+                self.c.drawString(self.MARGIN + x, self.y, truncate(text, font, 10, limit))
+            self.c.setStrokeColor(colors.lightgrey)
+            self.c.line(self.MARGIN, self.y - 5, right, self.y - 5)
+
+    def render(self, report: SalesReport, date_range: str = None) -> BytesIO:
+        buffer = BytesIO()
+        self.c = canvas.Canvas(buffer, pagesize=A4)
+        self.c.setTitle("Sales Report")
+        self._new_page()
+
+        self.c.setFillColor(colors.darkblue)
+        self.c.setFont(self.BOLD, 18)
+        self.y -= 18
+        self.c.drawCentredString(self.WIDTH / 2, self.y, "SALES REPORT")
+        self.c.setFillColor(colors.black)
+        if date_range:
+            self._line(f"Period: {date_range}", self.FONT, 12, 28)
+        average = report.revenue // report.count if report.count else 0
+        for label, value in (("Total Sales:", str(report.count)),
+                             ("Total Revenue:", f"{report.revenue:,} {CURRENCY}"),
+                             ("Unique Customers:", str(len(report.customers))),
+                             ("Average Sale:", f"{average:,} {CURRENCY}"),
+                             ("Report Date:", datetime.now().strftime('%Y-%m-%d %H:%M:%S'))):
+            self._line(label, self.BOLD, 11, 18)
+            self.c.setFont(self.FONT, 11)
+            self.c.drawString(self.MARGIN + 2 * inch, self.y, value)
+
+        if report.days:
+            self._table("Revenue by day", (("Date", 0), ("Sales", 2 * inch), ("Revenue", 3.2 * inch)),
+                        ((day, counter['count'], f"{counter['revenue']:,} {CURRENCY}")
+                         for day, counter in sorted(report.days.items())))
+        if report.products:
+            self._table("Revenue by product",
+                        (("Product", 0), ("Sales", 2.6 * inch), ("Revenue", 3.4 * inch), ("Share", 5 * inch)),
+                        ((name, counter['count'], f"{counter['revenue']:,} {CURRENCY}",
+                          f"{counter['revenue'] * 100 / report.revenue:.1f}%" if report.revenue else "-")
+                         for name, counter in sorted(report.products.items(),
+                                                     key=lambda item: item[1]['revenue'], reverse=True)))
+        else:
+            self._line("No sales in this period", self.FONT, 12, 30)
+
+        self._page_footer()
+        self.c.showPage()
+        self.c.save()
+        buffer.seek(0)
+        return buffer
+
+
+class PDFInvoiceGenerator:
+    def __init__(self, renderer: str = INVOICE_RENDERER):
         self.styles = getSampleStyleSheet()
         self.setup_custom_styles()
+        # "fast": canvas renderer, "story": the platypus layout below
+        self.fast_renderer = FastInvoiceRenderer() if renderer == "fast" else None
+        register_arabic_font()
 
     def setup_custom_styles(self):
         """Setup custom styles for better Arabic text rendering"""
@@ -65,6 +423,23 @@ class PDFInvoiceGenerator:
 
     def create_invoice(self, sale_data: Dict[str, Any], user_data: Dict[str, Any]) -> BytesIO:
         """Create professional PDF invoice"""
+        if self.fast_renderer is not None:
+            return self.fast_renderer.render(sale_data, user_data)
+        return self.create_story_invoice(sale_data, user_data)
+
+    @staticmethod
+    def shape_values(table_data: list) -> list:
+        """Shape the value column of a label/value table in place, returns FONTNAME commands for Arabic cells"""
+        commands = []
+        for row, (_, value) in enumerate(table_data):
+            text, font = pdf_text(value, 'Helvetica')
+            table_data[row][1] = text
+            if font != 'Helvetica':
+                commands.append(('FONTNAME', (1, row), (1, row), font))
+        return commands
+
+    def create_story_invoice(self, sale_data: Dict[str, Any], user_data: Dict[str, Any]) -> BytesIO:
+        """Create the invoice with a platypus document layout"""
         buffer = BytesIO()
         
         # Create PDF document
@@ -100,6 +475,8 @@ class PDFInvoiceGenerator:
             ['Price:', f"{sale_data.get('price', 0):,} {CURRENCY}"],
         ]
         
+        value_fonts = self.shape_values(invoice_data)
+        
         invoice_table = Table(invoice_data, colWidths=[2*inch, 3*inch])
         invoice_table.setStyle(TableStyle([
             ('BACKGROUND', (0, 0), (0, -1), colors.lightgrey),
@@ -111,7 +488,7 @@ class PDFInvoiceGenerator:
             ('GRID', (0, 0), (-1, -1), 1, colors.black),
             ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
             ('ROWBACKGROUNDS', (0, 0), (-1, -1), [colors.white, colors.lightgrey])
-        ]))
+        ] + value_fonts))
         
         story.append(invoice_table)
         story.append(Spacer(1, 30))
@@ -126,6 +503,8 @@ class PDFInvoiceGenerator:
                 ['Instructions:', 'Please keep this code safe and follow product instructions']
             ]
             
+            value_fonts = self.shape_values(code_data)
+            
             code_table = Table(code_data, colWidths=[2*inch, 3*inch])
             code_table.setStyle(TableStyle([
                 ('BACKGROUND', (0, 0), (0, -1), colors.lightblue),
@@ -136,7 +515,7 @@ class PDFInvoiceGenerator:
                 ('FONTSIZE', (0, 0), (-1, -1), 11),
                 ('GRID', (0, 0), (-1, -1), 1, colors.black),
                 ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-            ]))
+            ] + value_fonts))
             
             story.append(code_table)
             story.append(Spacer(1, 30))
@@ -195,56 +574,9 @@ By: Yasiin
         buffer.seek(0)
         return buffer
 
-    def create_sales_report(self, sales_data: Dict[str, Any], date_range: str = None) -> BytesIO:
-        """Create sales report PDF"""
-        buffer = BytesIO()
-        
-        doc = SimpleDocTemplate(
-            buffer,
-            pagesize=A4,
-            rightMargin=inch,
-            leftMargin=inch,
-            topMargin=inch,
-            bottomMargin=inch,
-            title="Sales Report"
-        )
-        
-        story = []
-        
-        # Header
-        story.append(Paragraph("SALES REPORT", self.header_style))
-        story.append(Spacer(1, 20))
-        
-        if date_range:
-            story.append(Paragraph(f"Period: {date_range}", self.normal_style))
-            story.append(Spacer(1, 15))
-        
-        # Sales summary
-        total_sales = len(sales_data)
-        total_revenue = sum(sale.get('price', 0) for sale in sales_data.values())
-        
-        summary_data = [
-            ['Total Sales:', str(total_sales)],
-            ['Total Revenue:', f"{total_revenue:,} {CURRENCY}"],
-            ['Report Date:', datetime.now().strftime('%Y-%m-%d %H:%M:%S')]
-        ]
-        
-        summary_table = Table(summary_data, colWidths=[2*inch, 3*inch])
-        summary_table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (0, -1), colors.lightgrey),
-            ('TEXTCOLOR', (0, 0), (-1, -1), colors.black),
-            ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-            ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
-            ('FONTSIZE', (0, 0), (-1, -1), 11),
-            ('GRID', (0, 0), (-1, -1), 1, colors.black),
-        ]))
-        
-        story.append(summary_table)
-        story.append(Spacer(1, 20))
-        
-        # Footer
-        story.append(Paragraph("By: Yasiin", self.footer_style))
-        
-        doc.build(story)
-        buffer.seek(0)
-        return buffer
+    def create_sales_report(self, sales: Iterable[Tuple[str, Dict[str, Any]]], date_range: str = None) -> BytesIO:
+        """Create sales report PDF from a stream of ``(user_id, sale)`` pairs, such as ``db.iter_sales()``"""
+        report = SalesReport()
+        for user_id, sale in sales:
+            report.add(user_id, sale)
+        return SalesReportRenderer().render(report, date_range)
@@ -0,0 +1,152 @@
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Tuple
+from utils import ensure_directory
+from config import (RATE_LIMIT_SECONDS, MAX_REQUESTS_PER_MINUTE, RATE_LIMIT_BACKEND,
+                    RATE_LIMIT_DATABASE_FILE, RATE_LIMIT_MAX_ENTRIES)
+
+class TokenBuckets:
+    """The two limits as token buckets.
+
+    A burst bucket holding one token refilled every ``min_interval`` seconds
+    enforces the gap between actions, and a bucket of ``per_minute`` tokens
+    refilled continuously caps the rate. An action takes a token from both.
+    """
+
+    def __init__(self, min_interval: float = RATE_LIMIT_SECONDS, per_minute: int = MAX_REQUESTS_PER_MINUTE):
+        self.min_interval = min_interval
+        self.per_minute = per_minute
+        self.minute_rate = per_minute / 60
+        # After this long without actions both buckets are full again, the
+        # same as having no entry at all
+        self.idle_seconds = max(min_interval, 60)
+
+    def initial(self) -> Tuple[float, float]:
+        return 1.0, float(self.per_minute)
+
+    def take(self, burst: float, minute: float, elapsed: float) -> Tuple[bool, float, float]:
+        """Refill both buckets for ``elapsed`` seconds and try to take a token"""
+        if self.min_interval > 0:
+            burst = min(1.0, burst + elapsed / self.min_interval)
+        else:
+            burst = 1.0
+        minute = min(float(self.per_minute), minute + elapsed * self.minute_rate)
+        if burst < 1.0 or minute < 1.0:
+            return False, burst, minute
+        return True, burst - 1.0, minute - 1.0
+
+
+class RateLimiter:
+    """Per-user token buckets kept in memory.
+
+    Entries are kept in least-recently-used order; idle ones are evicted as
+    new checks arrive and the table never exceeds ``max_entries``.
+    """
+
+    def __init__(self, buckets: TokenBuckets = None, max_entries: int = RATE_LIMIT_MAX_ENTRIES):
+        self.buckets = buckets or TokenBuckets()
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def allow(self, key: str) -> bool:
+        """Check and count one action of ``key``"""
+        now = time.monotonic()
+        with self._lock:
+            self._evict(now)
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                burst, minute, last = *self.buckets.initial(), now
+            else:
+                burst, minute, last = entry
+            allowed, burst, minute = self.buckets.take(burst, minute, now - last)
+            self._entries[key] = (burst, minute, now)
+            return allowed
+
+    def _evict(self, now: float) -> None:
+        while self._entries:
+            key, (_, _, last) = next(iter(self._entries.items()))
+            if now - last < self.buckets.idle_seconds and len(self._entries) < self.max_entries:
+                break
+            del self._entries[key]
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class SQLiteRateLimiter:
+    """Token buckets in a SQLite file shared by every bot process on the host"""
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS rate_limits (
+        key TEXT PRIMARY KEY,
+        burst REAL NOT NULL,
+        minute REAL NOT NULL,
+        updated REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_rate_limits_updated ON rate_limits (updated);
+    """
+
+    EVICT_EVERY = 1000
+
+    def __init__(self, path: str = RATE_LIMIT_DATABASE_FILE, buckets: TokenBuckets = None):
+        self.path = path
+        self.buckets = buckets or TokenBuckets()
+        self._local = threading.local()
+        self._checks = 0
+        ensure_directory(path)
+        conn = self._conn()
+        conn.executescript(self.SCHEMA)
+        conn.commit()
+
+    def _conn(self) -> sqlite3.Connection:
+        """Get the connection of the current thread"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=OFF")
+            self._local.conn = conn
+        return conn
+
+    def allow(self, key: str) -> bool:
+        """Check and count one action of ``key``"""
+        now = time.time()  # wall clock, shared across processes
+        try:
+            return self._allow(key, now)
+        except sqlite3.Error as e:
+            # Never lock customers out because the limiter database is busy
+            print(f"Rate limiter unavailable: {e}")
+            return True
+
+    def _allow(self, key: str, now: float) -> bool:
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT burst, minute, updated FROM rate_limits WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                burst, minute, last = *self.buckets.initial(), now
+            else:
+                burst, minute, last = row
+            allowed, burst, minute = self.buckets.take(burst, minute, max(0.0, now - last))
+            conn.execute("INSERT OR REPLACE INTO rate_limits (key, burst, minute, updated) VALUES (?, ?, ?, ?)",
+                         (key, burst, minute, now))
+            self._checks += 1
+            if self._checks % self.EVICT_EVERY == 0:
+                conn.execute("DELETE FROM rate_limits WHERE updated < ?", (now - self.buckets.idle_seconds,))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return allowed
+
+
+def create_rate_limiter(backend: str = RATE_LIMIT_BACKEND):
+    """Create the configured rate limiter"""
+    if backend == "sqlite":
+        return SQLiteRateLimiter()
+    if backend == "memory":
+        return RateLimiter()
+    raise ValueError(f"Unknown rate limit backend: {backend}")
@@ -0,0 +1,170 @@
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+from utils import ensure_directory
+from config import STATE_BACKEND, STATE_DATABASE_FILE, STATE_TTL_SECONDS, STATE_MAX_ENTRIES
+
+class StateStore:
+    """Conversation states of multi-step flows kept in memory.
+
+    Each state expires ``ttl`` seconds after it was last written, and the
+    oldest states are dropped once ``max_entries`` is reached, so abandoned
+    flows never pile up.
+    """
+
+    def __init__(self, ttl: int = STATE_TTL_SECONDS, max_entries: int = STATE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._states = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _evict(self, now: float) -> None:
+        while self._states:
+            user_id, (_, expires) = next(iter(self._states.items()))
+            if expires > now and len(self._states) < self.max_entries:
+                break
+            del self._states[user_id]
+
+    def get(self, user_id: str) -> Optional[Dict]:
+        """Get a copy of the user's state, None if missing or expired"""
+        with self._lock:
+            entry = self._states.get(user_id)
+            if entry is None:
+                return None
+            if entry[1] <= time.monotonic():
+                del self._states[user_id]
+                return None
+            return dict(entry[0])
+
+    def set(self, user_id: str, state: Dict) -> None:
+        """Replace the user's state and restart its TTL"""
+        now = time.monotonic()
+        with self._lock:
+            self._states.pop(user_id, None)
+            self._evict(now)
+            self._states[user_id] = (dict(state), now + self.ttl)
+
+    def update(self, user_id: str, **fields) -> bool:
+        """Change fields of an existing state, False if there is none"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._states.pop(user_id, None)
+            if entry is None or entry[1] <= now:
+                return False
+            self._states[user_id] = (dict(entry[0], **fields), now + self.ttl)
+            return True
+
+    def delete(self, user_id: str) -> None:
+        """End the user's flow"""
+        with self._lock:
+            self._states.pop(user_id, None)
+
+    def __len__(self) -> int:
+        return len(self._states)
+
+
+class SQLiteStateStore:
+    """Conversation states in a SQLite file.
+
+    States survive restarts and are visible to every bot process on the
+    host. Expired rows are ignored on read and purged as new states are
+    written; the table is trimmed to ``max_entries`` by expiry.
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS conversation_states (
+        user_id TEXT PRIMARY KEY,
+        state TEXT NOT NULL,
+        expires REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_conversation_states_expires ON conversation_states (expires);
+    """
+
+    PURGE_EVERY = 100
+
+    def __init__(self, path: str = STATE_DATABASE_FILE, ttl: int = STATE_TTL_SECONDS,
+                 max_entries: int = STATE_MAX_ENTRIES):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self._writes = 0
+        ensure_directory(path)
+        conn = self._conn()
+        conn.executescript(self.SCHEMA)
+        conn.commit()
+
+    def _conn(self) -> sqlite3.Connection:
+        """Get the connection of the current thread"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, user_id: str) -> Optional[Dict]:
+        """Get the user's state, None if missing or expired"""
+        row = self._conn().execute("SELECT state FROM conversation_states WHERE user_id = ? AND expires > ?",
+                                   (user_id, time.time())).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, user_id: str, state: Dict) -> None:
+        """Replace the user's state and restart its TTL"""
+        now = time.time()
+        conn = self._conn()
+        with conn:
+            conn.execute("INSERT OR REPLACE INTO conversation_states (user_id, state, expires) VALUES (?, ?, ?)",
+                         (user_id, json.dumps(state, ensure_ascii=False), now + self.ttl))
+            self._writes += 1
+            if self._writes % self.PURGE_EVERY == 0:
+                self._purge(conn, now)
+
+    def _purge(self, conn: sqlite3.Connection, now: float) -> None:
+        conn.execute("DELETE FROM conversation_states WHERE expires <= ?", (now,))
+        conn.execute("DELETE FROM conversation_states WHERE user_id IN (SELECT user_id FROM conversation_states "
+                     "ORDER BY expires DESC LIMIT -1 OFFSET ?)", (self.max_entries,))
+
+    def update(self, user_id: str, **fields) -> bool:
+        """Change fields of an existing state, False if there is none
+
+        The read and the write share one write transaction, so concurrent
+        updates from other threads or processes are not lost.
+        """
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            now = time.time()
+            row = conn.execute("SELECT state FROM conversation_states WHERE user_id = ? AND expires > ?",
+                               (user_id, now)).fetchone()
+            if row is None:
+                conn.rollback()
+                return False
+            state = json.loads(row[0])
+            state.update(fields)
+            conn.execute("UPDATE conversation_states SET state = ?, expires = ? WHERE user_id = ?",
+                         (json.dumps(state, ensure_ascii=False), now + self.ttl, user_id))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        return True
+
+    def delete(self, user_id: str) -> None:
+        """End the user's flow"""
+        conn = self._conn()
+        with conn:
+            conn.execute("DELETE FROM conversation_states WHERE user_id = ?", (user_id,))
+
+
+def create_state_store(backend: str = STATE_BACKEND):
+    """Create the configured conversation state store"""
+    if backend == "sqlite":
+        return SQLiteStateStore()
+    if backend == "memory":
+        return StateStore()
+    raise ValueError(f"Unknown state backend: {backend}")
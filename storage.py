@@ -0,0 +1,1150 @@
+import bisect
+import json
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+from typing import Dict, List, Optional, Any
+from utils import load_json, ensure_directory, get_current_timestamp, GroupCommitWriter
+from inventory import CodeInventory
+from ledger import SalesLedger, SalesStats
+from wal import BalanceWAL
+from config import (USERS_FILE, PRODUCTS_FILE, SALES_FILE, RECHARGE_REQUESTS_FILE, DATABASE_FILE,
+                    SALES_LEDGER_DIR, WAL_DIR, STORAGE_BACKEND, DURABILITY_MODE, GROUP_COMMIT_WINDOW_MS,
+                    WAL_COMPACT_INTERVAL_SECONDS)
+
+class ProductLocks:
+    """One lock per product id, created on first use"""
+
+    def __init__(self):
+        self._locks = {}
+        self._guard = threading.Lock()
+
+    def get(self, product_id: str) -> threading.Lock:
+        with self._guard:
+            return self._locks.setdefault(product_id, threading.Lock())
+
+class JSONStorage:
+    """In-memory data store with write-through persistence to the JSON files.
+
+    Every file is parsed once on startup; reads are served from memory and
+    each mutation rewrites only the file it touched. Product codes are kept
+    out of products.json in a CodeInventory; products carry a ``stock`` count.
+    Sales are appended to a SalesLedger instead of rewriting sales.json,
+    with running totals kept in SalesStats. Pending users and recharge
+    requests are tracked in status indexes so listing them never scans the
+    full history. File rewrites go through a GroupCommitWriter. Balance
+    changes are appended to a BalanceWAL and folded into users.json by a
+    background compactor instead of rewriting it on every purchase.
+    Purchases of one product are serialized by its own lock and hold the
+    storage lock only to charge the balance.
+    """
+
+    def __init__(self, durability: str = DURABILITY_MODE, compact_interval: int = WAL_COMPACT_INTERVAL_SECONDS):
+        self._lock = threading.RLock()
+        self._product_locks = ProductLocks()
+        self._sales_lock = threading.Lock()  # ledger append and stats of one sale
+        self.writer = GroupCommitWriter(durability, GROUP_COMMIT_WINDOW_MS)
+        self.wal = BalanceWAL(fsync=durability == "fsync",
+                              sync_window=GROUP_COMMIT_WINDOW_MS / 1000 if durability == "group" else 0)
+        self.users = load_json(USERS_FILE)
+        replayed = self.wal.replay(self.users)
+        if replayed:
+            print(f"Replayed {replayed} balance changes from the write-ahead log")
+        self.products = load_json(PRODUCTS_FILE)
+        self.recharge_requests = load_json(RECHARGE_REQUESTS_FILE)
+        self.inventory = CodeInventory()
+        self.ledger = SalesLedger()
+        self._migrate_product_codes()
+        self._migrate_sales()
+        self._build_status_indexes()
+        # Users added since the last compaction snapshot; their balance
+        # entries carry the user row until users.json is known to have it
+        self._unsnapshotted_users = set()
+        self.stats = SalesStats(writer=self.writer)
+        self._unrecorded = self._record_purchases(list(self.wal.entries()))
+        if self.stats.data["total_sales"] != self.ledger.sale_count():
+            print("Sales stats out of date, rebuilding from ledger")
+            self.rebuild_sales_stats()
+        if compact_interval > 0:
+            threading.Thread(target=self._compact_loop, args=(compact_interval,),
+                             name="wal-compactor", daemon=True).start()
+
+    def _migrate_product_codes(self) -> None:
+        """Move code lists embedded in products.json into the inventory"""
+        migrated = False
+        for product_id, product in self.products.items():
+            if "codes" in product:
+                codes = product.pop("codes")
+                if not self.inventory.exists(product_id):
+                    self.inventory.add(product_id, codes)
+                migrated = True
+        if migrated:
+            self._save_products()
+
+    def _migrate_sales(self) -> None:
+        """Move sales.json into the ledger once"""
+        if not os.path.exists(SALES_FILE):
+            return
+        sales = load_json(SALES_FILE)
+        if not sales:
+            return
+        if not self.ledger.is_empty():
+            print(f"Sales ledger already has data, not importing {SALES_FILE}")
+            return
+        self.ledger.import_sales(sales)
+        os.replace(SALES_FILE, SALES_FILE + ".migrated")
+
+    def _build_status_indexes(self) -> None:
+        """Index pending users and recharge requests by status"""
+        self._pending_users = {}
+        self._requests_by_status = {}
+        self._request_locations = {}
+        for user_id, user in self.users.items():
+            if user.get("pending_approval", False):
+                self._pending_users[user_id] = None
+        for user_id, user_requests in self.recharge_requests.items():
+            for position, request in enumerate(user_requests):
+                self._index_request(user_id, position, request)
+
+    def _index_request(self, user_id: str, position: int, request: Dict) -> None:
+        request_id = request.get("request_id")
+        self._request_locations[request_id] = (user_id, position)
+        self._requests_by_status.setdefault(request.get("status"), {})[request_id] = None
+
+    def _with_stock(self, product_id: str, product: Dict) -> Dict:
+        product = dict(product)
+        product["stock"] = self.inventory.count(product_id)
+        return product
+
+    def _serialize(self, name: str) -> str:
+        with self._lock:
+            return json.dumps(getattr(self, name), ensure_ascii=False, indent=2)
+
+    def _serialize_users(self) -> str:
+        with self._lock:
+            snapshot = {BalanceWAL.SNAPSHOT_KEY: self.wal.last_seq}
+            snapshot.update(self.users)
+            return json.dumps(snapshot, ensure_ascii=False, indent=2)
+
+    # The writes below return futures: wait on them after releasing self._lock,
+    # which the flush takes to serialize
+    def _save_users(self) -> Future:
+        return self.writer.write(USERS_FILE, self._serialize_users)
+
+    def _save_products(self) -> Future:
+        return self.writer.write(PRODUCTS_FILE, lambda: self._serialize("products"))
+
+    def _save_recharge_requests(self) -> Future:
+        return self.writer.write(RECHARGE_REQUESTS_FILE, lambda: self._serialize("recharge_requests"))
+
+    def flush(self) -> bool:
+        """Write all pending changes to disk now"""
+        self.wal.sync()
+        return self.writer.flush()
+
+    def get_metrics(self) -> Dict:
+        """Storage write metrics"""
+        return dict(self.writer.stats(), backend="json", wal_seq=self.wal.last_seq, wal_bytes=self.wal.size())
+
+    def catalog_version(self) -> Optional[int]:
+        """The files belong to this process, which counts its own changes"""
+        return None
+
+    def _write_users_snapshot(self) -> Optional[int]:
+        """Persist users.json, returns a WAL sequence the file is known to include"""
+        with self._lock:
+            products = {entry["product_id"] for entry in self._unrecorded}
+        for product_id in products:
+            with self._product_locks.get(product_id):
+                self._retry_unrecorded(product_id)
+        with self._lock:
+            if self._unrecorded:
+                return None  # keep their journal entries in the log until they are recorded
+            seq = self.wal.last_seq
+            added = set(self._unsnapshotted_users)
+            self._save_users()
+        # The flush serializes at write time, so the file holds seq or newer
+        if not self.writer.flush():
+            return None
+        with self._lock:
+            self._unsnapshotted_users -= added
+        return seq
+
+    def compact_wal(self) -> int:
+        """Fold the balance log into users.json, returns archived entries"""
+        return self.wal.compact(self._write_users_snapshot, self._lock)
+
+    def _compact_loop(self, interval: int) -> None:
+        while True:
+            time.sleep(interval)
+            try:
+                self.compact_wal()
+            except Exception as e:
+                print(f"Error compacting balance log: {e}")
+
+    # Users
+    def get_user(self, user_id: str) -> Optional[Dict]:
+        """Get a copy of user data"""
+        with self._lock:
+            user = self.users.get(user_id)
+            return dict(user) if user is not None else None
+
+    def get_all_users(self) -> Dict:
+        """Get a copy of all users"""
+        with self._lock:
+            return {user_id: dict(user) for user_id, user in self.users.items()}
+
+    def iter_users(self, after: Optional[str] = None, batch: int = 500):
+        """Stream (user_id, user) pairs in user id order, starting after ``after``"""
+        with self._lock:
+            user_ids = sorted(self.users)
+        start = bisect.bisect_right(user_ids, after) if after is not None else 0
+        for offset in range(start, len(user_ids), batch):
+            with self._lock:
+                page = [(user_id, dict(self.users[user_id])) for user_id in user_ids[offset:offset + batch]
+                        if user_id in self.users]
+            yield from page
+
+    def add_user(self, user_id: str, user_data: Dict) -> bool:
+        """Insert a new user, returns False if it already exists"""
+        with self._lock:
+            if user_id in self.users:
+                return False
+            self.users[user_id] = dict(user_data)
+            self._unsnapshotted_users.add(user_id)
+            if user_data.get("pending_approval", False):
+                self._pending_users[user_id] = None
+            saved = self._save_users()
+        return saved.result()
+
+    def update_user(self, user_id: str, updates: Dict) -> bool:
+        """Update user fields"""
+        with self._lock:
+            if user_id not in self.users:
+                return False
+            updates = dict(updates)
+            if "balance" in updates:
+                balance = updates.pop("balance")
+                if not self._log_balance(user_id, balance - self.users[user_id].get("balance", 0), "set"):
+                    return False
+            self.users[user_id].update(updates)
+            if "pending_approval" in updates:
+                if updates["pending_approval"]:
+                    self._pending_users[user_id] = None
+                else:
+                    self._pending_users.pop(user_id, None)
+            saved = self._save_users()
+        return saved.result()
+
+    def _log_balance(self, user_id: str, delta: int, reason: str, ref: Optional[str] = None, purchases: int = 0,
+                     extra: Optional[Dict] = None) -> Optional[Dict]:
+        """Append a balance change to the WAL and apply it in memory, returns the entry"""
+        if user_id in self._unsnapshotted_users:
+            extra = dict(extra or {}, user=self.users[user_id])
+        try:
+            entry = self.wal.append(user_id, delta, reason, ref, purchases, extra)
+        except OSError as e:
+            print(f"Error writing balance log: {e}")
+            return None
+        BalanceWAL.apply(self.users, entry)
+        return entry
+
+    def adjust_user_balance(self, user_id: str, amount: int, reason: str = "adjust", ref: Optional[str] = None) -> bool:
+        """Add amount (may be negative) to user balance"""
+        with self._lock:
+            if user_id not in self.users:
+                return False
+            return self._log_balance(user_id, amount, reason, ref) is not None
+
+    def set_user_balance(self, user_id: str, balance: int, reason: str = "set", ref: Optional[str] = None) -> bool:
+        """Set user balance to a specific amount"""
+        with self._lock:
+            if user_id not in self.users:
+                return False
+            return self._log_balance(user_id, balance - self.users[user_id].get("balance", 0), reason, ref) is not None
+
+    def delete_user(self, user_id: str) -> bool:
+        """Delete user"""
+        with self._lock:
+            if user_id not in self.users:
+                return False
+            del self.users[user_id]
+            self._pending_users.pop(user_id, None)
+            saved = self._save_users()
+        return saved.result()
+
+    def get_pending_users(self) -> List[Dict]:
+        """Get users pending approval"""
+        with self._lock:
+            pending_users = []
+            for user_id in self._pending_users:
+                user_info = dict(self.users[user_id])
+                user_info["user_id"] = user_id
+                pending_users.append(user_info)
+            return pending_users
+
+    # Products
+    def get_products(self) -> Dict:
+        """Get a copy of all products"""
+        with self._lock:
+            return {product_id: self._with_stock(product_id, product) for product_id, product in self.products.items()}
+
+    def get_product(self, product_id: str) -> Optional[Dict]:
+        """Get a copy of product data"""
+        with self._lock:
+            product = self.products.get(product_id)
+            return self._with_stock(product_id, product) if product is not None else None
+
+    def add_product(self, product_id: str, product_data: Dict) -> bool:
+        """Insert a new product, returns False if it already exists"""
+        with self._lock:
+            if product_id in self.products:
+                return False
+            product_data = dict(product_data)
+            codes = product_data.pop("codes", [])
+            product_data.pop("stock", None)
+            self.inventory.clear(product_id)
+            if codes:
+                self.inventory.add(product_id, codes)
+            self.products[product_id] = product_data
+            saved = self._save_products()
+        return saved.result()
+
+    def update_product(self, product_id: str, updates: Dict) -> bool:
+        """Update product fields, a ``codes`` list replaces the stock"""
+        with self._lock:
+            if product_id not in self.products:
+                return False
+            updates = dict(updates)
+            codes = updates.pop("codes", None)
+            updates.pop("stock", None)
+            if codes is not None:
+                self.inventory.clear(product_id)
+                self.inventory.add(product_id, codes)
+            self.products[product_id].update(updates)
+            saved = self._save_products()
+        return saved.result()
+
+    def delete_product(self, product_id: str) -> bool:
+        """Delete product and its codes"""
+        with self._lock:
+            if product_id not in self.products:
+                return False
+            del self.products[product_id]
+            self.inventory.delete(product_id)
+            saved = self._save_products()
+        return saved.result()
+
+    def add_product_codes(self, product_id: str, codes: List[str]) -> bool:
+        """Append codes to product stock"""
+        with self._lock:
+            if product_id not in self.products:
+                return False
+            self.inventory.add(product_id, codes)
+            return True
+
+    def add_product_code(self, product_id: str, code: str) -> bool:
+        """Append code to product stock"""
+        return self.add_product_codes(product_id, [code])
+
+    def pop_product_code(self, product_id: str) -> Optional[str]:
+        """Remove and return the first available code"""
+        with self._lock:
+            if product_id not in self.products:
+                return None
+            return self.inventory.pop(product_id)
+
+    # Sales
+    def _record_purchases(self, entries: List[Dict], known_new: bool = False) -> List[Dict]:
+        """Take the code and record the sale of journaled purchases.
+
+        Safe to repeat: codes are taken idempotently and sales already in the
+        ledger are skipped (``known_new`` skips that lookup for a purchase
+        that was just logged). Returns the entries that could not be recorded.
+        """
+        purchases = [entry for entry in entries if "sale" in entry]
+        recorded = {}
+        if not known_new:
+            since = {}
+            for entry in purchases:
+                user_id = entry["user_id"]
+                since[user_id] = min(since.get(user_id, entry["sale"]["date"]), entry["sale"]["date"])
+            recorded = {user_id: self.ledger.invoice_ids_since(user_id, date) for user_id, date in since.items()}
+        failed = []
+        for entry in purchases:
+            user_id, sale = entry["user_id"], entry["sale"]
+            try:
+                self.inventory.take(entry["product_id"], sale["code"], entry["offset"])
+            except OSError as e:
+                print(f"Error taking product code: {e}")
+                failed.append(entry)
+                continue
+            if sale["invoice_id"] in recorded.get(user_id, ()):
+                continue
+            if not self._append_sale(user_id, sale):
+                failed.append(entry)
+        return failed
+
+    def _retry_unrecorded(self, product_id: str) -> bool:
+        """Record the product's journaled purchases that failed before, call with its lock held.
+
+        Returns False if some are still unrecorded.
+        """
+        with self._lock:
+            entries = [entry for entry in self._unrecorded if entry["product_id"] == product_id]
+        if not entries:
+            return True
+        failed = self._record_purchases(entries)
+        retried = {id(entry) for entry in entries}
+        with self._lock:
+            self._unrecorded = [entry for entry in self._unrecorded if id(entry) not in retried] + failed
+        return not failed
+
+    def _append_sale(self, user_id: str, sale_record: Dict) -> bool:
+        with self._sales_lock:
+            new_customer = not self.ledger.has_sales(user_id)
+            if not self.ledger.append(user_id, sale_record):
+                return False
+            self.stats.add(sale_record, new_customer)
+            return True
+
+    def add_sale(self, user_id: str, sale_record: Dict) -> bool:
+        """Append a sale record to user history"""
+        return self._append_sale(user_id, sale_record)
+
+    def get_user_sales(self, user_id: str, limit: Optional[int] = None) -> List[Dict]:
+        """Get user purchase history, ``limit`` keeps only the last N"""
+        return self.ledger.get_user_sales(user_id, limit)
+
+    def get_all_sales(self) -> Dict:
+        """Get all sales grouped by user (reads the whole ledger)"""
+        sales = {}
+        for user_id, record in self.ledger.iter_sales():
+            sales.setdefault(user_id, []).append(record)
+        return sales
+
+    def iter_sales(self, start: Optional[str] = None, end: Optional[str] = None):
+        """Stream (user_id, sale) pairs with start <= date < end"""
+        return self.ledger.iter_sales(start, end)
+
+    def get_sales_stats(self) -> Dict:
+        """Get running sales totals"""
+        return self.stats.snapshot()
+
+    def rebuild_sales_stats(self) -> Dict:
+        """Recompute sales totals from the ledger"""
+        with self._sales_lock:
+            return self.stats.rebuild(self.ledger.iter_sales())
+
+    def purchase(self, user_id: str, product_id: str, invoice_id: str, date: str) -> Dict:
+        """Take a code, charge the user and record the sale as one unit of work
+
+        The product's lock is held from picking the code to taking it, so
+        buyers of one product queue up while buyers of different products
+        only share the storage lock around the balance check and charge.
+        """
+        with self._product_locks.get(product_id):
+            if not self._retry_unrecorded(product_id):
+                return {"status": "write_failed"}  # the head code may belong to an unrecorded sale
+            with self._lock:
+                user = self.users.get(user_id)
+                product = self.products.get(product_id)
+                if user is None:
+                    return {"status": "no_user"}
+                if product is None:
+                    return {"status": "no_product"}
+                price = product.get("price", 0)
+                product_name = product.get("name")
+                sale_name = product.get("name", "منتج غير معروف")
+                balance = user.get("balance", 0)
+            if balance < price:
+                return {"status": "insufficient_balance", "balance": balance, "price": price}
+            code, offset = self.inventory.peek(product_id)
+            if code is None:
+                return {"status": "out_of_stock"}
+            sale_record = {
+                "product": sale_name,
+                "code": code,
+                "price": price,
+                "date": date,
+                "invoice_id": invoice_id
+            }
+            
+            with self._lock:
+                user = self.users.get(user_id)
+                if user is None:
+                    return {"status": "no_user"}
+                balance = user.get("balance", 0)
+                if balance < price:  # spent on another product meanwhile
+                    return {"status": "insufficient_balance", "balance": balance, "price": price}
+                # The WAL entry is the commit point: once it is written the
+                # purchase happened, and the code and sale record are derived
+                # from it again on startup if writing them is interrupted
+                entry = self._log_balance(user_id, -price, "purchase", invoice_id, purchases=1,
+                                          extra={"product_id": product_id, "offset": offset, "sale": sale_record})
+                if entry is None:
+                    return {"status": "write_failed"}
+                balance = user["balance"]
+            failed = self._record_purchases([entry], known_new=True)
+            if failed:
+                with self._lock:
+                    self._unrecorded.extend(failed)
+            
+            return {
+                "status": "ok",
+                "code": code,
+                "price": price,
+                "product_name": product_name,
+                "balance": balance,
+                "invoice_id": invoice_id
+            }
+
+    # Recharge requests
+    def add_recharge_request(self, user_id: str, request_data: Dict) -> bool:
+        """Append recharge request for user"""
+        with self._lock:
+            user_requests = self.recharge_requests.setdefault(user_id, [])
+            user_requests.append(dict(request_data))
+            self._index_request(user_id, len(user_requests) - 1, request_data)
+            saved = self._save_recharge_requests()
+        return saved.result()
+
+    def get_recharge_requests(self, status: str = None) -> Dict:
+        """Get recharge requests grouped by user, optionally filtered by status"""
+        with self._lock:
+            result = {}
+            if status:
+                for request_id in self._requests_by_status.get(status, {}):
+                    user_id, position = self._request_locations[request_id]
+                    result.setdefault(user_id, []).append(dict(self.recharge_requests[user_id][position]))
+                return result
+            for user_id, user_requests in self.recharge_requests.items():
+                if user_requests:
+                    result[user_id] = [dict(req) for req in user_requests]
+            return result
+
+    def update_recharge_request(self, user_id: str, request_id: str, updates: Dict) -> bool:
+        """Update fields of a recharge request"""
+        with self._lock:
+            location = self._request_locations.get(request_id)
+            if location is None or location[0] != user_id:
+                return False
+            request = self.recharge_requests[user_id][location[1]]
+            old_status = request.get("status")
+            request.update(updates)
+            if request.get("status") != old_status:
+                self._requests_by_status.get(old_status, {}).pop(request_id, None)
+                self._requests_by_status.setdefault(request.get("status"), {})[request_id] = None
+            saved = self._save_recharge_requests()
+        return saved.result()
+
+
+class SQLiteStorage:
+    """Data store backed by a local SQLite database.
+
+    Exposes the same interface as JSONStorage. Each mutation touches only the
+    affected rows instead of rewriting a whole file. Balance changes are
+    recorded in ``balance_log`` inside the transaction that applies them.
+    Purchases pick their code under a per-product lock and keep SQLite's
+    write lock only for the writes.
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS users (
+        user_id TEXT PRIMARY KEY,
+        name TEXT,
+        balance INTEGER NOT NULL DEFAULT 0,
+        total_spent INTEGER NOT NULL DEFAULT 0,
+        purchase_count INTEGER NOT NULL DEFAULT 0,
+        banned INTEGER NOT NULL DEFAULT 0,
+        pending_approval INTEGER NOT NULL DEFAULT 0,
+        created_at TEXT,
+        approved_at TEXT,
+        extra TEXT
+    );
+    CREATE INDEX IF NOT EXISTS idx_users_pending ON users (pending_approval);
+
+    CREATE TABLE IF NOT EXISTS products (
+        product_id TEXT PRIMARY KEY,
+        name TEXT,
+        price INTEGER NOT NULL DEFAULT 0,
+        description TEXT,
+        image TEXT,
+        category TEXT,
+        active INTEGER NOT NULL DEFAULT 1,
+        stock INTEGER NOT NULL DEFAULT 0,
+        extra TEXT
+    );
+
+    CREATE TABLE IF NOT EXISTS product_codes (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        product_id TEXT NOT NULL,
+        code TEXT NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_product_codes_product ON product_codes (product_id, id);
+
+    CREATE TABLE IF NOT EXISTS sales (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        invoice_id TEXT,
+        user_id TEXT NOT NULL,
+        product TEXT,
+        code TEXT,
+        price INTEGER NOT NULL DEFAULT 0,
+        date TEXT,
+        extra TEXT
+    );
+    CREATE INDEX IF NOT EXISTS idx_sales_user ON sales (user_id, id);
+    CREATE INDEX IF NOT EXISTS idx_sales_date ON sales (date);
+    CREATE INDEX IF NOT EXISTS idx_sales_invoice ON sales (invoice_id);
+
+    CREATE TABLE IF NOT EXISTS sales_stats (
+        bucket TEXT NOT NULL,
+        key TEXT NOT NULL,
+        count INTEGER NOT NULL DEFAULT 0,
+        revenue INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (bucket, key)
+    );
+
+    CREATE TABLE IF NOT EXISTS recharge_requests (
+        request_id TEXT PRIMARY KEY,
+        user_id TEXT NOT NULL,
+        amount INTEGER NOT NULL DEFAULT 0,
+        status TEXT NOT NULL DEFAULT 'pending',
+        date TEXT,
+        transfer_date TEXT,
+        receipt_photo TEXT,
+        processed_at TEXT,
+        extra TEXT
+    );
+    CREATE INDEX IF NOT EXISTS idx_recharge_user ON recharge_requests (user_id);
+    CREATE INDEX IF NOT EXISTS idx_recharge_status ON recharge_requests (status, date);
+    CREATE INDEX IF NOT EXISTS idx_recharge_date ON recharge_requests (date);
+
+    CREATE TABLE IF NOT EXISTS balance_log (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id TEXT NOT NULL,
+        delta INTEGER NOT NULL,
+        reason TEXT,
+        ref TEXT,
+        date TEXT
+    );
+    CREATE INDEX IF NOT EXISTS idx_balance_log_user ON balance_log (user_id, seq);
+
+    -- Bumped by every product change (stock included) so that cached catalog
+    -- screens in other processes notice it
+    CREATE TABLE IF NOT EXISTS catalog_version (
+        id INTEGER PRIMARY KEY CHECK (id = 0),
+        version INTEGER NOT NULL
+    );
+    INSERT OR IGNORE INTO catalog_version (id, version) VALUES (0, 0);
+    CREATE TRIGGER IF NOT EXISTS products_inserted AFTER INSERT ON products
+    BEGIN UPDATE catalog_version SET version = version + 1; END;
+    CREATE TRIGGER IF NOT EXISTS products_updated AFTER UPDATE ON products
+    BEGIN UPDATE catalog_version SET version = version + 1; END;
+    CREATE TRIGGER IF NOT EXISTS products_deleted AFTER DELETE ON products
+    BEGIN UPDATE catalog_version SET version = version + 1; END;
+    """
+
+    USER_COLUMNS = ("name", "balance", "total_spent", "purchase_count", "banned",
+                    "pending_approval", "created_at", "approved_at")
+    PRODUCT_COLUMNS = ("name", "price", "description", "image", "category", "active")
+    SALE_COLUMNS = ("invoice_id", "product", "code", "price", "date")
+    REQUEST_COLUMNS = ("request_id", "amount", "status", "date", "transfer_date",
+                       "receipt_photo", "processed_at")
+    BOOLEAN_COLUMNS = ("banned", "pending_approval", "active")
+
+    def __init__(self, path: str = DATABASE_FILE):
+        self.path = path
+        self._local = threading.local()
+        self._product_locks = ProductLocks()
+        ensure_directory(path)
+        conn = self._conn()
+        conn.executescript(self.SCHEMA)
+        self._migrate_schema(conn)
+        conn.commit()
+        if self._is_empty():
+            self.import_from_json()
+        if not conn.execute("SELECT 1 FROM sales_stats WHERE bucket = 'total'").fetchone():
+            self.rebuild_sales_stats()
+
+    def _conn(self) -> sqlite3.Connection:
+        """Get the connection of the current thread"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def flush(self) -> bool:
+        """Every transaction is already committed"""
+        return True
+
+    def get_metrics(self) -> Dict:
+        """Storage metrics"""
+        return {"backend": "sqlite", "mode": "transaction"}
+
+    def compact_wal(self) -> int:
+        """Balance changes are committed in place, nothing to fold"""
+        return 0
+
+    def catalog_version(self) -> Optional[int]:
+        """Counter of product changes made by any process"""
+        return self._conn().execute("SELECT version FROM catalog_version WHERE id = 0").fetchone()[0]
+
+    def _execute(self, sql: str, params: tuple = ()) -> sqlite3.Cursor:
+        conn = self._conn()
+        with conn:
+            return conn.execute(sql, params)
+
+    def _migrate_schema(self, conn: sqlite3.Connection) -> None:
+        """Bring databases created by older versions up to date"""
+        product_columns = [row["name"] for row in conn.execute("PRAGMA table_info(products)")]
+        if "stock" not in product_columns:
+            conn.execute("ALTER TABLE products ADD COLUMN stock INTEGER NOT NULL DEFAULT 0")
+            conn.execute("UPDATE products SET stock = (SELECT COUNT(*) FROM product_codes "
+                         "WHERE product_codes.product_id = products.product_id)")
+
+    def _is_empty(self) -> bool:
+        conn = self._conn()
+        for table in ("users", "products", "sales", "recharge_requests"):
+            if conn.execute(f"SELECT 1 FROM {table} LIMIT 1").fetchone():
+                return False
+        return True
+
+    # Row conversion
+    def _split(self, data: Dict, columns: tuple) -> tuple:
+        """Split a record into known column values and extra JSON fields"""
+        values = {}
+        extra = {}
+        for key, value in data.items():
+            if key in columns:
+                values[key] = int(value) if key in self.BOOLEAN_COLUMNS else value
+            else:
+                extra[key] = value
+        return values, extra
+
+    def _row_to_dict(self, row: sqlite3.Row, skip: tuple = ()) -> Dict:
+        data = {}
+        for key in row.keys():
+            if key in skip or key == "extra":
+                continue
+            value = row[key]
+            if key in self.BOOLEAN_COLUMNS:
+                value = bool(value)
+            if value is not None or key not in ("approved_at", "processed_at"):
+                data[key] = value
+        if row["extra"]:
+            data.update(json.loads(row["extra"]))
+        return data
+
+    def _insert(self, conn: sqlite3.Connection, table: str, columns: tuple, data: Dict, keys: Dict) -> None:
+        values, extra = self._split(data, columns)
+        values.update(keys)
+        values["extra"] = json.dumps(extra, ensure_ascii=False) if extra else None
+        names = ", ".join(values)
+        placeholders = ", ".join("?" for _ in values)
+        conn.execute(f"INSERT INTO {table} ({names}) VALUES ({placeholders})", tuple(values.values()))
+
+    def _update(self, conn: sqlite3.Connection, table: str, key_column: str, key: str, columns: tuple, updates: Dict) -> bool:
+        row = conn.execute(f"SELECT extra FROM {table} WHERE {key_column} = ?", (key,)).fetchone()
+        if row is None:
+            return False
+        values, extra = self._split(updates, columns)
+        if extra:
+            merged = json.loads(row["extra"]) if row["extra"] else {}
+            merged.update(extra)
+            values["extra"] = json.dumps(merged, ensure_ascii=False)
+        if values:
+            assignments = ", ".join(f"{name} = ?" for name in values)
+            conn.execute(f"UPDATE {table} SET {assignments} WHERE {key_column} = ?",
+                         tuple(values.values()) + (key,))
+        return True
+
+    def import_from_json(self) -> None:
+        """Import existing JSON data files into the database"""
+        conn = self._conn()
+        with conn:
+            users = load_json(USERS_FILE)
+            if os.path.isdir(WAL_DIR):
+                wal = BalanceWAL()
+                wal.replay(users)
+                wal.close()
+            users.pop(BalanceWAL.SNAPSHOT_KEY, None)
+            for user_id, user in users.items():
+                self._insert(conn, "users", self.USER_COLUMNS, user, {"user_id": user_id})
+            inventory = CodeInventory()
+            for product_id, product in load_json(PRODUCTS_FILE).items():
+                product = dict(product)
+                codes = product.pop("codes", None)
+                if codes is None:
+                    codes = list(inventory.remaining(product_id))
+                product.pop("stock", None)
+                self._insert(conn, "products", self.PRODUCT_COLUMNS, product, {"product_id": product_id})
+                self._insert_codes(conn, product_id, codes)
+            for user_id, user_sales in load_json(SALES_FILE).items():
+                for sale in user_sales:
+                    self._insert(conn, "sales", self.SALE_COLUMNS, sale, {"user_id": user_id})
+            if os.path.isdir(SALES_LEDGER_DIR):
+                for user_id, sale in SalesLedger().iter_sales():
+                    self._insert(conn, "sales", self.SALE_COLUMNS, sale, {"user_id": user_id})
+            for user_id, user_requests in load_json(RECHARGE_REQUESTS_FILE).items():
+                for request in user_requests:
+                    self._insert(conn, "recharge_requests", self.REQUEST_COLUMNS, request, {"user_id": user_id})
+
+    # Users
+    def get_user(self, user_id: str) -> Optional[Dict]:
+        """Get user data"""
+        row = self._conn().execute("SELECT * FROM users WHERE user_id = ?", (user_id,)).fetchone()
+        return self._row_to_dict(row, skip=("user_id",)) if row else None
+
+    def get_all_users(self) -> Dict:
+        """Get all users"""
+        rows = self._conn().execute("SELECT * FROM users ORDER BY rowid")
+        return {row["user_id"]: self._row_to_dict(row, skip=("user_id",)) for row in rows}
+
+    def iter_users(self, after: Optional[str] = None, batch: int = 500):
+        """Stream (user_id, user) pairs in user id order, starting after ``after``"""
+        while True:
+            rows = self._conn().execute("SELECT * FROM users WHERE user_id > ? ORDER BY user_id LIMIT ?",
+                                        (after or "", batch)).fetchall()
+            for row in rows:
+                yield row["user_id"], self._row_to_dict(row, skip=("user_id",))
+            if len(rows) < batch:
+                return
+            after = rows[-1]["user_id"]
+
+    def add_user(self, user_id: str, user_data: Dict) -> bool:
+        """Insert a new user, returns False if it already exists"""
+        conn = self._conn()
+        try:
+            with conn:
+                self._insert(conn, "users", self.USER_COLUMNS, user_data, {"user_id": user_id})
+            return True
+        except sqlite3.IntegrityError:
+            return False
+
+    def update_user(self, user_id: str, updates: Dict) -> bool:
+        """Update user fields"""
+        conn = self._conn()
+        with conn:
+            updates = dict(updates)
+            if "balance" in updates:
+                if not self._set_balance(conn, user_id, updates.pop("balance"), "set", None):
+                    return False
+            return self._update(conn, "users", "user_id", user_id, self.USER_COLUMNS, updates)
+
+    def _log_balance(self, conn: sqlite3.Connection, user_id: str, delta: int, reason: str, ref: Optional[str]) -> None:
+        conn.execute("INSERT INTO balance_log (user_id, delta, reason, ref, date) VALUES (?, ?, ?, ?, ?)",
+                     (user_id, delta, reason, ref, get_current_timestamp()))
+
+    def _set_balance(self, conn: sqlite3.Connection, user_id: str, balance: int, reason: str, ref: Optional[str]) -> bool:
+        row = conn.execute("SELECT balance FROM users WHERE user_id = ?", (user_id,)).fetchone()
+        if row is None:
+            return False
+        conn.execute("UPDATE users SET balance = ? WHERE user_id = ?", (balance, user_id))
+        self._log_balance(conn, user_id, balance - row["balance"], reason, ref)
+        return True
+
+    def adjust_user_balance(self, user_id: str, amount: int, reason: str = "adjust", ref: Optional[str] = None) -> bool:
+        """Add amount (may be negative) to user balance"""
+        conn = self._conn()
+        with conn:
+            if conn.execute("UPDATE users SET balance = balance + ? WHERE user_id = ?", (amount, user_id)).rowcount == 0:
+                return False
+            self._log_balance(conn, user_id, amount, reason, ref)
+            return True
+
+    def set_user_balance(self, user_id: str, balance: int, reason: str = "set", ref: Optional[str] = None) -> bool:
+        """Set user balance to a specific amount"""
+        conn = self._conn()
+        with conn:
+            return self._set_balance(conn, user_id, balance, reason, ref)
+
+    def delete_user(self, user_id: str) -> bool:
+        """Delete user"""
+        return self._execute("DELETE FROM users WHERE user_id = ?", (user_id,)).rowcount > 0
+
+    def get_pending_users(self) -> List[Dict]:
+        """Get users pending approval"""
+        rows = self._conn().execute("SELECT * FROM users WHERE pending_approval = 1 ORDER BY rowid")
+        return [self._row_to_dict(row) for row in rows]
+
+    # Products
+    def _insert_codes(self, conn: sqlite3.Connection, product_id: str, codes: List[str]) -> None:
+        conn.executemany("INSERT INTO product_codes (product_id, code) VALUES (?, ?)",
+                         [(product_id, code) for code in codes])
+        conn.execute("UPDATE products SET stock = stock + ? WHERE product_id = ?", (len(codes), product_id))
+
+    def get_products(self) -> Dict:
+        """Get all products"""
+        rows = self._conn().execute("SELECT * FROM products ORDER BY rowid")
+        return {row["product_id"]: self._row_to_dict(row, skip=("product_id",)) for row in rows}
+
+    def get_product(self, product_id: str) -> Optional[Dict]:
+        """Get product data"""
+        row = self._conn().execute("SELECT * FROM products WHERE product_id = ?", (product_id,)).fetchone()
+        return self._row_to_dict(row, skip=("product_id",)) if row else None
+
+    def add_product(self, product_id: str, product_data: Dict) -> bool:
+        """Insert a new product, returns False if it already exists"""
+        product_data = dict(product_data)
+        codes = product_data.pop("codes", [])
+        product_data.pop("stock", None)
+        conn = self._conn()
+        try:
+            with conn:
+                self._insert(conn, "products", self.PRODUCT_COLUMNS, product_data, {"product_id": product_id})
+                self._insert_codes(conn, product_id, codes)
+            return True
+        except sqlite3.IntegrityError:
+            return False
+
+    def update_product(self, product_id: str, updates: Dict) -> bool:
+        """Update product fields, a ``codes`` list replaces the stock"""
+        updates = dict(updates)
+        codes = updates.pop("codes", None)
+        updates.pop("stock", None)
+        conn = self._conn()
+        with conn:
+            if not self._update(conn, "products", "product_id", product_id, self.PRODUCT_COLUMNS, updates):
+                return False
+            if codes is not None:
+                conn.execute("DELETE FROM product_codes WHERE product_id = ?", (product_id,))
+                conn.execute("UPDATE products SET stock = 0 WHERE product_id = ?", (product_id,))
+                self._insert_codes(conn, product_id, codes)
+            return True
+
+    def delete_product(self, product_id: str) -> bool:
+        """Delete product and its codes"""
+        conn = self._conn()
+        with conn:
+            deleted = conn.execute("DELETE FROM products WHERE product_id = ?", (product_id,)).rowcount > 0
+            conn.execute("DELETE FROM product_codes WHERE product_id = ?", (product_id,))
+            return deleted
+
+    def add_product_codes(self, product_id: str, codes: List[str]) -> bool:
+        """Append codes to product stock"""
+        conn = self._conn()
+        with conn:
+            if not conn.execute("SELECT 1 FROM products WHERE product_id = ?", (product_id,)).fetchone():
+                return False
+            self._insert_codes(conn, product_id, codes)
+            return True
+
+    def add_product_code(self, product_id: str, code: str) -> bool:
+        """Append code to product stock"""
+        return self.add_product_codes(product_id, [code])
+
+    def _take_code(self, conn: sqlite3.Connection, product_id: str) -> Optional[str]:
+        row = conn.execute("SELECT id, code FROM product_codes WHERE product_id = ? ORDER BY id LIMIT 1",
+                           (product_id,)).fetchone()
+        if row is None:
+            return None
+        conn.execute("DELETE FROM product_codes WHERE id = ?", (row["id"],))
+        conn.execute("UPDATE products SET stock = stock - 1 WHERE product_id = ?", (product_id,))
+        return row["code"]
+
+    def pop_product_code(self, product_id: str) -> Optional[str]:
+        """Remove and return the first available code"""
+        conn = self._conn()
+        with conn:
+            return self._take_code(conn, product_id)
+
+    # Sales
+    def _sale_from_row(self, row: sqlite3.Row) -> Dict:
+        return self._row_to_dict(row, skip=("id", "user_id"))
+
+    def _count_sale(self, conn: sqlite3.Connection, user_id: str, product: str, price: int, date: str) -> None:
+        """Update running totals; must run before the sale row is inserted"""
+        new_customer = not conn.execute("SELECT 1 FROM sales WHERE user_id = ? LIMIT 1", (user_id,)).fetchone()
+        upsert = ("INSERT INTO sales_stats (bucket, key, count, revenue) VALUES (?, ?, ?, ?) "
+                  "ON CONFLICT (bucket, key) DO UPDATE SET count = count + excluded.count, "
+                  "revenue = revenue + excluded.revenue")
+        conn.execute(upsert, ("total", "", 1, price))
+        conn.execute(upsert, ("customers", "", 1 if new_customer else 0, 0))
+        conn.execute(upsert, ("product", product or "", 1, price))
+        conn.execute(upsert, ("day", (date or "")[:10], 1, price))
+
+    def add_sale(self, user_id: str, sale_record: Dict) -> bool:
+        """Insert a sale record"""
+        conn = self._conn()
+        with conn:
+            self._count_sale(conn, user_id, sale_record.get("product"), sale_record.get("price", 0),
+                             sale_record.get("date"))
+            self._insert(conn, "sales", self.SALE_COLUMNS, sale_record, {"user_id": user_id})
+        return True
+
+    def get_user_sales(self, user_id: str, limit: Optional[int] = None) -> List[Dict]:
+        """Get user purchase history, ``limit`` keeps only the last N"""
+        if limit is None:
+            rows = self._conn().execute("SELECT * FROM sales WHERE user_id = ? ORDER BY id", (user_id,)).fetchall()
+        else:
+            rows = self._conn().execute("SELECT * FROM sales WHERE user_id = ? ORDER BY id DESC LIMIT ?",
+                                        (user_id, limit)).fetchall()[::-1]
+        return [self._sale_from_row(row) for row in rows]
+
+    def get_all_sales(self) -> Dict:
+        """Get all sales grouped by user"""
+        sales = {}
+        for user_id, record in self.iter_sales():
+            sales.setdefault(user_id, []).append(record)
+        return sales
+
+    def iter_sales(self, start: Optional[str] = None, end: Optional[str] = None):
+        """Stream (user_id, sale) pairs with start <= date < end"""
+        sql = "SELECT * FROM sales"
+        conditions = []
+        params = []
+        if start:
+            conditions.append("date >= ?")
+            params.append(start)
+        if end:
+            conditions.append("date < ?")
+            params.append(end)
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        # A dedicated connection keeps the cursor usable while other queries run
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        try:
+            for row in conn.execute(sql + " ORDER BY date, id", params):
+                yield row["user_id"], self._sale_from_row(row)
+        finally:
+            conn.close()
+
+    def purchase(self, user_id: str, product_id: str, invoice_id: str, date: str) -> Dict:
+        """Take a code, charge the user and record the sale in one transaction
+
+        The user, product and code are read before the write transaction,
+        which then only applies the writes, each conditional on what was
+        read: buyers of different products hold SQLite's write lock for a few
+        statements instead of the whole purchase. Buyers of one product are
+        queued by its lock within a process; a code sold by another process
+        or a balance spent meanwhile makes the transaction roll back and the
+        purchase start over.
+        """
+        conn = self._conn()
+        with self._product_locks.get(product_id):
+            while True:
+                user = conn.execute("SELECT balance FROM users WHERE user_id = ?", (user_id,)).fetchone()
+                product = conn.execute("SELECT name, price FROM products WHERE product_id = ?",
+                                       (product_id,)).fetchone()
+                if user is None:
+                    return {"status": "no_user"}
+                if product is None:
+                    return {"status": "no_product"}
+                
+                price = product["price"]
+                balance = user["balance"]
+                if balance < price:
+                    return {"status": "insufficient_balance", "balance": balance, "price": price}
+                
+                code = conn.execute("SELECT id, code FROM product_codes WHERE product_id = ? ORDER BY id LIMIT 1",
+                                    (product_id,)).fetchone()
+                if code is None:
+                    return {"status": "out_of_stock"}
+                
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    taken = conn.execute("DELETE FROM product_codes WHERE id = ?", (code["id"],)).rowcount
+                    charged = taken and conn.execute(
+                        "UPDATE users SET balance = balance - ?, total_spent = total_spent + ?, "
+                        "purchase_count = purchase_count + 1 WHERE user_id = ? AND balance >= ?",
+                        (price, price, user_id, price)).rowcount
+                    if not charged:
+                        conn.rollback()
+                        continue  # changed by another process, read again
+                    conn.execute("UPDATE products SET stock = stock - 1 WHERE product_id = ?", (product_id,))
+                    self._log_balance(conn, user_id, -price, "purchase", invoice_id)
+                    self._count_sale(conn, user_id, product["name"] or "منتج غير معروف", price, date)
+                    conn.execute(
+                        "INSERT INTO sales (invoice_id, user_id, product, code, price, date) VALUES (?, ?, ?, ?, ?, ?)",
+                        (invoice_id, user_id, product["name"] or "منتج غير معروف", code["code"], price, date))
+                    balance = conn.execute("SELECT balance FROM users WHERE user_id = ?", (user_id,)).fetchone()[0]
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    raise
+                
+                return {
+                    "status": "ok",
+                    "code": code["code"],
+                    "price": price,
+                    "product_name": product["name"],
+                    "balance": balance,
+                    "invoice_id": invoice_id
+                }
+
+    def get_sales_stats(self) -> Dict:
+        """Get running sales totals"""
+        stats = {"total_sales": 0, "total_revenue": 0, "unique_customers": 0, "products": {}, "days": {}}
+        for row in self._conn().execute("SELECT * FROM sales_stats"):
+            if row["bucket"] == "total":
+                stats["total_sales"] = row["count"]
+                stats["total_revenue"] = row["revenue"]
+            elif row["bucket"] == "customers":
+                stats["unique_customers"] = row["count"]
+            else:
+                bucket = "products" if row["bucket"] == "product" else "days"
+                stats[bucket][row["key"]] = {"count": row["count"], "revenue": row["revenue"]}
+        return stats
+
+    def rebuild_sales_stats(self) -> Dict:
+        """Recompute sales totals from the sales table"""
+        conn = self._conn()
+        with conn:
+            conn.execute("DELETE FROM sales_stats")
+            conn.execute("INSERT INTO sales_stats SELECT 'total', '', COUNT(*), COALESCE(SUM(price), 0) FROM sales")
+            conn.execute("INSERT INTO sales_stats SELECT 'customers', '', COUNT(DISTINCT user_id), 0 FROM sales")
+            conn.execute("INSERT INTO sales_stats SELECT 'product', COALESCE(product, ''), COUNT(*), SUM(price) "
+                         "FROM sales GROUP BY COALESCE(product, '')")
+            conn.execute("INSERT INTO sales_stats SELECT 'day', substr(COALESCE(date, ''), 1, 10), COUNT(*), SUM(price) "
+                         "FROM sales GROUP BY substr(COALESCE(date, ''), 1, 10)")
+        return self.get_sales_stats()
+
+    # Recharge requests
+    def add_recharge_request(self, user_id: str, request_data: Dict) -> bool:
+        """Insert recharge request for user"""
+        conn = self._conn()
+        try:
+            with conn:
+                self._insert(conn, "recharge_requests", self.REQUEST_COLUMNS, request_data, {"user_id": user_id})
+            return True
+        except sqlite3.IntegrityError:
+            return False
+
+    def get_recharge_requests(self, status: str = None) -> Dict:
+        """Get recharge requests grouped by user, optionally filtered by status"""
+        if status:
+            rows = self._conn().execute(
+                "SELECT * FROM recharge_requests WHERE status = ? ORDER BY date", (status,))
+        else:
+            rows = self._conn().execute("SELECT * FROM recharge_requests ORDER BY date")
+        result = {}
+        for row in rows:
+            result.setdefault(row["user_id"], []).append(self._row_to_dict(row, skip=("user_id",)))
+        return result
+
+    def update_recharge_request(self, user_id: str, request_id: str, updates: Dict) -> bool:
+        """Update fields of a recharge request"""
+        conn = self._conn()
+        with conn:
+            row = conn.execute("SELECT user_id FROM recharge_requests WHERE request_id = ?",
+                               (request_id,)).fetchone()
+            if row is None or row["user_id"] != user_id:
+                return False
+            return self._update(conn, "recharge_requests", "request_id", request_id, self.REQUEST_COLUMNS, updates)
+
+
+def create_storage(backend: str = STORAGE_BACKEND):
+    """Create the configured storage backend"""
+    if backend == "sqlite":
+        return SQLiteStorage()
+    if backend == "json":
+        return JSONStorage()
+    raise ValueError(f"Unknown storage backend: {backend}")
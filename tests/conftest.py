@@ -0,0 +1,30 @@
+import os
+import shutil
+import sys
+import tempfile
+import pytest
+
+# config reads DATA_DIR on import, so point it at a scratch directory first
+DATA_DIR = tempfile.mkdtemp(prefix="store_tests_")
+os.environ["DATA_DIR"] = DATA_DIR
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+@pytest.fixture
+def data_dir():
+    """An empty DATA_DIR for one test"""
+    for name in os.listdir(DATA_DIR):
+        path = os.path.join(DATA_DIR, name)
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        else:
+            os.remove(path)
+    return DATA_DIR
+
+@pytest.fixture
+def open_storage(data_dir):
+    """Open JSONStorage on the test's DATA_DIR; call again to simulate a restart"""
+    from storage import JSONStorage
+
+    def open_storage():
+        return JSONStorage(durability="fsync", compact_interval=0)
+    return open_storage
@@ -0,0 +1,59 @@
+import asyncio
+from concurrent.futures import Future
+from types import SimpleNamespace
+from async_main import AsyncBot, AsyncHandlers, AsyncUpdateDispatcher
+
+class PendingOutbound:
+    """Sends stay in flight until the test delivers them"""
+
+    def __init__(self):
+        self.sent = []
+
+    def submit(self, method, *args, **kwargs):
+        future = Future()
+        self.sent.append((method, args[0], future))
+        return future
+
+def text_update(update_id, user_id, text):
+    user = SimpleNamespace(id=user_id, first_name="Test", last_name=None)
+    message = SimpleNamespace(content_type="text", text=text, chat=SimpleNamespace(id=user_id), from_user=user)
+    return SimpleNamespace(update_id=update_id, message=message, callback_query=None)
+
+def test_users_wait_for_replies_on_the_loop_in_order():
+    outbound = PendingOutbound()
+    handlers = AsyncHandlers(SimpleNamespace(HELP_TEXT="help"), AsyncBot(None, outbound))
+    dispatcher = AsyncUpdateDispatcher(handlers.handle, workers=1)
+
+    async def scenario():
+        await dispatcher.dispatch([text_update(1, 10, "/help"), text_update(2, 10, "/help@store_bot"),
+                                   text_update(3, 20, "/help")])
+        await asyncio.sleep(0.05)
+        # Both users' first replies are in flight at once; user 10's second waits for its first
+        assert [chat for _, chat, _ in outbound.sent] == [10, 20]
+        assert dispatcher.stats()["active_users"] == 2
+        for _, _, future in list(outbound.sent):
+            future.set_result(None)
+        await asyncio.sleep(0.05)
+        assert [chat for _, chat, _ in outbound.sent] == [10, 20, 10]
+        outbound.sent[-1][2].set_result(None)
+        await asyncio.sleep(0.05)
+
+    asyncio.run(scenario())
+    assert dispatcher.stats() == {"workers": 1, "queue_depth": 0, "active_users": 0, "processed": 3, "errors": 0}
+
+def test_failed_reply_counts_as_an_error_and_the_queue_moves_on():
+    outbound = PendingOutbound()
+    handlers = AsyncHandlers(SimpleNamespace(HELP_TEXT="help"), AsyncBot(None, outbound))
+    dispatcher = AsyncUpdateDispatcher(handlers.handle, workers=4)
+
+    async def scenario():
+        await dispatcher.dispatch([text_update(1, 10, "/help"), text_update(2, 10, "/help")])
+        await asyncio.sleep(0.05)
+        outbound.sent[0][2].set_exception(ConnectionError("telegram unreachable"))
+        await asyncio.sleep(0.05)
+        outbound.sent[1][2].set_result(None)
+        await asyncio.sleep(0.05)
+
+    asyncio.run(scenario())
+    stats = dispatcher.stats()
+    assert stats["processed"] == 2 and stats["errors"] == 1 and stats["workers"] == 4
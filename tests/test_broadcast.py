@@ -0,0 +1,85 @@
+import os
+import threading
+from concurrent.futures import Future
+from types import SimpleNamespace
+from broadcast import BroadcastEngine
+from database import DatabaseManager
+from utils import load_json, save_json
+
+ADMIN = 999
+
+class Blocked(Exception):
+    error_code = 403
+
+class FakeOutbound:
+    """Sends complete at once, except to users listed in ``held`` until released"""
+
+    def __init__(self, held=(), blocked=()):
+        self.held = {user_id: Future() for user_id in held}
+        self.blocked = set(blocked)
+        self.sent = []
+        self.submitted = threading.Semaphore(0)
+
+    def submit(self, method, chat_id, text, priority=None):
+        self.sent.append(chat_id)
+        future = self.held.get(chat_id)
+        if future is None:
+            future = Future()
+            if chat_id in self.blocked:
+                future.set_exception(Blocked())
+            else:
+                future.set_result(None)
+        self.submitted.release()
+        return future
+
+    def call(self, method, *args, **kwargs):
+        return SimpleNamespace(message_id=1)
+
+def make_users(storage):
+    for user_id in range(101, 111):
+        storage.add_user(str(user_id), {"name": "user", "balance": 0})
+        storage.update_user(str(user_id), {"pending_approval": False})
+    storage.update_user("104", {"banned": True})
+
+def test_broadcast_reaches_every_active_user(open_storage, data_dir):
+    db = DatabaseManager(open_storage())
+    make_users(db.storage)
+    outbound = FakeOutbound(blocked=[107])
+    engine = BroadcastEngine(outbound, db, os.path.join(data_dir, "broadcast.json"), window=3)
+    assert engine.start("hello", ADMIN)
+    engine._thread.join(10)
+    assert outbound.sent == [101, 102, 103, 105, 106, 107, 108, 109, 110]
+    status = engine.status()
+    assert status["status"] == "done" and status["cursor"] == "110"
+    assert status["counts"] == {"delivered": 8, "blocked": 1, "failed": 0}
+
+def test_checkpoint_never_passes_an_unfinished_send(open_storage, data_dir):
+    db = DatabaseManager(open_storage())
+    make_users(db.storage)
+    checkpoint_file = os.path.join(data_dir, "broadcast.json")
+    outbound = FakeOutbound(held=[102])
+    engine = BroadcastEngine(outbound, db, checkpoint_file, window=3, progress_seconds=0)
+    engine.start("hello", ADMIN)
+    for _ in range(4):
+        assert outbound.submitted.acquire(timeout=10)
+    # 101, 102 (held), 103 and 105 are out; the window is full behind 102
+    assert load_json(checkpoint_file)["cursor"] == "101"
+    outbound.held[102].set_result(None)
+    engine._thread.join(10)
+    assert load_json(checkpoint_file)["cursor"] == "110"
+
+def test_interrupted_broadcast_resumes_after_its_checkpoint(open_storage, data_dir):
+    db = DatabaseManager(open_storage())
+    make_users(db.storage)
+    checkpoint_file = os.path.join(data_dir, "broadcast.json")
+    save_json(checkpoint_file, {"text": "hello", "status": "running", "started_at": "2024-01-05T10:00:00",
+                                "admin_chat_id": ADMIN, "progress_message_id": 1, "cursor": "105",
+                                "counts": {"delivered": 3, "blocked": 0, "failed": 0}})
+    outbound = FakeOutbound()
+    engine = BroadcastEngine(outbound, db, checkpoint_file)
+    assert engine.resume()
+    engine._thread.join(10)
+    assert outbound.sent == [106, 107, 108, 109, 110]
+    saved = load_json(checkpoint_file)
+    assert saved["status"] == "done" and saved["counts"]["delivered"] == 8
+    assert not BroadcastEngine(outbound, db, checkpoint_file).resume()
@@ -0,0 +1,32 @@
+import queue
+import threading
+import time
+import pytest
+from cluster import ClusterSupervisor
+from webhook import fake_update
+
+def test_cluster_backlog_is_counted_in_updates():
+    supervisor = ClusterSupervisor(workers=1, queue_size=3)
+    supervisor.dispatch([fake_update(1, 7), fake_update(2, 7)])
+    assert supervisor.queue_depth() == 2
+    with pytest.raises(queue.Full):
+        supervisor.dispatch([fake_update(3, 7), fake_update(4, 7)])
+    assert supervisor.queue_depth() == 2  # a refused batch queues nothing
+
+    threading.Thread(target=supervisor._collect_acks, daemon=True).start()
+    supervisor._acks.put((0, 1))
+    deadline = time.time() + 5
+    while supervisor.queue_depth() != 1 and time.time() < deadline:
+        time.sleep(0.01)
+    assert supervisor.queue_depth() == 1
+    supervisor.dispatch([fake_update(3, 7), fake_update(4, 7)])
+
+def test_restarted_worker_gets_its_unstarted_updates(monkeypatch):
+    supervisor = ClusterSupervisor(workers=1, queue_size=10)
+    supervisor.dispatch([fake_update(1, 7)])
+    supervisor.dispatch([fake_update(2, 7)])
+    supervisor._unstarted[0].pop(1)  # update 1 was started before the crash
+    monkeypatch.setattr(supervisor, "_start_worker", lambda worker_id: None)
+    supervisor._restart_worker(0)
+    assert [data["update_id"] for data in supervisor._queues[0].get(timeout=5)] == [2]
+    assert supervisor.stats()["redelivered"] == 1
@@ -0,0 +1,53 @@
+import json
+import os
+import threading
+from utils import GroupCommitWriter
+
+def test_write_resolves_after_its_batch_is_fsynced(data_dir, monkeypatch):
+    synced = []
+    real_fsync = os.fsync
+    monkeypatch.setattr(os, "fsync", lambda fd: (synced.append(fd), real_fsync(fd)))
+    writer = GroupCommitWriter("group", window_ms=100)
+    path = os.path.join(data_dir, "state.json")
+    written = writer.write(path, lambda: '{"n": 1}')
+    assert not written.done() and not os.path.exists(path)
+    assert written.result(timeout=5) is True
+    assert synced
+    with open(path) as f:
+        assert json.load(f) == {"n": 1}
+
+def test_writes_in_one_window_share_a_flush(data_dir):
+    writer = GroupCommitWriter("group", window_ms=100)
+    path = os.path.join(data_dir, "state.json")
+    state = {"n": 0}
+    futures = []
+    for n in range(1, 6):
+        state["n"] = n
+        futures.append(writer.write(path, lambda: json.dumps(state)))
+    assert all(future.result(timeout=5) for future in futures)
+    assert writer.stats()["flushes_total"] == 1
+    with open(path) as f:
+        assert json.load(f) == {"n": 5}
+
+def test_failed_write_resolves_false(data_dir):
+    writer = GroupCommitWriter("none", window_ms=10)
+    def broken_snapshot():
+        raise ValueError("not serializable")
+    assert writer.write(os.path.join(data_dir, "state.json"), broken_snapshot).result(timeout=5) is False
+
+def test_storage_mutation_returns_once_the_file_is_written(data_dir):
+    from config import USERS_FILE
+    from storage import JSONStorage
+
+    storage = JSONStorage(durability="group", compact_interval=0)
+    results = []
+    threads = [threading.Thread(target=lambda i=i: results.append(storage.add_user(f"u{i}", {"balance": 0})))
+               for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == [True] * 4
+    with open(USERS_FILE) as f:
+        users = json.load(f)
+    assert all(f"u{i}" in users for i in range(4))
@@ -0,0 +1,48 @@
+import multiprocessing
+import threading
+import time
+from utils import IDGenerator
+
+def issue(generator, count, results):
+    results.put([generator.next_id() for _ in range(count)])
+
+def test_ids_are_unique_across_forked_processes():
+    generator = IDGenerator("INV")
+    parent_ids = [generator.next_id() for _ in range(50)]
+    context = multiprocessing.get_context("fork")
+    results = context.Queue()
+    processes = [context.Process(target=issue, args=(generator, 500, results)) for _ in range(4)]
+    for process in processes:
+        process.start()
+    ids = parent_ids + [generator.next_id() for _ in range(500)]
+    for _ in processes:
+        ids.extend(results.get(timeout=30))
+    for process in processes:
+        process.join()
+    assert len(ids) == len(set(ids)) == 50 + 5 * 500
+
+def test_ids_sort_in_issue_order_and_use_utc():
+    generator = IDGenerator("REQ")
+    ids = [generator.next_id() for _ in range(2000)]
+    assert ids == sorted(ids)
+    assert all(part.isalnum() for part in ids[0].split("-"))
+    stamp = ids[0].split("-")[1]
+    assert abs(time.mktime(time.strptime(stamp, "%Y%m%d%H%M%S")) - time.mktime(time.gmtime())) < 5
+
+def test_worker_id_replaces_the_nonce():
+    assert IDGenerator("INV", worker_id=3).next_id().endswith("-3")
+
+def test_request_ids_fit_in_recharge_callback_data():
+    request_id = IDGenerator("REQ").next_id()
+    assert len(f"approve_recharge_{10 ** 10 - 1}_{request_id}_{9999999}".encode()) <= 64
+
+def test_ids_are_unique_across_threads():
+    generator = IDGenerator("INV")
+    ids = []
+    threads = [threading.Thread(target=lambda: ids.extend(generator.next_id() for _ in range(2000)))
+               for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(set(ids)) == 8 * 2000
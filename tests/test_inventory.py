@@ -0,0 +1,48 @@
+import os
+from inventory import CodeInventory
+
+def open_inventory(data_dir):
+    return CodeInventory(os.path.join(data_dir, "inventory"))
+
+def test_take_is_idempotent(data_dir):
+    inventory = open_inventory(data_dir)
+    inventory.add("p", ["A", "B", "C"])
+    code, offset = inventory.peek("p")
+    assert code == "A"
+    assert inventory.take("p", "A", offset)
+    # A replayed purchase takes nothing more
+    assert inventory.take("p", "A", offset)
+    assert inventory.count("p") == 2 and inventory.peek("p")[0] == "B"
+    # Not the head of the queue: an older offset, or a different code at the next one
+    assert not inventory.take("p", "A", 0)
+    assert not inventory.take("p", "C", inventory.peek("p")[1])
+    assert list(inventory.remaining("p")) == ["B", "C"]
+
+def test_restart_resumes_from_the_taken_log(data_dir):
+    inventory = open_inventory(data_dir)
+    inventory.add("p/1", ["A", "كود-ب", "C"])
+    assert inventory.pop("p/1") == "A"
+    assert inventory.pop("p/1") == "كود-ب"
+    restarted = open_inventory(data_dir)
+    assert restarted.count("p/1") == 1 and restarted.pop("p/1") == "C"
+    assert open_inventory(data_dir).count("p/1") == 0
+
+def test_torn_taken_line_is_ignored(data_dir):
+    inventory = open_inventory(data_dir)
+    inventory.add("p", ["A", "B", "C"])
+    inventory.pop("p")
+    _, taken_path = inventory._paths("p")
+    with open(taken_path, "a") as f:
+        f.write("1")  # crash while appending the next offset
+    restarted = open_inventory(data_dir)
+    assert restarted.count("p") == 2 and restarted.pop("p") == "B"
+    assert open_inventory(data_dir).peek("p")[0] == "C"
+
+def test_restocking_a_sold_out_product_starts_new_files(data_dir):
+    inventory = open_inventory(data_dir)
+    inventory.add("p", ["A"])
+    inventory.pop("p")
+    assert inventory.add("p", ["B"]) == 1
+    codes_path, taken_path = inventory._paths("p")
+    assert os.path.getsize(taken_path) == 0 and os.path.getsize(codes_path) == len(b'"B"\n')
+    assert open_inventory(data_dir).pop("p") == "B"
@@ -0,0 +1,40 @@
+import os
+import time
+from invoice_archive import InvoiceArchive
+
+def open_archive(data_dir, max_bytes=1024 * 1024):
+    return InvoiceArchive(os.path.join(data_dir, "invoices"), max_bytes=max_bytes, retention_interval=0)
+
+def blobs(archive):
+    return sorted(name for _, _, files in os.walk(archive.directory) for name in files if name.endswith(".pdf"))
+
+def test_identical_pdfs_are_stored_and_counted_once(data_dir):
+    archive = open_archive(data_dir)
+    pdf = b"%PDF-1.4 same content"
+    first = archive.store("INV-1", "10", pdf)
+    second = archive.store("INV-2", "11", pdf)
+    assert first == second
+    assert len(blobs(archive)) == 1
+    assert archive.read("INV-1") == archive.read("INV-2") == pdf
+    assert archive.get("INV-2")["user_id"] == "11"
+    assert archive.stats() == {"invoices": 2, "bytes": len(pdf), "max_bytes": 1024 * 1024}
+
+def test_corrupt_blob_is_not_served(data_dir):
+    archive = open_archive(data_dir)
+    sha256 = archive.store("INV-1", "10", b"%PDF-1.4 original")
+    with open(archive._blob_path(sha256), "wb") as f:
+        f.write(b"%PDF-1.4 damaged")
+    assert archive.read("INV-1") is None
+
+def test_retention_drops_the_oldest_invoices_and_their_files(data_dir):
+    archive = open_archive(data_dir, max_bytes=250)
+    for n in range(5):
+        archive.store(f"INV-{n}", "10", bytes([n]) * 100)
+        time.sleep(0.01)
+    archive.store("INV-copy-of-4", "10", bytes([4]) * 100)
+    archive.enforce_retention()
+    assert [archive.get(f"INV-{n}") is not None for n in range(5)] == [False, False, False, True, True]
+    assert archive.get("INV-copy-of-4") is not None
+    assert len(blobs(archive)) == 2
+    assert archive.stats()["bytes"] == 200
+    assert archive.read("INV-3") == bytes([3]) * 100
@@ -0,0 +1,85 @@
+import threading
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+from invoice_jobs import InvoiceJobs, start_render_pool
+from invoice_worker import render_invoice
+from utils import percentile
+
+SALE = {"invoice_id": "INV-TEST-0001", "product_name": "Test product", "price": 5000,
+        "code": "TEST-CODE", "timestamp": "2024-01-01T12:00:00"}
+USER = {"user_id": 42, "name": "Test customer"}
+
+class FakeOutbound:
+    def __init__(self):
+        self.calls = []
+        self.sent = threading.Event()
+
+    def submit(self, method, *args, **kwargs):
+        self.calls.append((method, args))
+        self.sent.set()
+        future = Future()
+        future.set_result(None)
+        return future
+
+class BrokenPool:
+    """Every job dies with the pool; the callbacks run in the thread that breaks it"""
+
+    def __init__(self):
+        self.futures = []
+
+    def submit(self, fn, *args):
+        future = Future()
+        self.futures.append(future)
+        return future
+
+    def break_pool(self):
+        for future in self.futures:
+            future.set_exception(BrokenProcessPool("a render process died"))
+
+    def shutdown(self, wait=True):
+        pass
+
+class RenderingPool:
+    def submit(self, fn, *args):
+        future = Future()
+        future.set_result((b"%PDF-1.4", 0.01))
+        return future
+
+    def shutdown(self, wait=True):
+        pass
+
+def test_broken_pool_is_replaced_off_its_callback_thread():
+    broken = BrokenPool()
+    factory_threads = []
+
+    def pool_factory():
+        factory_threads.append(threading.current_thread())
+        return RenderingPool()
+
+    outbound = FakeOutbound()
+    jobs = InvoiceJobs(outbound, broken, pool_factory=pool_factory)
+    assert jobs.submit(7, SALE, USER)
+    broken.break_pool()
+    assert outbound.sent.wait(10)
+    assert factory_threads and factory_threads[0] is not threading.current_thread()
+    assert outbound.calls == [("send_document", (7, b"%PDF-1.4"))]
+    stats = jobs.stats()
+    assert stats["pool_restarts"] == 1 and stats["rendered"] == 1 and stats["backlog"] == 0
+
+def test_render_pool_renders_in_a_forkserver_process():
+    pool = start_render_pool(processes=1)
+    try:
+        pdf, seconds = pool.submit(render_invoice, SALE, USER).result(timeout=60)
+    finally:
+        pool.shutdown()
+    assert pdf.startswith(b"%PDF") and seconds > 0
+
+def test_percentile_is_nearest_rank():
+    samples = list(range(1, 101))
+    assert percentile(samples, 50) == 50
+    assert percentile(samples, 7) == 7
+    assert percentile(samples, 99) == 99
+    assert percentile([1, 2, 3], 50) == 2
+    assert percentile([1, 2, 3, 4], 60) == 3
+    assert percentile([5], 0) == 5
+    assert percentile([], 99) == 0.0
@@ -0,0 +1,24 @@
+import pytest
+from benchmark import arabic_name
+from pdf_generator_new import FastInvoiceRenderer, pdf_text, register_arabic_font, shape_text, ARABIC_FONT
+
+SALE = {"invoice_id": "INV-1", "product_name": "بطاقة شحن", "price": 5000, "code": "CODE-1"}
+
+def test_latin_text_keeps_its_font():
+    assert pdf_text("Card 10$", "Helvetica") == ("Card 10$", "Helvetica")
+
+def test_shaped_text_is_cached():
+    pytest.importorskip("arabic_reshaper")
+    shape_text.cache_clear()
+    shape_text("متجر")
+    shape_text("متجر")
+    assert shape_text.cache_info().hits == 1
+
+def test_new_arabic_names_render_on_the_fast_path():
+    if not register_arabic_font():
+        pytest.skip("INVOICE_FONT_FILE is not installed")
+    renderer = FastInvoiceRenderer()
+    assert pdf_text(arabic_name(0), "Helvetica")[1] == ARABIC_FONT
+    for index in range(3):
+        pdf = renderer.render(SALE, {"user_id": 1, "name": arabic_name(index)}).getvalue()
+        assert pdf.startswith(b"%PDF") and b"/FontFile2" in pdf
@@ -0,0 +1,43 @@
+import json
+from database import DatabaseManager
+from keyboards import BACK, MAIN_MENU, RECHARGE_MENU, CatalogView, render_store
+from config import RECHARGE_AMOUNTS
+
+def callbacks(markup):
+    return [button.get("callback_data") for row in json.loads(markup)["inline_keyboard"] for button in row]
+
+def test_static_keyboards_are_serialized_once():
+    assert isinstance(MAIN_MENU, str)
+    assert callbacks(MAIN_MENU)[:3] == ["store", "recharge", "history"]
+    assert callbacks(RECHARGE_MENU) == [f"recharge_{amount}" for amount in RECHARGE_AMOUNTS] + ["back"]
+
+def test_catalog_view_renders_again_only_after_a_catalog_change(open_storage):
+    db = DatabaseManager(open_storage())
+    renders = []
+
+    def render(products):
+        renders.append(products)
+        return render_store(products)
+
+    view = CatalogView(db, render)
+    text, markup = view.get()
+    assert view.get() == (text, markup) and len(renders) == 1
+    assert "product_vpn_1month" in callbacks(markup)
+
+    db.update_product("vpn_1month", {"active": False})
+    text, markup = view.get()
+    assert len(renders) == 2 and "product_vpn_1month" not in callbacks(markup)
+
+    for product_id in list(db.get_products()):
+        db.update_product(product_id, {"active": False})
+    assert view.get()[1] == BACK
+
+def test_sold_out_product_leaves_the_cached_store(open_storage):
+    db = DatabaseManager(open_storage())
+    db.create_user("1", "buyer")
+    db.update_user_balance("1", 100000)
+    view = CatalogView(db, render_store)
+    assert "product_spotify_premium" in callbacks(view.get()[1])
+    for _ in range(2):
+        assert db.process_purchase("1", "spotify_premium")["success"]
+    assert "product_spotify_premium" not in callbacks(view.get()[1])
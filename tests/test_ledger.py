@@ -0,0 +1,46 @@
+import json
+import os
+from ledger import SalesLedger
+
+def sale(invoice_id, date):
+    return {"product": "p", "code": "c", "price": 10, "date": date, "invoice_id": invoice_id}
+
+def test_torn_index_line_is_truncated(tmp_path):
+    ledger = SalesLedger(str(tmp_path))
+    ledger.append("1", sale("INV-1", "2024-01-05"))
+    index_path = os.path.join(str(tmp_path), SalesLedger.INDEX_FILE)
+    with open(index_path, "a", encoding="utf-8") as f:
+        f.write("2\t2024-0")  # crash while appending the index
+
+    ledger = SalesLedger(str(tmp_path))
+    assert ledger.sale_count() == 1
+    ledger.append("2", sale("INV-2", "2024-01-06"))
+    with open(index_path, encoding="utf-8") as f:
+        assert [line.split("\t")[0] for line in f] == ["1", "2"]
+    ledger = SalesLedger(str(tmp_path))
+    assert [record["invoice_id"] for record in ledger.get_user_sales("2")] == ["INV-2"]
+
+def test_records_missing_from_the_index_are_recovered_in_every_partition(tmp_path):
+    ledger = SalesLedger(str(tmp_path))
+    ledger.append("1", sale("INV-1", "2024-01-05"))
+    ledger.append("1", sale("INV-2", "2024-02-05"))
+    # A sale reached the older partition but not the index
+    record = dict(sale("INV-3", "2024-01-20"), user_id="1")
+    with open(os.path.join(str(tmp_path), "2024-01.jsonl"), "a", encoding="utf-8") as f:
+        f.write(json.dumps(record) + "\n")
+
+    ledger = SalesLedger(str(tmp_path))
+    assert ledger.sale_count() == 3
+    assert [record["invoice_id"] for record in ledger.get_user_sales("1")] == ["INV-1", "INV-3", "INV-2"]
+    assert SalesLedger(str(tmp_path)).sale_count() == 3  # recovered once
+
+def test_half_written_record_is_dropped(tmp_path):
+    ledger = SalesLedger(str(tmp_path))
+    ledger.append("1", sale("INV-1", "2024-01-05"))
+    with open(os.path.join(str(tmp_path), "2024-01.jsonl"), "a", encoding="utf-8") as f:
+        f.write('{"product": "p", "co')
+
+    ledger = SalesLedger(str(tmp_path))
+    ledger.append("1", sale("INV-2", "2024-01-06"))
+    assert [record["invoice_id"] for record in ledger.get_user_sales("1")] == ["INV-1", "INV-2"]
+    assert ledger.invoice_ids_since("1", "2024-01-06") == {"INV-2"}
@@ -0,0 +1,87 @@
+import asyncio
+import os
+import pytest
+from types import SimpleNamespace
+from media_cache import MediaCache
+
+URL = "https://example.com/vpn.jpg"
+
+class ApiError(Exception):
+    def __init__(self, error_code):
+        super().__init__(f"error {error_code}")
+        self.error_code = error_code
+
+class FakeBot:
+    """Telegram stand-in: a URL upload returns a new file_id, known file_ids are accepted"""
+
+    def __init__(self):
+        self.sent = []
+        self.file_ids = set()
+        self.error = None
+
+    def send_photo(self, chat_id, photo, **kwargs):
+        self.sent.append(photo)
+        if photo.startswith("https://"):
+            file_id = f"file-{len(self.sent)}"
+            self.file_ids.add(file_id)
+            sizes = [SimpleNamespace(file_id=f"{file_id}-small"), SimpleNamespace(file_id=file_id)]
+            return SimpleNamespace(photo=sizes, message_id=len(self.sent))
+        if self.error is not None or photo not in self.file_ids:
+            raise self.error or ApiError(400)
+        return SimpleNamespace(photo=None, message_id=len(self.sent))
+
+    def delete_message(self, chat_id, message_id, **kwargs):
+        pass
+
+class AsyncBot:
+    def __init__(self, bot):
+        self.bot = bot
+
+    async def send_photo(self, *args, **kwargs):
+        return self.bot.send_photo(*args, **kwargs)
+
+def test_url_is_uploaded_once_and_remembered(data_dir):
+    path = os.path.join(data_dir, "media_cache.json")
+    bot = FakeBot()
+    cache = MediaCache(bot, path)
+    cache.send_photo(1, URL, caption="VPN")
+    cache.send_photo(2, URL, caption="VPN")
+    assert bot.sent == [URL, "file-1"]
+    assert cache.stats() == {"entries": 1, "hits": 1, "misses": 1}
+    MediaCache(bot, path).send_photo(3, URL)
+    assert bot.sent[-1] == "file-1"
+
+def test_rejected_file_id_falls_back_to_the_url(data_dir):
+    bot = FakeBot()
+    cache = MediaCache(bot, os.path.join(data_dir, "media_cache.json"))
+    cache.send_photo(1, URL)
+    bot.file_ids.clear()
+    cache.send_photo(1, URL)
+    cache.send_photo(1, URL)
+    assert bot.sent == [URL, "file-1", URL, "file-3"]
+
+def test_other_errors_are_not_swallowed(data_dir):
+    bot = FakeBot()
+    cache = MediaCache(bot, os.path.join(data_dir, "media_cache.json"))
+    cache.send_photo(1, URL)
+    bot.error = ApiError(429)
+    with pytest.raises(ApiError):
+        cache.send_photo(1, URL)
+    assert cache.stats()["entries"] == 1
+
+def test_replaced_product_image_is_forgotten(data_dir):
+    bot = FakeBot()
+    cache = MediaCache(bot, os.path.join(data_dir, "media_cache.json"))
+    assert cache.warm_up([URL, URL, None], chat_id=99) == 1
+    cache.on_product_change("vpn", {"image": URL}, {"image": URL})
+    assert cache.stats()["entries"] == 1
+    cache.on_product_change("vpn", {"image": URL}, {"image": "https://example.com/new.jpg"})
+    assert cache.stats()["entries"] == 0
+    assert MediaCache(bot, cache.path).stats()["entries"] == 0
+
+def test_async_send_uses_the_same_cache(data_dir):
+    bot = FakeBot()
+    cache = MediaCache(bot, os.path.join(data_dir, "media_cache.json"))
+    cache.send_photo(1, URL)
+    asyncio.run(cache.send_photo_async(AsyncBot(bot), 2, URL))
+    assert bot.sent == [URL, "file-1"]
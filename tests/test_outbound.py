@@ -0,0 +1,73 @@
+import threading
+import time
+import pytest
+from outbound import OutboundQueue
+
+class ApiError(Exception):
+    def __init__(self, error_code, retry_after=None):
+        super().__init__(f"error {error_code}")
+        self.error_code = error_code
+        self.result_json = {"parameters": {"retry_after": retry_after}} if retry_after is not None else {}
+
+class FakeBot:
+    """Records each call; ``errors`` lists what the next calls of a method raise"""
+
+    def __init__(self, **errors):
+        self.errors = {method: list(queued) for method, queued in errors.items()}
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def __getattr__(self, method):
+        def call(chat_id, *args, **kwargs):
+            with self._lock:
+                self.calls.append((method, chat_id, time.monotonic()))
+                queued = self.errors.get(method)
+                if queued:
+                    raise queued.pop(0)
+            return (method, chat_id) + args
+        return call
+
+def open_queue(bot, **limits):
+    options = dict(global_rate=1000, per_chat_rate=1000, per_chat_burst=1000, senders=2, max_retries=3)
+    options.update(limits)
+    return OutboundQueue(bot, **options)
+
+def test_flood_wait_pauses_the_chat_for_retry_after():
+    bot = FakeBot(send_message=[ApiError(429, retry_after=0.3)])
+    outbound = open_queue(bot)
+    assert outbound.call("send_message", 1, "hi") == ("send_message", 1, "hi")
+    first, second = bot.calls
+    assert second[2] - first[2] >= 0.3
+    stats = outbound.stats()
+    assert stats["flood_waits"] == 1 and stats["retried"] == 1 and stats["sent"] == 1
+
+def test_server_errors_are_retried_only_for_idempotent_calls():
+    bot = FakeBot(send_message=[ApiError(502)], edit_message_reply_markup=[ApiError(502)])
+    outbound = open_queue(bot)
+    with pytest.raises(ApiError):
+        outbound.call("send_message", 1, "hi")
+    assert outbound.call("edit_message_reply_markup", 1, 10) == ("edit_message_reply_markup", 1, 10)
+    assert [call[0] for call in bot.calls] == ["send_message", "edit_message_reply_markup",
+                                               "edit_message_reply_markup"]
+    stats = outbound.stats()
+    assert stats["failed"] == 1 and stats["retried"] == 1 and stats["sent"] == 1
+
+def test_connect_errors_are_retried_for_sends():
+    bot = FakeBot(send_message=[ConnectionRefusedError()])
+    outbound = open_queue(bot)
+    assert outbound.call("send_message", 1, "hi") == ("send_message", 1, "hi")
+    assert len(bot.calls) == 2
+
+def test_each_chat_has_its_own_bucket():
+    bot = FakeBot()
+    outbound = open_queue(bot, per_chat_rate=2, per_chat_burst=1)
+    futures = [outbound.submit("send_message", 1, n) for n in range(3)]
+    futures.append(outbound.submit("send_message", 2, 0))
+    assert [future.result(timeout=10) for future in futures] == [
+        ("send_message", 1, 0), ("send_message", 1, 1), ("send_message", 1, 2), ("send_message", 2, 0)]
+    times = {}
+    for _, chat_id, at in bot.calls:
+        times.setdefault(chat_id, []).append(at)
+    # chat 1 is held to 2 per second, in order; chat 2 does not wait behind it
+    assert times[1][1] - times[1][0] >= 0.4 and times[1][2] - times[1][1] >= 0.4
+    assert times[2][0] < times[1][1]
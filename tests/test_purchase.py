@@ -0,0 +1,128 @@
+import os
+import threading
+from storage import JSONStorage, SQLiteStorage
+
+def setup_store(storage, codes=("A", "B", "C")):
+    storage.add_user("1", {"name": "buyer", "balance": 100})
+    storage.add_product("p", {"name": "Card", "price": 30, "codes": list(codes)})
+
+def test_purchase_charges_takes_code_and_records_sale(open_storage):
+    storage = open_storage()
+    setup_store(storage)
+    result = storage.purchase("1", "p", "INV-1", "2024-01-05 10:00:00")
+    assert result["status"] == "ok" and result["code"] == "A" and result["balance"] == 70
+    assert storage.get_product("p")["stock"] == 2
+    assert [record["code"] for record in storage.get_user_sales("1")] == ["A"]
+    assert storage.get_sales_stats()["total_sales"] == 1
+
+def test_failed_journal_write_changes_nothing(open_storage, monkeypatch):
+    storage = open_storage()
+    setup_store(storage)
+
+    def fail(*args, **kwargs):
+        raise OSError("disk full")
+    monkeypatch.setattr(storage.wal, "append", fail)
+    assert storage.purchase("1", "p", "INV-1", "2024-01-05 10:00:00")["status"] == "write_failed"
+    assert storage.get_user("1")["balance"] == 100
+    assert storage.get_product("p")["stock"] == 3
+    assert storage.get_user_sales("1") == []
+
+def test_interrupted_purchase_is_completed_on_restart(open_storage, monkeypatch):
+    storage = open_storage()
+    setup_store(storage)
+    # Crash right after the journal entry is written
+    monkeypatch.setattr(JSONStorage, "_record_purchases", lambda self, entries, known_new=False: [])
+    assert storage.purchase("1", "p", "INV-1", "2024-01-05 10:00:00")["status"] == "ok"
+    assert storage.get_product("p")["stock"] == 3
+    monkeypatch.undo()
+
+    restarted = open_storage()
+    assert restarted.get_user("1")["balance"] == 70
+    assert restarted.get_product("p")["stock"] == 2
+    assert [record["invoice_id"] for record in restarted.get_user_sales("1")] == ["INV-1"]
+    assert restarted.get_sales_stats()["total_sales"] == 1
+    assert restarted.purchase("1", "p", "INV-2", "2024-01-05 10:01:00")["code"] == "B"
+
+def test_unrecorded_sale_is_recorded_once(open_storage, monkeypatch):
+    storage = open_storage()
+    setup_store(storage)
+    monkeypatch.setattr(storage.ledger, "append", lambda user_id, record: False)
+    assert storage.purchase("1", "p", "INV-1", "2024-01-05 10:00:00")["status"] == "ok"
+    assert storage.compact_wal() == 0  # the journal entry stays until its sale is recorded
+
+    for _ in range(2):
+        restarted = open_storage()
+        assert [record["invoice_id"] for record in restarted.get_user_sales("1")] == ["INV-1"]
+        assert restarted.get_sales_stats()["total_sales"] == 1
+        assert restarted.get_product("p")["stock"] == 2
+        assert restarted.get_user("1")["balance"] == 70
+    assert restarted.compact_wal() > 0
+    assert open_storage().get_user_sales("1")[0]["code"] == "A"
+
+def test_purchases_of_different_products_run_in_parallel(open_storage, monkeypatch):
+    storage = open_storage()
+    setup_store(storage)
+    storage.add_product("q", {"name": "Other", "price": 10, "codes": ["Q1"]})
+    recording, release = threading.Event(), threading.Event()
+    take = storage.inventory.take
+
+    def slow_take(product_id, code, offset):
+        if code == "A":
+            recording.set()
+            release.wait(10)
+        return take(product_id, code, offset)
+    monkeypatch.setattr(storage.inventory, "take", slow_take)
+    results = []
+    slow = threading.Thread(target=lambda: results.append(storage.purchase("1", "p", "INV-1", "2024-01-05 10:00:00")))
+    slow.start()
+    assert recording.wait(10)
+
+    # "p" is still taking its code: "q" goes through, a second "p" waits
+    assert storage.purchase("1", "q", "INV-2", "2024-01-05 10:00:01")["code"] == "Q1"
+    queued = threading.Thread(target=lambda: results.append(storage.purchase("1", "p", "INV-3", "2024-01-05 10:00:02")))
+    queued.start()
+    queued.join(0.2)
+    assert queued.is_alive()
+    release.set()
+    slow.join(10)
+    queued.join(10)
+    assert [result["code"] for result in results] == ["A", "B"]
+    assert storage.get_user("1")["balance"] == 100 - 30 - 10 - 30
+
+def test_sqlite_purchase_waits_only_for_its_own_product(data_dir):
+    storage = SQLiteStorage(os.path.join(data_dir, "store.db"))
+    setup_store(storage)
+    storage.add_product("q", {"name": "Other", "price": 10, "codes": ["Q1"]})
+    result = []
+    with storage._product_locks.get("p"):
+        assert storage.purchase("1", "q", "INV-1", "2024-01-05 10:00:00")["code"] == "Q1"
+        queued = threading.Thread(target=lambda: result.append(storage.purchase("1", "p", "INV-2", "2024-01-05 10:00:01")))
+        queued.start()
+        queued.join(0.2)
+        assert queued.is_alive()
+    queued.join(10)
+    assert result[0]["code"] == "A" and result[0]["balance"] == 60
+
+def test_sqlite_purchase_retries_a_code_sold_by_another_process(data_dir):
+    path = os.path.join(data_dir, "store.db")
+    storage = SQLiteStorage(path)
+    setup_store(storage)
+    other = SQLiteStorage(path)
+    execute = storage._conn().execute
+    raced = []
+
+    class RacingConnection:
+        """Lets the other process sell the first code between the read and the write"""
+        def execute(self, sql, params=()):
+            if sql == "BEGIN IMMEDIATE" and not raced:
+                raced.append(other.pop_product_code("p"))
+            return execute(sql, params)
+
+        def __getattr__(self, name):
+            return getattr(storage._local.conn, name)
+    connection = RacingConnection()
+    storage._conn = lambda: connection
+    result = storage.purchase("1", "p", "INV-1", "2024-01-05 10:00:00")
+    assert raced == ["A"] and result["code"] == "B"
+    assert storage.get_product("p")["stock"] == 1
+    assert [sale["code"] for sale in storage.get_user_sales("1")] == ["B"]
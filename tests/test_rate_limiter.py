@@ -0,0 +1,48 @@
+import os
+import threading
+import time
+import pytest
+from rate_limiter import RateLimiter, SQLiteRateLimiter, TokenBuckets
+
+@pytest.fixture(params=["memory", "sqlite"])
+def make_limiter(request, data_dir):
+    def make_limiter(min_interval=0.0, per_minute=1000, **options):
+        buckets = TokenBuckets(min_interval=min_interval, per_minute=per_minute)
+        if request.param == "memory":
+            return RateLimiter(buckets, **options)
+        return SQLiteRateLimiter(os.path.join(data_dir, "rate_limits.db"), buckets)
+    return make_limiter
+
+def test_minimum_interval_between_actions(make_limiter):
+    limiter = make_limiter(min_interval=0.2)
+    assert limiter.allow("1")
+    assert not limiter.allow("1")
+    assert limiter.allow("2")
+    time.sleep(0.25)
+    assert limiter.allow("1")
+
+def test_per_minute_cap(make_limiter):
+    limiter = make_limiter(per_minute=5)
+    assert [limiter.allow("1") for _ in range(7)] == [True] * 5 + [False] * 2
+    assert limiter.allow("2")
+
+def test_concurrent_checks_never_exceed_the_cap(make_limiter):
+    limiter = make_limiter(per_minute=10)  # refills one token every 6 seconds
+    results = []
+
+    def check():
+        for _ in range(20):
+            results.append(limiter.allow("1"))
+
+    threads = [threading.Thread(target=check) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results.count(True) == 10
+
+def test_memory_table_is_bounded():
+    limiter = RateLimiter(TokenBuckets(min_interval=0.0, per_minute=10), max_entries=100)
+    for n in range(1000):
+        limiter.allow(str(n))
+    assert len(limiter) <= 100
@@ -0,0 +1,35 @@
+from datetime import date, timedelta
+from pdf_generator_new import PDFInvoiceGenerator, SalesReport
+
+def sales(days, per_day=5):
+    """A one-pass stream of sales, like db.iter_sales()"""
+    first = date(2024, 1, 1)
+    for day in range(days):
+        for n in range(per_day):
+            yield str(n % 3), {"product": f"Card {n}", "price": 1000 * (n + 1),
+                               "date": f"{first + timedelta(days=day)}T10:00:00"}
+
+def test_report_keeps_totals_not_sales():
+    report = SalesReport()
+    for user_id, sale in sales(days=400):
+        report.add(user_id, sale)
+    assert report.count == 2000 and report.revenue == 400 * 15000
+    assert report.customers == {"0", "1", "2"}
+    assert len(report.days) == 400 and report.days["2024-02-29"] == {"count": 5, "revenue": 15000}
+    assert report.products["Card 4"] == {"count": 400, "revenue": 400 * 5000}
+
+def test_long_report_is_rendered_from_a_stream_across_pages():
+    pdf = PDFInvoiceGenerator().create_sales_report(sales(days=400), "2024-01-01 - 2025-02-04").getvalue()
+    assert pdf.startswith(b"%PDF")
+    assert pdf.count(b"/Type /Page\n") > 5
+
+def test_report_of_a_date_range(open_storage):
+    storage = open_storage()
+    storage.add_user("1", {"name": "buyer", "balance": 100})
+    storage.add_product("p", {"name": "Card", "price": 10, "codes": ["A", "B", "C"]})
+    for invoice, day in enumerate(("2024-01-31 23:00:00", "2024-02-01 09:00:00", "2024-03-01 00:00:00")):
+        assert storage.purchase("1", "p", f"INV-{invoice}", day)["status"] == "ok"
+    report = SalesReport()
+    for user_id, sale in storage.iter_sales("2024-02-01", "2024-03-01"):
+        report.add(user_id, sale)
+    assert report.count == 1 and list(report.days) == ["2024-02-01"]
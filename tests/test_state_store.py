@@ -0,0 +1,46 @@
+import os
+import threading
+import time
+import pytest
+from state_store import StateStore, SQLiteStateStore
+
+@pytest.fixture(params=["memory", "sqlite"])
+def make_store(request, data_dir):
+    def make_store(ttl=60):
+        if request.param == "memory":
+            return StateStore(ttl=ttl)
+        return SQLiteStateStore(os.path.join(data_dir, "states.db"), ttl=ttl)
+    return make_store
+
+def test_states_expire_after_ttl(make_store):
+    store = make_store(ttl=0.2)
+    store.set("1", {"state": "waiting_receipt", "amount": 5000})
+    assert store.get("1") == {"state": "waiting_receipt", "amount": 5000}
+    time.sleep(0.3)
+    assert store.get("1") is None
+    assert store.update("1", state="waiting_date") is False
+    assert store.get("1") is None
+
+def test_update_restarts_ttl(make_store):
+    store = make_store(ttl=0.4)
+    store.set("1", {"state": "waiting_receipt"})
+    time.sleep(0.25)
+    assert store.update("1", state="waiting_date")
+    time.sleep(0.25)
+    assert store.get("1") == {"state": "waiting_date"}
+
+def test_concurrent_updates_are_not_lost(make_store):
+    store = make_store()
+    store.set("1", {"state": "waiting_receipt"})
+
+    def worker(index):
+        for n in range(20):
+            assert store.update("1", **{f"field_{index}": n})
+
+    threads = [threading.Thread(target=worker, args=(index,)) for index in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    state = store.get("1")
+    assert state == dict({"state": "waiting_receipt"}, **{f"field_{index}": 19 for index in range(8)})
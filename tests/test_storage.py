@@ -0,0 +1,34 @@
+import os
+from config import USERS_FILE
+from database import DatabaseManager
+
+def test_reads_are_served_from_memory(open_storage, monkeypatch):
+    db = DatabaseManager(open_storage())
+    db.create_user("1", "buyer")
+
+    def no_disk(*args, **kwargs):
+        raise AssertionError("read went to disk")
+    monkeypatch.setattr("builtins.open", no_disk)
+    assert db.get_user("1")["name"] == "buyer"
+    assert db.is_user_pending("1")
+    assert "vpn_1month" in db.get_products()
+    assert db.get_user_purchases("1") == []
+
+def test_mutations_write_through(open_storage):
+    db = DatabaseManager(open_storage())
+    db.create_user("1", "buyer")
+    db.approve_user("1")
+    db.update_product("vpn_1month", {"price": 6000})
+    assert os.path.exists(USERS_FILE)
+
+    restarted = DatabaseManager(open_storage())
+    assert restarted.is_user_pending("1") is False
+    assert restarted.get_product("vpn_1month")["price"] == 6000
+
+def test_returned_records_are_copies(open_storage):
+    db = DatabaseManager(open_storage())
+    db.create_user("1", "buyer")
+    db.get_user("1")["balance"] = 10 ** 6
+    db.get_product("vpn_1month")["price"] = 1
+    assert db.get_user("1")["balance"] == 0
+    assert db.get_product("vpn_1month")["price"] == 5000
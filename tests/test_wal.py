@@ -0,0 +1,87 @@
+import json
+import os
+from concurrent.futures import Future
+from wal import BalanceWAL
+
+def read_seqs(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line)["seq"] for line in f]
+
+def test_replay_applies_only_entries_after_the_snapshot(tmp_path):
+    wal = BalanceWAL(str(tmp_path))
+    wal.append("1", 100, "recharge")
+    wal.append("1", -30, "purchase", "INV-1", purchases=1)
+    users = {BalanceWAL.SNAPSHOT_KEY: 1, "1": {"balance": 100}}
+    assert BalanceWAL(str(tmp_path)).replay(users) == 1
+    assert users == {"1": {"balance": 70, "total_spent": 30, "purchase_count": 1}}
+
+def test_replay_stops_at_a_torn_entry(tmp_path):
+    wal = BalanceWAL(str(tmp_path))
+    wal.append("1", 100, "recharge")
+    wal.close()
+    with open(wal.path, "a", encoding="utf-8") as f:
+        f.write('{"seq": 2, "user_id": "1", "del')
+    users = {"1": {"balance": 0}}
+    assert BalanceWAL(str(tmp_path)).replay(users) == 1
+    assert users["1"]["balance"] == 100
+
+def test_replay_creates_users_missing_from_the_snapshot(tmp_path):
+    wal = BalanceWAL(str(tmp_path))
+    wal.append("2", 50, "recharge", extra={"user": {"name": "new", "balance": 0}})
+    wal.append("2", 5, "recharge")
+    users = {}
+    BalanceWAL(str(tmp_path)).replay(users)
+    assert users == {"2": {"name": "new", "balance": 55}}
+
+def test_compaction_archives_only_folded_entries(tmp_path):
+    wal = BalanceWAL(str(tmp_path))
+    for _ in range(3):
+        wal.append("1", 10, "recharge")
+
+    def write_snapshot():
+        wal.append("1", 10, "recharge")  # lands after the snapshot
+        return 3
+    assert wal.compact(write_snapshot, wal._lock) == 3
+    assert read_seqs(os.path.join(str(tmp_path), "segment-3.log")) == [1, 2, 3]
+    assert read_seqs(wal.path) == [4]
+
+    wal.append("1", 10, "recharge")
+    assert wal.compact(lambda: 5, wal._lock) == 2
+    assert read_seqs(os.path.join(str(tmp_path), "segment-5.log")) == [4, 5]
+    assert read_seqs(wal.path) == []
+    assert BalanceWAL(str(tmp_path)).last_seq == 5
+
+def test_compaction_skips_entries_archived_before_a_crash(tmp_path):
+    wal = BalanceWAL(str(tmp_path))
+    for _ in range(3):
+        wal.append("1", 10, "recharge")
+    wal.close()
+    # A compaction wrote its segment, then died before swapping current.log
+    with open(os.path.join(str(tmp_path), "segment-2.log"), "w", encoding="utf-8") as f:
+        f.write("")
+    wal = BalanceWAL(str(tmp_path))
+    assert wal.compact(lambda: 3, wal._lock) == 1
+    assert read_seqs(os.path.join(str(tmp_path), "segment-3.log")) == [3]
+    assert read_seqs(wal.path) == []
+
+def test_new_user_balance_survives_a_crash_before_users_json_is_written(open_storage):
+    storage = open_storage()
+    storage.add_user("1", {"name": "old", "balance": 0})
+    storage.compact_wal()
+    skipped = Future()
+    skipped.set_result(True)
+    storage.writer.write = lambda filename, snapshot: skipped  # users.json is never written again
+    storage.add_user("2", {"name": "new", "balance": 0})
+    assert storage.adjust_user_balance("2", 500)
+
+    restarted = open_storage()
+    assert restarted.get_user("2") == {"name": "new", "balance": 500}
+
+def test_compaction_folds_balances_into_users_json(open_storage):
+    storage = open_storage()
+    storage.add_user("1", {"name": "a", "balance": 0})
+    for _ in range(5):
+        storage.adjust_user_balance("1", 10)
+    assert storage.compact_wal() == 5
+    assert storage.wal.size() == 0
+    assert open_storage().get_user("1")["balance"] == 50
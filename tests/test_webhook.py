@@ -0,0 +1,54 @@
+import queue
+import pytest
+from cluster import raw_update
+from webhook import WebhookServer, fake_update, send_updates
+
+class FakeDispatcher:
+    def __init__(self, full=False):
+        self.depth = 0
+        self.full = full
+
+    def queue_depth(self):
+        return self.depth
+
+    def dispatch(self, updates):
+        if self.full:
+            raise queue.Full
+        self.depth += len(updates)
+
+@pytest.fixture
+def serve():
+    servers = []
+
+    def serve(dispatcher, max_pending, parse=raw_update):
+        server = WebhookServer(dispatcher, "s", host="127.0.0.1", port=0, max_pending=max_pending, parse=parse)
+        server.start()
+        servers.append(server)
+        return f"http://127.0.0.1:{server.port}{server.path}", server
+    yield serve
+    for server in servers:
+        server.shutdown()
+
+def test_backlog_over_max_pending_gets_503(serve):
+    dispatcher = FakeDispatcher()
+    url, server = serve(dispatcher, 3)
+    assert send_updates(url, [fake_update(1, 1), fake_update(2, 2)], "s") == 200
+    assert send_updates(url, [fake_update(3, 3), fake_update(4, 4)], "s") == 503
+    assert send_updates(url, fake_update(5, 5), "s") == 200
+    assert (server.accepted, server.rejected, dispatcher.depth) == (3, 2, 3)
+
+def test_dispatcher_refusal_gets_503(serve):
+    url, server = serve(FakeDispatcher(full=True), 100)
+    assert send_updates(url, fake_update(1, 1), "s") == 503
+    assert server.rejected == 1
+
+def test_wrong_secret_is_refused(serve):
+    url, _ = serve(FakeDispatcher(), 100)
+    assert send_updates(url, fake_update(1, 1), "wrong") == 403
+
+def test_unparseable_update_gets_400(serve):
+    def parse(data):
+        raise AttributeError("broken update")
+    url, _ = serve(FakeDispatcher(), 100, parse=parse)
+    assert send_updates(url, fake_update(1, 1), "s") == 400
+    assert send_updates(url + "x", fake_update(1, 1), "s") == 404
@@ -0,0 +1,166 @@
+import json
+import os
+import threading
+import time
+from typing import Callable, Dict, Iterator, Optional
+from utils import get_current_timestamp, write_text_atomic
+from config import WAL_DIR
+
+class BalanceWAL:
+    """Write-ahead log of balance changes.
+
+    Each change is one JSON line ``{"seq", "user_id", "delta", "reason",
+    "ref", "date"}`` appended to ``current.log``. Purchase entries also
+    carry ``"purchases": 1`` so replay keeps the spending statistics in step,
+    plus the ``product_id``, inventory ``offset`` and ``sale`` record, which
+    makes the entry the journal of the whole purchase. The users snapshot
+    records the last sequence it contains, so startup only replays the tail.
+    The first entries of a user not yet in a snapshot carry the ``user``
+    row, so replay can create them. Compaction archives exactly the folded
+    entries as ``segment-<seq>.log``, which keeps a full audit trail of
+    recharges and purchases.
+
+    With ``fsync`` every append is fsynced; with ``sync_window`` appends are
+    fsynced in batches at most that many seconds after they are written.
+    """
+
+    SNAPSHOT_KEY = "__wal_seq__"
+
+    def __init__(self, directory: str = WAL_DIR, fsync: bool = False, sync_window: float = 0):
+        self.directory = directory
+        self.fsync = fsync
+        self.sync_window = sync_window
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.RLock()
+        self._dirty = threading.Event()
+        self.last_seq = 0
+        self.archived_seq = 0
+        for entry in self.entries():
+            self.last_seq = max(self.last_seq, entry["seq"])
+        for name in os.listdir(directory):
+            if name.startswith("segment-") and name.endswith(".log"):
+                self.archived_seq = max(self.archived_seq, int(name[len("segment-"):-len(".log")]))
+        self.last_seq = max(self.last_seq, self.archived_seq)
+        self._file = open(self.path, "a", encoding="utf-8")
+        if sync_window > 0 and not fsync:
+            threading.Thread(target=self._sync_loop, name="wal-sync", daemon=True).start()
+
+    @property
+    def path(self) -> str:
+        return os.path.join(self.directory, "current.log")
+
+    def entries(self, since_seq: int = 0) -> Iterator[Dict]:
+        """Iterate complete entries with seq > since_seq"""
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                if not line.endswith("\n"):
+                    break  # interrupted append
+                entry = json.loads(line)
+                if entry["seq"] > since_seq:
+                    yield entry
+
+    def append(self, user_id: str, delta: int, reason: str, ref: Optional[str] = None, purchases: int = 0,
+               extra: Optional[Dict] = None) -> Dict:
+        """Append a balance change and return the entry, ``extra`` fields are stored with it"""
+        with self._lock:
+            entry = {
+                "seq": self.last_seq + 1,
+                "user_id": user_id,
+                "delta": delta,
+                "reason": reason,
+                "ref": ref,
+                "date": get_current_timestamp()
+            }
+            if purchases:
+                entry["purchases"] = purchases
+            if extra:
+                entry.update(extra)
+            self._file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            self._file.flush()
+            if self.fsync:
+                os.fsync(self._file.fileno())
+            else:
+                self._dirty.set()
+            self.last_seq = entry["seq"]
+            return entry
+
+    @staticmethod
+    def apply(users: Dict, entry: Dict) -> None:
+        """Apply one entry to a users dict"""
+        user = users.get(entry["user_id"])
+        if user is None:
+            if "user" not in entry:
+                return
+            user = users[entry["user_id"]] = dict(entry["user"])
+        user["balance"] = user.get("balance", 0) + entry["delta"]
+        if entry.get("purchases"):
+            user["total_spent"] = user.get("total_spent", 0) - entry["delta"]
+            user["purchase_count"] = user.get("purchase_count", 0) + entry["purchases"]
+
+    def replay(self, users: Dict) -> int:
+        """Bring a loaded users snapshot up to date, returns replayed entries"""
+        snapshot_seq = users.pop(self.SNAPSHOT_KEY, 0)
+        replayed = 0
+        for entry in self.entries(snapshot_seq):
+            self.apply(users, entry)
+            replayed += 1
+        return replayed
+
+    def size(self) -> int:
+        """Current log size in bytes"""
+        return os.path.getsize(self.path) if os.path.exists(self.path) else 0
+
+    def sync(self) -> None:
+        """Force appended entries to disk"""
+        with self._lock:
+            self._dirty.clear()
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def _sync_loop(self) -> None:
+        while True:
+            self._dirty.wait()
+            time.sleep(self.sync_window)
+            try:
+                self.sync()
+            except (OSError, ValueError) as e:
+                print(f"Error syncing balance log: {e}")
+
+    def compact(self, write_snapshot: Callable[[], Optional[int]], lock: threading.RLock) -> int:
+        """Fold the log into a users snapshot and archive the folded entries.
+
+        ``write_snapshot`` writes the users snapshot and returns a sequence
+        it is known to contain (None on failure). Entries after it move to a
+        fresh log. ``lock`` blocks appends while the log is swapped. Returns
+        the number of entries archived.
+        """
+        snapshot_seq = write_snapshot()
+        if snapshot_seq is None:
+            return 0
+        with lock, self._lock:
+            self._file.flush()
+            folded, tail = [], []
+            for entry in self.entries():
+                if entry["seq"] <= self.archived_seq:
+                    continue  # archived by a compaction interrupted before the swap
+                lines = folded if entry["seq"] <= snapshot_seq else tail
+                lines.append(json.dumps(entry, ensure_ascii=False) + "\n")
+            if not folded:
+                return 0
+            # Archive first, new log second, swap last: a crash at any point
+            # leaves a complete current.log that replays correctly.
+            temp_path = self.path + ".tmp"
+            if not (write_text_atomic(os.path.join(self.directory, f"segment-{snapshot_seq}.log"), "".join(folded))
+                    and write_text_atomic(temp_path, "".join(tail))):
+                return 0
+            self.archived_seq = snapshot_seq
+            self._file.close()
+            os.replace(temp_path, self.path)
+            self._file = open(self.path, "a", encoding="utf-8")
+            return len(folded)
+
+    def close(self) -> None:
+        with self._lock:
+            self._file.close()
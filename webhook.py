@@ -0,0 +1,164 @@
+"""Webhook intake for Telegram updates.
+
+Telegram POSTs updates to WEBHOOK_PATH; each request is checked against the
+secret token and pushed to the update dispatcher. When the dispatcher
+backlog is full the server answers 503 and Telegram redelivers later.
+
+Offline test against a running server:
+    python webhook.py fake --url http://127.0.0.1:8443/telegram --secret s3cret --count 100
+"""
+import argparse
+import hmac
+import json
+import queue
+import threading
+import time
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+MAX_BODY_BYTES = 1 << 20
+
+def parse_update(data: Dict):
+    """Convert a JSON update into a telebot Update"""
+    from telebot.types import Update
+    return Update.de_json(data)
+
+class WebhookServer:
+    """Threaded HTTP endpoint feeding updates into a dispatcher.
+
+    ``dispatcher`` needs ``dispatch(updates)`` and ``queue_depth()``, both
+    counting updates; batches that would push the backlog past
+    ``max_pending``, or that ``dispatch`` refuses with ``queue.Full``, are
+    answered with 503. ``dispatch`` must not block: it runs on the request
+    thread.
+    """
+
+    def __init__(self, dispatcher, secret_token: str, host: str = "0.0.0.0", port: int = 8443,
+                 path: str = "/telegram", max_pending: int = 1000,
+                 parse: Callable[[Dict], object] = parse_update):
+        self.dispatcher = dispatcher
+        self.secret_token = secret_token
+        self.path = path
+        self.max_pending = max_pending
+        self.parse = parse
+        self.accepted = 0
+        self.rejected = 0
+        self._counter_lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer((host, port), self._handler_class())
+        self.httpd.daemon_threads = True
+
+    @property
+    def port(self) -> int:
+        return self.httpd.server_address[1]
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                status = server.handle(self.path, self.headers, self.rfile)
+                self.send_response(status)
+                if status == 503:
+                    self.send_header("Retry-After", "1")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def log_message(self, format, *args):
+                pass  # one line per update would flood the console
+
+        return Handler
+
+    def handle(self, path: str, headers, body) -> int:
+        """Validate one webhook request and queue its updates, returns the HTTP status"""
+        if path != self.path:
+            return 404
+        if not hmac.compare_digest(headers.get(SECRET_HEADER, ""), self.secret_token):
+            return 403
+        length = int(headers.get("Content-Length", 0) or 0)
+        if length <= 0 or length > MAX_BODY_BYTES:
+            return 413 if length > MAX_BODY_BYTES else 400
+        try:
+            payload = json.loads(body.read(length).decode("utf-8"))
+            batch = payload if isinstance(payload, list) else [payload]
+            updates = [self.parse(data) for data in batch]
+        except Exception as e:
+            # Anything else would become a 500 and Telegram would redeliver the update forever
+            print(f"Invalid webhook payload: {e}")
+            return 400
+
+        try:
+            if self.dispatcher.queue_depth() + len(updates) > self.max_pending:
+                raise queue.Full
+            self.dispatcher.dispatch(updates)
+        except queue.Full:
+            with self._counter_lock:
+                self.rejected += len(updates)
+            return 503
+        with self._counter_lock:
+            self.accepted += len(updates)
+        return 200
+
+    def serve_forever(self) -> None:
+        self.httpd.serve_forever()
+
+    def start(self) -> threading.Thread:
+        """Serve in a background thread"""
+        thread = threading.Thread(target=self.serve_forever, name="webhook", daemon=True)
+        thread.start()
+        return thread
+
+    def shutdown(self) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+# Fake sender for offline testing
+def fake_update(update_id: int, user_id: int, text: str = "/start") -> Dict:
+    """Build a minimal private-chat message update"""
+    user = {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"}
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "from": user,
+            "chat": {"id": user_id, "type": "private", "first_name": user["first_name"]},
+            "date": int(time.time()),
+            "text": text
+        }
+    }
+
+def send_updates(url: str, updates, secret_token: Optional[str], timeout: float = 10) -> int:
+    """POST one update or a batch the way Telegram does, returns the HTTP status"""
+    request = urllib.request.Request(url, data=json.dumps(updates).encode("utf-8"), method="POST",
+                                     headers={"Content-Type": "application/json"})
+    if secret_token is not None:
+        request.add_header(SECRET_HEADER, secret_token)
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    fake = subparsers.add_parser("fake", help="send synthetic updates to a webhook")
+    fake.add_argument("--url", required=True)
+    fake.add_argument("--secret", required=True)
+    fake.add_argument("--count", type=int, default=10)
+    fake.add_argument("--users", type=int, default=5)
+    fake.add_argument("--batch", type=int, default=1)
+    args = parser.parse_args()
+
+    statuses = {}
+    updates: List[Dict] = [fake_update(n + 1, 1000 + n % args.users) for n in range(args.count)]
+    for start in range(0, len(updates), args.batch):
+        batch = updates[start:start + args.batch]
+        status = send_updates(args.url, batch if args.batch > 1 else batch[0], args.secret)
+        statuses[status] = statuses.get(status, 0) + 1
+    print(f"responses: {statuses}")
+
+if __name__ == "__main__":
+    main()